@@ -0,0 +1,142 @@
+"""Streaming upload of recordings to AssemblyAI.
+
+Recordings are sent in chunks straight from where they already are (bytes
+in memory, an open file or a path on disk), so uploading never needs
+another full copy of the audio. Each upload URL is remembered by the
+recording's SHA-256 under .cache/uploads (UPLOAD_CACHE_DIR overrides it),
+so a call reprocessed after a failure or restart skips the upload.
+AssemblyAI's upload endpoint has no partial uploads, so this is as far as
+resuming goes.
+
+With AUDIO_TRANSCODE=opus (or transcode=True) recordings are converted to
+16 kHz mono Opus with ffmpeg before uploading, which is usually a fraction
+of the original size. Without ffmpeg on the PATH the original is sent.
+"""
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+from pathlib import Path
+
+from tiered_cache import TieredCache, content_key
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# AssemblyAI keeps uploaded files for a limited time; stay well inside it
+UPLOAD_URL_TTL = 12 * 3600
+OPUS_BITRATE = '24k'
+
+_upload_cache = TieredCache(
+    disk_dir=os.environ.get('UPLOAD_CACHE_DIR', Path(__file__).parent / '.cache' / 'uploads'),
+    max_entries=512,
+    ttl=UPLOAD_URL_TTL
+)
+
+class UploadBody:
+    """A recording as a restartable iterable of chunks, with a known length.
+
+    Every iteration starts again from the beginning, so a retried request
+    sends the whole recording. source is bytes, a path or a seekable file.
+    """
+
+    def __init__(self, source, chunk_size=UPLOAD_CHUNK_SIZE):
+        self.source = source
+        self.chunk_size = chunk_size
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            self._size = len(source)
+        elif isinstance(source, (str, Path)):
+            self._size = os.path.getsize(source)
+        else:
+            self._start = source.tell()
+            self._size = source.seek(0, os.SEEK_END) - self._start
+            source.seek(self._start)
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        source = self.source
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            view = memoryview(source)
+            for offset in range(0, len(view), self.chunk_size):
+                yield bytes(view[offset:offset + self.chunk_size])
+        elif isinstance(source, (str, Path)):
+            with open(source, 'rb') as f:
+                yield from iter(lambda: f.read(self.chunk_size), b'')
+        else:
+            source.seek(self._start)
+            yield from iter(lambda: source.read(self.chunk_size), b'')
+
+    def sha256(self):
+        digest = hashlib.sha256()
+        for chunk in self:
+            digest.update(chunk)
+        return digest.hexdigest()
+
+def transcode_enabled():
+    return os.environ.get('AUDIO_TRANSCODE', '').lower() == 'opus'
+
+def transcode_to_opus(source):
+    """Path of a temporary 16 kHz mono Opus copy of source, or None without ffmpeg.
+
+    The caller deletes the returned file.
+    """
+    ffmpeg = shutil.which('ffmpeg')
+    if not ffmpeg:
+        return None
+
+    input_path = None
+    if not isinstance(source, (str, Path)):
+        # ffmpeg needs to seek in some containers, so give it a file
+        with tempfile.NamedTemporaryFile(suffix='.audio', delete=False) as f:
+            for chunk in UploadBody(source):
+                f.write(chunk)
+            input_path = f.name
+
+    fd, output_path = tempfile.mkstemp(suffix='.ogg')
+    os.close(fd)
+    try:
+        subprocess.run(
+            [ffmpeg, '-nostdin', '-loglevel', 'error', '-y', '-i', str(input_path or source),
+             '-ac', '1', '-ar', '16000', '-c:a', 'libopus', '-b:a', OPUS_BITRATE, output_path],
+            check=True, timeout=300
+        )
+    except (OSError, subprocess.SubprocessError):
+        os.unlink(output_path)
+        return None
+    finally:
+        if input_path:
+            os.unlink(input_path)
+    return output_path
+
+def upload_audio(client, api_key, source, transcode=None):
+    """Upload a recording with an AssemblyAI client and return its upload URL.
+
+    Raises RuntimeError if the upload is rejected.
+    """
+    body = UploadBody(source)
+    # The URL is only readable with the key that uploaded it
+    cache_key = content_key('upload', api_key, body.sha256())
+    cached = _upload_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    transcoded = transcode_to_opus(source) if (transcode_enabled() if transcode is None else transcode) else None
+    try:
+        response = client.post(
+            'upload',
+            headers={'authorization': api_key, 'content-type': 'application/octet-stream'},
+            data=UploadBody(transcoded) if transcoded else body,
+            # Uploading again only stores another copy, so failed uploads are retried
+            idempotent=True
+        )
+    finally:
+        if transcoded:
+            os.unlink(transcoded)
+
+    if response.status_code != 200:
+        raise RuntimeError(f"Error al subir: {response.text}")
+
+    upload_url = response.json()['upload_url']
+    _upload_cache.put(cache_key, upload_url)
+    return upload_url
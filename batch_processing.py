@@ -0,0 +1,176 @@
+"""Batch processing of emergency call recordings.
+
+Runs the full pipeline over many recordings with a bounded worker pool and
+reports throughput and per-stage latency. Used by the "Procesamiento por
+Lotes" tab and from the command line:
+
+    python batch_processing.py AudiosPrueba/ --workers 4 --output resultados.jsonl
+
+From the command line the API keys are read from the ASSEMBLYAI_API_KEY and
+GROQ_API_KEY environment variables, and processed calls are saved to the
+call store (see call_store.py) unless --no-store is given.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from call_store import get_call_store
+from emergency_pipeline import CALL_LATENCY_BUDGET, process_call
+from metrics import percentile
+from transcription_backends import get_transcription_backend
+
+AUDIO_EXTENSIONS = ['mp3', 'wav', 'm4a', 'flac', 'ogg']
+STAGES = ['upload', 'transcription', 'extraction', 'analysis', 'geocode', 'total']
+
+class BatchStats:
+    """Collects per-call stage timings and summarizes batch throughput"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finished = None
+        self.completed = 0
+        self.failed = 0
+        self.stage_times = {stage: [] for stage in STAGES}
+
+    def record(self, timings, ok):
+        """Add the outcome and stage timings of one call"""
+        if ok:
+            self.completed += 1
+        else:
+            self.failed += 1
+        for stage, seconds in timings.items():
+            self.stage_times.setdefault(stage, []).append(seconds)
+
+    def finish(self):
+        self.finished = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def calls_per_minute(self):
+        return self.completed / self.elapsed * 60 if self.elapsed > 0 else 0.0
+
+    def stage_summary(self):
+        """One row per stage with sample count and p50/p95/p99 latency in seconds"""
+        return [
+            {
+                'stage': stage,
+                'count': len(times),
+                'p50': percentile(times, 50),
+                'p95': percentile(times, 95),
+                'p99': percentile(times, 99)
+            }
+            for stage, times in self.stage_times.items()
+        ]
+
+    def report(self):
+        """Plain-text summary for the command line"""
+        lines = [
+            f"Llamadas procesadas: {self.completed}  fallidas: {self.failed}",
+            f"Tiempo total: {self.elapsed:.1f} s  ({self.calls_per_minute:.1f} llamadas/min)",
+            f"{'etapa':<15}{'n':>5}{'p50 (s)':>10}{'p95 (s)':>10}"
+        ]
+        for row in self.stage_summary():
+            if not row['count']:
+                continue
+            lines.append(f"{row['stage']:<15}{row['count']:>5}{row['p50']:>10.2f}{row['p95']:>10.2f}")
+        return "\n".join(lines)
+
+def _process_source(source, assemblyai_key, groq_key, budget):
+    """Worker body: process one recording, streamed from wherever it is"""
+    timings = {}
+    try:
+        call_record, coords, timings = process_call(
+            source, assemblyai_key, groq_key, budget=budget
+        )
+        return call_record, coords, timings, None
+    except Exception as e:
+        return None, None, timings, e
+
+def process_batch(sources, assemblyai_key, groq_key, workers=4, on_result=None,
+                  budget=CALL_LATENCY_BUDGET):
+    """Process (name, source) pairs with at most `workers` calls in flight.
+
+    A source is the recording's bytes, a path to it or a seekable file. on_result is called
+    as on_result(name, call_record, coords, error) from the calling thread
+    as each call finishes; records have no id yet, the caller assigns it.
+    Returns the BatchStats for the run.
+    """
+    stats = BatchStats()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch") as pool:
+        futures = {
+            pool.submit(_process_source, source, assemblyai_key, groq_key, budget): name
+            for name, source in sources
+        }
+        for future in as_completed(futures):
+            call_record, coords, timings, error = future.result()
+            stats.record(timings, call_record is not None)
+            if on_result:
+                on_result(futures[future], call_record, coords, error)
+    stats.finish()
+    return stats
+
+def find_recordings(directory):
+    """Audio files directly inside a directory, sorted by name"""
+    return sorted(
+        path for path in Path(directory).iterdir()
+        if path.is_file() and path.suffix.lower().lstrip('.') in AUDIO_EXTENSIONS
+    )
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Procesa un directorio de grabaciones de llamadas de emergencia.")
+    parser.add_argument('directory', help="directorio con grabaciones (mp3, wav, m4a, flac, ogg)")
+    parser.add_argument('--workers', type=int, default=4, help="llamadas procesadas en paralelo")
+    parser.add_argument('--output', help="archivo JSONL donde guardar los registros de llamadas")
+    parser.add_argument('--budget', type=float, default=CALL_LATENCY_BUDGET,
+                        help="presupuesto en segundos para análisis, resumen y geocodificación")
+    parser.add_argument('--no-store', action='store_true', help="no guardar las llamadas en el historial")
+    args = parser.parse_args(argv)
+
+    assemblyai_key = os.environ.get('ASSEMBLYAI_API_KEY')
+    groq_key = os.environ.get('GROQ_API_KEY')
+    if get_transcription_backend().requires_api_key and not assemblyai_key:
+        parser.error("defina ASSEMBLYAI_API_KEY en el entorno")
+    if not groq_key:
+        parser.error("defina GROQ_API_KEY en el entorno")
+
+    recordings = find_recordings(args.directory)
+    if not recordings:
+        parser.error(f"no se encontraron grabaciones en {args.directory}")
+
+    store = None if args.no_store else get_call_store()
+    output = open(args.output, 'w', encoding='utf-8') if args.output else None
+    saved = []
+
+    def on_result(name, call_record, coords, error):
+        if call_record:
+            saved.append(name)
+            call_record['id'] = store.add(call_record) if store else len(saved)
+            print(f"✅ {name}: {call_record['severity']} - {call_record['type']}")
+            if output:
+                output.write(json.dumps({'file': name, 'coords': coords, **call_record}, ensure_ascii=False) + "\n")
+        else:
+            print(f"❌ {name}: {error or 'sin transcripción o resumen'}", file=sys.stderr)
+
+    try:
+        stats = process_batch(
+            [(path.name, path) for path in recordings],
+            assemblyai_key, groq_key,
+            workers=args.workers, on_result=on_result, budget=args.budget
+        )
+    finally:
+        if output:
+            output.close()
+
+    print()
+    print(stats.report())
+    return 0 if stats.completed else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,263 @@
+"""Offline benchmark of the call pipeline.
+
+Replays the recordings in AudiosPrueba/ (or another directory) through the
+whole pipeline (upload, transcription, analysis, summary, geocoding)
+against the local stand-ins in stand_in_services.py, and reports
+throughput, per-stage latency, memory and the requests each service got:
+
+    python benchmark.py
+    python benchmark.py --profile degraded --scale 10 --synthetic 20 --workers 8
+
+--scale replays the corpus several times, each copy a distinct recording,
+and --synthetic adds generated WAV recordings of 15 to 90 seconds. Every
+run starts with empty caches, so each call pays for its own transcription
+and analysis.
+
+The result is compared with the baseline stored for the same profile in
+benchmarks/baseline.json. The run fails (exit status 1) if throughput
+drops, a stage's p50 or p95 latency grows or peak memory grows by more
+than --tolerance, or if more calls fail. --update-baseline stores the
+result as the new baseline instead.
+
+The stand-ins run in a child process, so the pipeline's numbers do not
+include their CPU and memory. Nominatim keeps its one request per second
+throttle (see geocoding.py) unless NOMINATIM_MIN_INTERVAL says otherwise.
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import wave
+from array import array
+from collections import Counter
+from pathlib import Path
+
+from stand_in_services import PROFILES, StandInProcess
+
+DEFAULT_CORPUS = Path(__file__).parent / 'AudiosPrueba'
+BASELINE_PATH = Path(__file__).parent / 'benchmarks' / 'baseline.json'
+DEFAULT_TOLERANCE = 0.25
+# Latency changes smaller than this (seconds) are noise, whatever the ratio
+LATENCY_SLACK = 0.05
+# Likewise for peak memory, in MB
+MEMORY_SLACK_MB = 1.0
+SYNTHETIC_RATE = 16000
+SYNTHETIC_DURATIONS = (15, 30, 45, 60, 90)
+
+# Pipeline modules read the cache and service settings when imported
+PIPELINE_MODULES = ('emergency_pipeline', 'batch_processing', 'geocoding', 'http_client', 'call_store')
+
+def synthetic_recording(seconds, seed):
+    """WAV bytes of a 16 kHz mono tone, different for each seed"""
+    frequency = 200 + seed % 50 * 10
+    samples = array('h', (
+        int(3000 * math.sin(2 * math.pi * frequency * i / SYNTHETIC_RATE))
+        for i in range(int(seconds * SYNTHETIC_RATE))
+    ))
+    buffer = tempfile.SpooledTemporaryFile()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SYNTHETIC_RATE)
+        wav.writeframes(samples.tobytes())
+    buffer.seek(0)
+    return buffer.read()
+
+def build_corpus(recordings, scale=1, synthetic=0):
+    """(name, source) pairs: the recordings scale times, then the synthetic ones.
+
+    The first copy of each recording is read from disk as in production;
+    later copies get a few extra bytes so they count as new recordings.
+    """
+    sources = []
+    for copy in range(scale):
+        for path in recordings:
+            if copy == 0:
+                sources.append((path.name, path))
+            else:
+                sources.append((f"{path.name}#{copy}", path.read_bytes() + copy.to_bytes(4, 'big')))
+    for i in range(synthetic):
+        seconds = SYNTHETIC_DURATIONS[i % len(SYNTHETIC_DURATIONS)]
+        sources.append((f"sintetica-{i + 1}.wav", synthetic_recording(seconds, i)))
+    return sources
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+def run_benchmark(directory=DEFAULT_CORPUS, profile='realistic', scale=1, synthetic=0, workers=4, seed=0):
+    """Run the pipeline over the corpus against the stand-ins and return the result.
+
+    Runs once per process: the pipeline modules must not have been
+    imported yet, so that they pick up the stand-ins and empty caches.
+    """
+    if any(name in sys.modules for name in PIPELINE_MODULES):
+        raise RuntimeError("El benchmark debe ejecutarse en un proceso nuevo")
+
+    with tempfile.TemporaryDirectory() as cache_dir, StandInProcess(profile, seed) as services:
+        os.environ.update(services.environment())
+        for name in ('LLM_CACHE_DIR', 'GEOCODE_CACHE_DIR', 'UPLOAD_CACHE_DIR'):
+            os.environ[name] = str(Path(cache_dir) / name.lower())
+        os.environ['TRANSCRIPTION_BACKEND'] = 'assemblyai'
+        # Incident lookups read the call store; keep them off the real one
+        os.environ['CALL_STORE_URL'] = 'memory://'
+        os.environ.pop('ASSEMBLYAI_WEBHOOK_URL', None)
+        os.environ.pop('GEOCODER_GAZETTEER', None)
+
+        from batch_processing import find_recordings, process_batch
+        # geocoding imports geopy on its first Nominatim request; load it now so
+        # its modules are not counted in the pipeline's peak memory
+        import geopy.geocoders
+
+        sources = build_corpus(find_recordings(directory), scale, synthetic)
+        stage_errors = Counter()
+
+        def on_result(name, call_record, coords, error):
+            if call_record:
+                stage_errors.update(call_record['stage_errors'])
+
+        tracemalloc.start()
+        try:
+            stats = process_batch(sources, 'benchmark', 'benchmark', workers=workers, on_result=on_result)
+            peak_heap = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        requests_per_service = services.request_counts()
+
+    return {
+        'profile': profile,
+        'calls': len(sources),
+        'workers': workers,
+        'completed': stats.completed,
+        'failed': stats.failed,
+        'elapsed': stats.elapsed,
+        'calls_per_minute': stats.calls_per_minute,
+        'stages': {
+            row['stage']: {key: row[key] for key in ('count', 'p50', 'p95', 'p99')}
+            for row in stats.stage_summary() if row['count']
+        },
+        'stage_errors': dict(stage_errors),
+        'peak_heap_mb': peak_heap / (1024 * 1024),
+        'peak_rss_mb': _peak_rss_mb(),
+        'requests': requests_per_service,
+        'date': time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+def compare(result, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Regressions of result against baseline, as a list of messages"""
+    regressions = []
+    if result['calls_per_minute'] < baseline['calls_per_minute'] * (1 - tolerance):
+        regressions.append(
+            f"rendimiento: {result['calls_per_minute']:.1f} llamadas/min "
+            f"(línea base {baseline['calls_per_minute']:.1f})"
+        )
+    if result['failed'] > baseline['failed']:
+        regressions.append(f"llamadas fallidas: {result['failed']} (línea base {baseline['failed']})")
+    for stage, expected in baseline['stages'].items():
+        measured = result['stages'].get(stage)
+        if not measured:
+            continue
+        for key in ('p50', 'p95'):
+            if measured[key] > expected[key] * (1 + tolerance) + LATENCY_SLACK:
+                regressions.append(
+                    f"{stage} {key}: {measured[key]:.2f} s (línea base {expected[key]:.2f} s)"
+                )
+    if result['peak_heap_mb'] > baseline['peak_heap_mb'] * (1 + tolerance) + MEMORY_SLACK_MB:
+        regressions.append(
+            f"memoria: {result['peak_heap_mb']:.1f} MB (línea base {baseline['peak_heap_mb']:.1f} MB)"
+        )
+    return regressions
+
+def load_baselines(path=BASELINE_PATH):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def save_baseline(result, path=BASELINE_PATH):
+    """Store result as the baseline of its profile"""
+    baselines = load_baselines(path)
+    baselines[result['profile']] = result
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(baselines, f, ensure_ascii=False, indent=2, sort_keys=True)
+        f.write("\n")
+
+def report(result):
+    """Plain-text summary of a result"""
+    lines = [
+        f"Perfil: {result['profile']}  llamadas: {result['calls']}  en paralelo: {result['workers']}",
+        f"Procesadas: {result['completed']}  fallidas: {result['failed']}",
+        f"Tiempo total: {result['elapsed']:.1f} s  ({result['calls_per_minute']:.1f} llamadas/min)",
+        f"{'etapa':<15}{'n':>5}{'p50 (s)':>10}{'p95 (s)':>10}{'p99 (s)':>10}",
+    ]
+    for stage, row in result['stages'].items():
+        lines.append(f"{stage:<15}{row['count']:>5}{row['p50']:>10.2f}{row['p95']:>10.2f}{row['p99']:>10.2f}")
+    if result['stage_errors']:
+        lines.append("Etapas con errores: " + ", ".join(f"{stage} ({n})" for stage, n in result['stage_errors'].items()))
+    memory = f"Memoria: pico del heap {result['peak_heap_mb']:.1f} MB"
+    if result['peak_rss_mb'] is not None:
+        memory += f", pico del proceso {result['peak_rss_mb']:.1f} MB"
+    lines.append(memory)
+    lines.append("Solicitudes: " + ", ".join(f"{name} {n}" for name, n in result['requests'].items()))
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mide el procesamiento de llamadas con servicios simulados locales.")
+    parser.add_argument('directory', nargs='?', default=DEFAULT_CORPUS, help="directorio con grabaciones")
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='realistic',
+                        help="latencia y errores de los servicios simulados")
+    parser.add_argument('--scale', type=int, default=1, help="veces que se repite el corpus")
+    parser.add_argument('--synthetic', type=int, default=0, help="grabaciones sintéticas adicionales")
+    parser.add_argument('--workers', type=int, default=4, help="llamadas procesadas en paralelo")
+    parser.add_argument('--seed', type=int, default=0, help="semilla de la latencia y los errores simulados")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="empeoramiento relativo permitido frente a la línea base")
+    parser.add_argument('--baseline', default=BASELINE_PATH, help="archivo JSON de líneas base")
+    parser.add_argument('--update-baseline', action='store_true', help="guardar el resultado como línea base")
+    parser.add_argument('--output', help="archivo JSON donde guardar el resultado")
+    args = parser.parse_args(argv)
+
+    result = run_benchmark(args.directory, args.profile, args.scale, args.synthetic, args.workers, args.seed)
+    print(report(result))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    if args.update_baseline:
+        save_baseline(result, args.baseline)
+        print(f"\nLínea base de '{args.profile}' actualizada en {args.baseline}")
+        return 0
+
+    baseline = load_baselines(args.baseline).get(args.profile)
+    if baseline is None:
+        print(f"\nNo hay línea base para '{args.profile}'; use --update-baseline para crearla")
+        return 0
+    if (baseline['calls'], baseline['workers']) != (result['calls'], result['workers']):
+        print(
+            f"\nLa línea base de '{args.profile}' es de {baseline['calls']} llamadas con {baseline['workers']} "
+            "en paralelo; no es comparable"
+        )
+        return 0
+
+    regressions = compare(result, baseline, args.tolerance)
+    if regressions:
+        print("\n❌ Regresiones frente a la línea base:")
+        for regression in regressions:
+            print(f"  - {regression}")
+        return 1
+    print("\n✅ Sin regresiones frente a la línea base")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,280 @@
+"""Columnar archive of the stored calls, for analytics over months of history.
+
+export_calls() writes the calls of each day to a Parquet file under
+CALL_ARCHIVE_DIR (default .data/archive), partitioned by day:
+
+    .data/archive/day=2026-10-16/calls.parquet
+
+One row per call, with its severity, type, location, barrio, coordinates,
+emotion, alerts (a list of {categoria, palabra, severidad}), incident,
+resolution and one column per pipeline stage timing, in seconds. A day's
+file is rewritten whole, so exporting a day again is safe. By default the
+export starts at the last archived day, so it rewrites that day and adds
+the ones after it; pass since to export older days again, for instance
+to pick up calls resolved after their day was archived.
+
+load_calls() reads the archive as a pyarrow Table, opening only the days
+in range and the columns asked for. The aggregations run vectorized over
+that table with pyarrow.compute and pandas, so a report over months of
+calls is a columnar scan instead of decoding every stored JSON record:
+
+* calls_by_hour: calls per hour of the day, by type or severity;
+* calls_by_day: calls per day, by severity;
+* hot_spots: the barrios with the most calls and their share of urgent ones;
+* alert_frequencies: alerts per category.
+
+The barrio of a call is the one its location mentions (see
+geocoding.place_name), else the gazetteer barrio whose center is nearest
+its coordinates, within BARRIO_RADIUS_M; calls with neither are grouped
+in grid zones about a kilometre wide, labelled by their center.
+
+From the command line:
+
+    python call_archive.py export
+    python call_archive.py export --since 2026-09-01 --until 2026-10-01
+    python call_archive.py report --since 2026-09-01 --until 2026-10-01 --csv reportes/
+"""
+import argparse
+import os
+import sys
+import threading
+from datetime import date, timedelta
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from call_store import get_call_store
+from geocoding import get_offline_index, place_name
+from incident_index import METERS_PER_DEGREE
+from metrics import PIPELINE_STAGES
+from priority_queue import URGENT_SEVERITIES
+
+ARCHIVE_DIR = Path(os.environ.get('CALL_ARCHIVE_DIR', Path(__file__).parent / '.data' / 'archive'))
+BARRIO_RADIUS_M = float(os.environ.get('BARRIO_RADIUS_M', 1500))
+# Width in degrees of the zones grouping calls without a barrio, about a kilometre
+ZONE_DEG = 0.01
+# Calls compared at once against every barrio center
+BARRIO_CHUNK = 1024
+HOT_SPOTS = 10
+NO_DATA = "Sin dato"
+
+ALERT_TYPE = pa.struct([('categoria', pa.string()), ('palabra', pa.string()), ('severidad', pa.string())])
+SCHEMA = pa.schema([
+    ('id', pa.int64()),
+    ('timestamp', pa.timestamp('s')),
+    ('severity', pa.string()),
+    ('type', pa.string()),
+    ('location', pa.string()),
+    ('barrio', pa.string()),
+    ('lat', pa.float64()),
+    ('lon', pa.float64()),
+    ('emotion', pa.string()),
+    ('alerts', pa.list_(ALERT_TYPE)),
+    ('incident_id', pa.int64()),
+    ('resolved', pa.bool_()),
+    ('stage_errors', pa.list_(pa.string())),
+    *((f'{stage}_s', pa.float64()) for stage in PIPELINE_STAGES),
+])
+# Directories are day=YYYY-MM-DD; the day is read as a string column
+PARTITIONING = ds.partitioning(pa.schema([('day', pa.string())]), flavor='hive')
+
+def assign_barrios(locations, lats, lons, index=None):
+    """Barrio of each call (see the module docstring), as a list of names"""
+    names = [place_name(location) if location else None for location in locations]
+    names = [name.title() if name else None for name in names]
+    coords = np.column_stack([np.array(lats, dtype=float), np.array(lons, dtype=float)]).reshape(-1, 2)
+    located = ~np.isnan(coords).any(axis=1)
+
+    index = index or get_offline_index()
+    if index and index.barrios:
+        labels = [barrio.title() for barrio in index.barrios]
+        centers = np.array(list(index.barrios.values()), dtype=float)
+        pending = np.flatnonzero(located & np.array([name is None for name in names], dtype=bool))
+        for start in range(0, len(pending), BARRIO_CHUNK):
+            rows = pending[start:start + BARRIO_CHUNK]
+            points = coords[rows]
+            # Equirectangular distance from each call to each barrio center
+            dlat = points[:, None, 0] - centers[None, :, 0]
+            dlon = (points[:, None, 1] - centers[None, :, 1]) * np.cos(np.radians(points[:, None, 0]))
+            distances = np.hypot(dlat, dlon) * METERS_PER_DEGREE
+            nearest = distances.argmin(axis=1)
+            close = distances[np.arange(len(rows)), nearest] <= BARRIO_RADIUS_M
+            for row, barrio in zip(rows[close], nearest[close]):
+                names[row] = labels[barrio]
+
+    zones = (np.floor(coords / ZONE_DEG) + 0.5) * ZONE_DEG
+    for row in np.flatnonzero(located & np.array([name is None for name in names], dtype=bool)):
+        names[row] = f"Zona {zones[row, 0]:.3f}, {zones[row, 1]:.3f}"
+    return names
+
+def calls_table(calls):
+    """Archive rows of a list of call records, as a pyarrow Table"""
+    coords = [call.get('coords') or (None, None) for call in calls]
+    lats = [lat for lat, _ in coords]
+    lons = [lon for _, lon in coords]
+    locations = [call.get('location') for call in calls]
+    columns = {
+        'id': [call['id'] for call in calls],
+        'timestamp': pc.strptime(
+            pa.array([call['timestamp'] for call in calls], pa.string()), format="%Y-%m-%d %H:%M:%S", unit='s'
+        ),
+        'severity': [call.get('severity') for call in calls],
+        'type': [call.get('type') for call in calls],
+        'location': locations,
+        'barrio': assign_barrios(locations, lats, lons),
+        'lat': lats,
+        'lon': lons,
+        'emotion': [call.get('emotion') for call in calls],
+        'alerts': [
+            [
+                {
+                    'categoria': alert.get('categoria'),
+                    'palabra': alert.get('palabra', alert.get('keyword')),
+                    'severidad': alert.get('severidad'),
+                }
+                for alert in call.get('alerts') or []
+            ]
+            for call in calls
+        ],
+        'incident_id': [call.get('incident_id') for call in calls],
+        'resolved': [bool(call.get('resolved')) for call in calls],
+        'stage_errors': [list(call.get('stage_errors') or []) for call in calls],
+        **{f'{stage}_s': [(call.get('timings') or {}).get(stage) for call in calls] for stage in PIPELINE_STAGES},
+    }
+    return pa.Table.from_pydict(columns, schema=SCHEMA)
+
+def _day_path(directory, day):
+    return Path(directory) / f"day={day}" / "calls.parquet"
+
+def archived_days(directory=ARCHIVE_DIR):
+    """Days with an archive file, oldest first, as YYYY-MM-DD"""
+    return sorted(path.parent.name.removeprefix('day=') for path in Path(directory).glob("day=*/calls.parquet"))
+
+def write_day(table, day, directory=ARCHIVE_DIR):
+    """Replace a day's archive file with table"""
+    path = _day_path(directory, day)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Dot files are skipped by load_calls, so readers never see a partial file
+    tmp = path.parent / f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+    pq.write_table(table, tmp)
+    os.replace(tmp, path)
+
+def export_calls(store=None, directory=ARCHIVE_DIR, since=None, until=None):
+    """Archive the stored calls of the days from since up to (not including)
+    until, YYYY-MM-DD; returns {day: calls written}. since defaults to the
+    last archived day, or the oldest call's, and until to tomorrow"""
+    store = store or get_call_store()
+    if since is None:
+        days = archived_days(directory)
+        oldest = store.list_range(limit=1)
+        if days:
+            since = days[-1]
+        elif oldest:
+            since = oldest[0]['timestamp'][:10]
+        else:
+            return {}
+    last = date.fromisoformat(until) if until else date.today() + timedelta(days=1)
+
+    exported = {}
+    day = date.fromisoformat(since)
+    while day < last:
+        next_day = day + timedelta(days=1)
+        calls = store.list_range(since=day.isoformat(), until=next_day.isoformat())
+        if calls:
+            write_day(calls_table(calls), day.isoformat(), directory)
+            exported[day.isoformat()] = len(calls)
+        day = next_day
+    return exported
+
+def load_calls(directory=ARCHIVE_DIR, since=None, until=None, columns=None):
+    """Archived calls of the days from since up to (not including) until, as a
+    pyarrow Table with only the given columns; only those days' files are read"""
+    if not archived_days(directory):
+        table = SCHEMA.empty_table()
+        return table.select(columns) if columns else table
+
+    dataset = ds.dataset(
+        directory, format='parquet', partitioning=PARTITIONING, schema=SCHEMA.append(pa.field('day', pa.string()))
+    )
+    day_filter = None
+    if since:
+        day_filter = ds.field('day') >= since
+    if until:
+        day_filter = ds.field('day') < until if day_filter is None else day_filter & (ds.field('day') < until)
+    return dataset.to_table(columns=columns or SCHEMA.names, filter=day_filter)
+
+def calls_by_hour(table, by='type'):
+    """Calls per hour of the day (rows 0 to 23) and value of the column by"""
+    frame = table.select(['timestamp', by]).to_pandas()
+    counts = pd.crosstab(frame['timestamp'].dt.hour, frame[by].fillna(NO_DATA))
+    return counts.reindex(range(24), fill_value=0).rename_axis(index='Hora', columns=None)
+
+def calls_by_day(table):
+    """Calls per day (rows) and severity (columns)"""
+    frame = table.select(['timestamp', 'severity']).to_pandas()
+    counts = pd.crosstab(frame['timestamp'].dt.normalize(), frame['severity'].fillna(NO_DATA))
+    return counts.rename_axis(index='Día', columns=None)
+
+def hot_spots(table, top=HOT_SPOTS):
+    """The top barrios by calls, with their urgent (Crítico or Alto) calls"""
+    frame = table.select(['barrio', 'severity']).to_pandas()
+    frame['urgent'] = frame['severity'].isin(URGENT_SEVERITIES)
+    spots = frame.dropna(subset=['barrio']).groupby('barrio').agg(
+        Llamadas=('urgent', 'size'), Urgentes=('urgent', 'sum')
+    )
+    spots['% urgentes'] = (100 * spots['Urgentes'] / spots['Llamadas']).round(1)
+    return spots.sort_values(['Llamadas', 'Urgentes'], ascending=False).head(top).rename_axis('Barrio')
+
+def alert_frequencies(table):
+    """Alerts per category, most frequent first"""
+    categories = pc.struct_field(pc.list_flatten(table['alerts']), 'categoria')
+    counts = pc.value_counts(pc.fill_null(categories, NO_DATA))
+    return pd.Series(
+        counts.field('counts').to_numpy(), index=pd.Index(counts.field('values').to_pylist(), name='Categoría'),
+        name='Alertas'
+    ).sort_values(ascending=False)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archiva las llamadas en Parquet y genera reportes históricos.")
+    parser.add_argument('command', choices=['export', 'report'], help="export: archivar llamadas; report: agregados")
+    parser.add_argument('--since', help="primer día (AAAA-MM-DD)")
+    parser.add_argument('--until', help="día siguiente al último (AAAA-MM-DD)")
+    parser.add_argument('--dir', default=ARCHIVE_DIR, help="directorio del archivo")
+    parser.add_argument('--csv', help="directorio donde guardar cada agregado en CSV (report)")
+    args = parser.parse_args(argv)
+
+    if args.command == 'export':
+        exported = export_calls(directory=args.dir, since=args.since, until=args.until)
+        for day, count in exported.items():
+            print(f"{day}: {count} llamadas")
+        print(f"{sum(exported.values())} llamadas archivadas en {len(exported)} días en {args.dir}")
+        return 0
+
+    table = load_calls(args.dir, args.since, args.until)
+    if not table.num_rows:
+        print("No hay llamadas archivadas en ese periodo; ejecute primero: python call_archive.py export")
+        return 1
+    reports = {
+        'llamadas_por_hora_tipo': calls_by_hour(table, 'type'),
+        'llamadas_por_hora_severidad': calls_by_hour(table, 'severity'),
+        'llamadas_por_dia': calls_by_day(table),
+        'barrios': hot_spots(table),
+        'alertas': alert_frequencies(table).to_frame(),
+    }
+    print(f"{table.num_rows} llamadas archivadas del periodo")
+    for name, frame in reports.items():
+        print(f"\n{name}\n{frame.to_string()}")
+    if args.csv:
+        Path(args.csv).mkdir(parents=True, exist_ok=True)
+        for name, frame in reports.items():
+            frame.to_csv(Path(args.csv) / f"{name}.csv")
+        print(f"\nReportes guardados en {args.csv}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
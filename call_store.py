@@ -0,0 +1,494 @@
+"""Persistent storage for processed calls, shared by every dispatcher session.
+
+The backend is chosen with the CALL_STORE_URL environment variable:
+
+* sqlite:///path/to/calls.db (default .data/calls.db) stores calls in
+  SQLite in WAL mode, so readers never block the writer, with indexes on
+  timestamp, severity, type and location.
+* memory:// keeps calls in process memory, for development.
+
+Dashboard totals (calls by severity and emotion, alerts) are kept up to
+date on every insert, so summary() costs the same with ten calls or ten
+thousand. version() changes whenever the stored calls do, for use as a
+cache key.
+
+Calls reporting the same incident (see incident_index.py) carry the id
+of the incident's first call in 'incident_id', and resolve_incident()
+closes all of them at once.
+
+The stage timings of each call (call_record['timings']) are also kept
+one row per stage, for the latency percentiles and histograms in
+metrics.py.
+
+list_range() reads the calls of a time range, oldest first, for the
+columnar archive in call_archive.py.
+
+Other backends can be added with register_store(scheme, factory).
+"""
+import json
+import os
+import sqlite3
+import threading
+from collections import Counter
+from pathlib import Path
+
+DEFAULT_STORE_URL = f"sqlite:///{Path(__file__).parent / '.data' / 'calls.db'}"
+
+# Fields that can be filtered on, mapped to their column
+FILTER_COLUMNS = {'severity': 'severity', 'type': 'type', 'location': 'location'}
+
+class CallStore:
+    """Interface of a call store; records are call_record dicts"""
+
+    def add(self, call_record):
+        """Store a call and return the id assigned to it"""
+        raise NotImplementedError
+
+    def get(self, call_id):
+        """The call with this id, or None"""
+        raise NotImplementedError
+
+    def list_calls(self, limit=50, offset=0, since=None, **filters):
+        """Calls newest first, optionally filtered by severity, type or location"""
+        raise NotImplementedError
+
+    def count(self, since=None, **filters):
+        raise NotImplementedError
+
+    def summary(self):
+        """Totals for the dashboard: calls, critical, high stress, alerts and
+        the number of calls per severity and per emotion"""
+        raise NotImplementedError
+
+    def version(self):
+        """Number that changes every time calls are added or cleared"""
+        raise NotImplementedError
+
+    def resolve(self, call_id):
+        """Mark a call as attended so it no longer counts as open; records show it as 'resolved'"""
+        raise NotImplementedError
+
+    def list_open(self, severities, after_id=0, since=None):
+        """Unresolved calls with one of the given severities and id above after_id,
+        oldest first; with since, only those at or after that timestamp"""
+        raise NotImplementedError
+
+    def resolve_incident(self, incident_id):
+        """Resolve an incident's first call and every call reporting the same incident"""
+        raise NotImplementedError
+
+    def list_range(self, since=None, until=None, limit=None):
+        """Calls with since <= timestamp < until, oldest first, for exports"""
+        raise NotImplementedError
+
+    def add_timing(self, call_id, stage, seconds):
+        """Record the duration of a stage measured after the call was stored, such as rendering"""
+        raise NotImplementedError
+
+    def stage_timings(self, since=None):
+        """Durations in seconds of each stage, {stage: [seconds, ...]}, of calls since a timestamp"""
+        raise NotImplementedError
+
+    def stage_histograms(self, buckets):
+        """Per stage: sample 'count', their 'sum', 'failures' and the cumulative
+        number of samples at or below each bound in buckets"""
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+def _timing_rows(call_record):
+    """(stage, seconds, ok) for each stage timing of a call record"""
+    failed = set(call_record.get('stage_errors') or [])
+    return [(stage, seconds, stage not in failed) for stage, seconds in (call_record.get('timings') or {}).items()]
+
+def _histogram(samples, buckets):
+    return {
+        'count': len(samples),
+        'sum': sum(seconds for seconds, _ in samples),
+        'failures': sum(not ok for _, ok in samples),
+        'buckets': [sum(seconds <= bound for seconds, _ in samples) for bound in buckets]
+    }
+
+def _summary(total, alerts, by_severity, by_emotion):
+    return {
+        'total': total,
+        'critical': by_severity.get('Crítico', 0),
+        'high_stress': sum(count for emotion, count in by_emotion.items() if 'ALTO' in emotion),
+        'alerts': alerts,
+        'by_severity': by_severity,
+        'by_emotion': by_emotion
+    }
+
+class SQLiteCallStore(CallStore):
+    """Call store in a SQLite database in WAL mode, one connection per thread"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS calls (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp TEXT NOT NULL,
+                    severity TEXT,
+                    type TEXT,
+                    location TEXT,
+                    emotion TEXT,
+                    alert_count INTEGER NOT NULL DEFAULT 0,
+                    record TEXT NOT NULL,
+                    resolved INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE INDEX IF NOT EXISTS idx_calls_timestamp ON calls (timestamp);
+                CREATE INDEX IF NOT EXISTS idx_calls_severity ON calls (severity, timestamp);
+                CREATE INDEX IF NOT EXISTS idx_calls_type ON calls (type, timestamp);
+                CREATE INDEX IF NOT EXISTS idx_calls_location ON calls (location);
+                CREATE TABLE IF NOT EXISTS call_timings (
+                    call_id INTEGER NOT NULL,
+                    stage TEXT NOT NULL,
+                    seconds REAL NOT NULL,
+                    ok INTEGER NOT NULL DEFAULT 1,
+                    PRIMARY KEY (call_id, stage)
+                );
+                CREATE INDEX IF NOT EXISTS idx_call_timings_stage ON call_timings (stage, seconds);
+            """)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(calls)")}
+            if 'resolved' not in columns:
+                conn.execute("ALTER TABLE calls ADD COLUMN resolved INTEGER NOT NULL DEFAULT 0")
+            if 'incident_id' not in columns:
+                conn.execute("ALTER TABLE calls ADD COLUMN incident_id INTEGER")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_calls_open ON calls (resolved, severity)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_calls_incident ON calls (incident_id)")
+
+            # Running totals, one row per (dimension, value); the 'version'
+            # row counts writes
+            has_counts = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'call_counts'"
+            ).fetchone()
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS call_counts ("
+                "dimension TEXT NOT NULL, value TEXT NOT NULL, count INTEGER NOT NULL, "
+                "PRIMARY KEY (dimension, value))"
+            )
+            if not has_counts:
+                self._rebuild_counts(conn)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _where(self, since, filters):
+        clauses = []
+        params = []
+        for field, value in filters.items():
+            if value is None:
+                continue
+            clauses.append(f"{FILTER_COLUMNS[field]} = ?")
+            params.append(value)
+        if since:
+            clauses.append("timestamp >= ?")
+            params.append(since)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def _rebuild_counts(self, conn):
+        """Recompute the running totals from the calls table"""
+        conn.execute("DELETE FROM call_counts WHERE dimension != 'version'")
+        conn.execute(
+            "INSERT INTO call_counts SELECT 'total', '', COUNT(*) FROM calls"
+        )
+        conn.execute(
+            "INSERT INTO call_counts SELECT 'alerts', '', COALESCE(SUM(alert_count), 0) FROM calls"
+        )
+        conn.execute(
+            "INSERT INTO call_counts SELECT 'severity', COALESCE(severity, ''), COUNT(*) FROM calls GROUP BY 1"
+        )
+        conn.execute(
+            "INSERT INTO call_counts SELECT 'emotion', COALESCE(emotion, ''), COUNT(*) FROM calls GROUP BY 1"
+        )
+        self._bump_version(conn)
+
+    def _increment(self, conn, dimension, value, amount=1):
+        conn.execute(
+            "INSERT INTO call_counts VALUES (?, ?, ?) "
+            "ON CONFLICT (dimension, value) DO UPDATE SET count = count + excluded.count",
+            (dimension, value or '', amount)
+        )
+
+    def _bump_version(self, conn):
+        self._increment(conn, 'version', '')
+
+    def add(self, call_record):
+        record = {k: v for k, v in call_record.items() if k not in ('id', 'resolved')}
+        alert_count = len(record.get('alerts') or [])
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO calls (timestamp, severity, type, location, emotion, alert_count, incident_id, record) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    record['timestamp'], record.get('severity'), record.get('type'),
+                    record.get('location'), record.get('emotion'), alert_count,
+                    record.get('incident_id'), json.dumps(record, ensure_ascii=False)
+                )
+            )
+            # Totals are updated in the same transaction as the insert
+            self._increment(conn, 'total', '')
+            self._increment(conn, 'alerts', '', alert_count)
+            self._increment(conn, 'severity', record.get('severity'))
+            self._increment(conn, 'emotion', record.get('emotion'))
+            conn.executemany(
+                "INSERT INTO call_timings (call_id, stage, seconds, ok) VALUES (?, ?, ?, ?)",
+                [(cursor.lastrowid, *row) for row in _timing_rows(record)]
+            )
+            self._bump_version(conn)
+            return cursor.lastrowid
+
+    def _row_to_record(self, row):
+        call_id, record, resolved = row
+        return dict(json.loads(record), id=call_id, resolved=bool(resolved))
+
+    def get(self, call_id):
+        row = self._connect().execute("SELECT id, record, resolved FROM calls WHERE id = ?", (call_id,)).fetchone()
+        return self._row_to_record(row) if row else None
+
+    def list_calls(self, limit=50, offset=0, since=None, **filters):
+        where, params = self._where(since, filters)
+        rows = self._connect().execute(
+            f"SELECT id, record, resolved FROM calls{where} ORDER BY id DESC LIMIT ? OFFSET ?",
+            params + [limit, offset]
+        ).fetchall()
+        return [self._row_to_record(row) for row in rows]
+
+    def count(self, since=None, **filters):
+        where, params = self._where(since, filters)
+        return self._connect().execute(f"SELECT COUNT(*) FROM calls{where}", params).fetchone()[0]
+
+    def summary(self):
+        counts = {}
+        for dimension, value, count in self._connect().execute("SELECT dimension, value, count FROM call_counts"):
+            counts.setdefault(dimension, {})[value] = count
+        return _summary(
+            counts.get('total', {}).get('', 0),
+            counts.get('alerts', {}).get('', 0),
+            {value: count for value, count in counts.get('severity', {}).items() if count},
+            {value: count for value, count in counts.get('emotion', {}).items() if count}
+        )
+
+    def version(self):
+        row = self._connect().execute(
+            "SELECT count FROM call_counts WHERE dimension = 'version'"
+        ).fetchone()
+        return row[0] if row else 0
+
+    def resolve(self, call_id):
+        with self._connect() as conn:
+            conn.execute("UPDATE calls SET resolved = 1 WHERE id = ?", (call_id,))
+            self._bump_version(conn)
+
+    def resolve_incident(self, incident_id):
+        with self._connect() as conn:
+            conn.execute("UPDATE calls SET resolved = 1 WHERE id = ? OR incident_id = ?", (incident_id, incident_id))
+            self._bump_version(conn)
+
+    def list_open(self, severities, after_id=0, since=None):
+        placeholders = ", ".join("?" for _ in severities)
+        rows = self._connect().execute(
+            f"SELECT id, record, resolved FROM calls WHERE id > ? AND resolved = 0 AND severity IN ({placeholders}) "
+            "AND timestamp >= ? ORDER BY id",
+            [after_id] + list(severities) + [since or '']
+        ).fetchall()
+        return [self._row_to_record(row) for row in rows]
+
+    def list_range(self, since=None, until=None, limit=None):
+        rows = self._connect().execute(
+            "SELECT id, record, resolved FROM calls WHERE timestamp >= ? AND (? IS NULL OR timestamp < ?) "
+            "ORDER BY timestamp, id LIMIT ?",
+            (since or '', until, until, -1 if limit is None else limit)
+        ).fetchall()
+        return [self._row_to_record(row) for row in rows]
+
+    def add_timing(self, call_id, stage, seconds):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO call_timings (call_id, stage, seconds) VALUES (?, ?, ?)",
+                (call_id, stage, seconds)
+            )
+            conn.execute(
+                "UPDATE calls SET record = json_set(record, '$.timings', "
+                "json_set(COALESCE(json_extract(record, '$.timings'), '{}'), '$.' || ?, ?)) WHERE id = ?",
+                (stage, seconds, call_id)
+            )
+            self._bump_version(conn)
+
+    def stage_timings(self, since=None):
+        if since:
+            rows = self._connect().execute(
+                "SELECT stage, seconds FROM call_timings JOIN calls ON calls.id = call_timings.call_id "
+                "WHERE calls.timestamp >= ?",
+                (since,)
+            )
+        else:
+            rows = self._connect().execute("SELECT stage, seconds FROM call_timings")
+        timings = {}
+        for stage, seconds in rows:
+            timings.setdefault(stage, []).append(seconds)
+        return timings
+
+    def stage_histograms(self, buckets):
+        # One scan of the timings table; each bucket is a conditional count
+        bounds = "".join(", SUM(seconds <= ?)" for _ in buckets)
+        rows = self._connect().execute(
+            f"SELECT stage, COUNT(*), SUM(seconds), SUM(ok = 0){bounds} FROM call_timings GROUP BY stage",
+            list(buckets)
+        )
+        return {
+            stage: {'count': count, 'sum': total, 'failures': failures, 'buckets': list(cumulative)}
+            for stage, count, total, failures, *cumulative in rows
+        }
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM calls")
+            conn.execute("DELETE FROM call_timings")
+            self._rebuild_counts(conn)
+
+class MemoryCallStore(CallStore):
+    """Call store in process memory, lost on restart"""
+
+    def __init__(self):
+        self._calls = []
+        self._lock = threading.Lock()
+        self._reset_counts()
+
+    def _reset_counts(self):
+        self._alerts = 0
+        self._by_severity = Counter()
+        self._by_emotion = Counter()
+        self._version = getattr(self, '_version', 0) + 1
+
+    def _matching(self, since, filters):
+        return [
+            call for call in reversed(self._calls)
+            if all(value is None or call.get(field) == value for field, value in filters.items())
+            and (not since or call['timestamp'] >= since)
+        ]
+
+    def add(self, call_record):
+        with self._lock:
+            call_id = self._calls[-1]['id'] + 1 if self._calls else 1
+            self._calls.append(dict(call_record, id=call_id))
+            self._alerts += len(call_record.get('alerts') or [])
+            self._by_severity[call_record.get('severity') or ''] += 1
+            self._by_emotion[call_record.get('emotion') or ''] += 1
+            self._version += 1
+            return call_id
+
+    def get(self, call_id):
+        with self._lock:
+            return next((dict(call) for call in self._calls if call['id'] == call_id), None)
+
+    def list_calls(self, limit=50, offset=0, since=None, **filters):
+        with self._lock:
+            return [dict(call) for call in self._matching(since, filters)[offset:offset + limit]]
+
+    def count(self, since=None, **filters):
+        with self._lock:
+            return len(self._matching(since, filters))
+
+    def summary(self):
+        with self._lock:
+            return _summary(len(self._calls), self._alerts, dict(self._by_severity), dict(self._by_emotion))
+
+    def version(self):
+        with self._lock:
+            return self._version
+
+    def resolve(self, call_id):
+        with self._lock:
+            for call in self._calls:
+                if call['id'] == call_id:
+                    call['resolved'] = True
+            self._version += 1
+
+    def resolve_incident(self, incident_id):
+        with self._lock:
+            for call in self._calls:
+                if incident_id in (call['id'], call.get('incident_id')):
+                    call['resolved'] = True
+            self._version += 1
+
+    def list_open(self, severities, after_id=0, since=None):
+        with self._lock:
+            return [
+                dict(call) for call in self._calls
+                if call['id'] > after_id and not call.get('resolved') and call['severity'] in severities
+                and (not since or call['timestamp'] >= since)
+            ]
+
+    def list_range(self, since=None, until=None, limit=None):
+        with self._lock:
+            calls = sorted(
+                (call for call in self._calls
+                 if (not since or call['timestamp'] >= since) and (not until or call['timestamp'] < until)),
+                key=lambda call: (call['timestamp'], call['id'])
+            )
+            return [dict(call) for call in calls[:limit]]
+
+    def add_timing(self, call_id, stage, seconds):
+        with self._lock:
+            for call in self._calls:
+                if call['id'] == call_id:
+                    call['timings'] = dict(call.get('timings') or {}, **{stage: seconds})
+            self._version += 1
+
+    def _samples(self, since=None):
+        samples = {}
+        for call in self._calls:
+            if since and call['timestamp'] < since:
+                continue
+            for stage, seconds, ok in _timing_rows(call):
+                samples.setdefault(stage, []).append((seconds, ok))
+        return samples
+
+    def stage_timings(self, since=None):
+        with self._lock:
+            return {stage: [seconds for seconds, _ in samples] for stage, samples in self._samples(since).items()}
+
+    def stage_histograms(self, buckets):
+        with self._lock:
+            return {stage: _histogram(samples, buckets) for stage, samples in self._samples().items()}
+
+    def clear(self):
+        with self._lock:
+            self._calls = []
+            self._reset_counts()
+
+_store_factories = {
+    'sqlite': lambda location: SQLiteCallStore(location),
+    'memory': lambda location: MemoryCallStore(),
+}
+_store = None
+_store_lock = threading.Lock()
+
+def register_store(scheme, factory):
+    """Make CALL_STORE_URL=<scheme>://<location> build factory(location)"""
+    _store_factories[scheme] = factory
+
+def open_store(url):
+    scheme, _, location = url.partition('://')
+    if scheme not in _store_factories:
+        raise ValueError(f"Almacenamiento de llamadas desconocido: {url}")
+    return _store_factories[scheme](location.removeprefix('/') if scheme == 'sqlite' else location)
+
+def get_call_store():
+    """Process-wide call store configured by CALL_STORE_URL"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = open_store(os.environ.get('CALL_STORE_URL', DEFAULT_STORE_URL))
+        return _store
@@ -0,0 +1,432 @@
+"""Processing stages for emergency calls, independent of the Streamlit UI.
+
+The functions here take API keys explicitly and raise or return None on
+failure instead of emitting Streamlit elements, so they can run on worker
+threads and from the command line (see batch_processing.py).
+"""
+import json
+import os
+import queue
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from geocoding import geocode_location, geocode_offline
+from http_client import get_client
+from incident_index import find_incident
+from location_extraction import extract_location
+from tiered_cache import TieredCache, content_key
+from transcription_backends import get_transcription_backend
+from transcription_wait import TRANSCRIPTION_DEADLINE
+from triage_rules import classify, reconcile
+
+# Total time (seconds) a call may spend in analysis, summary and geocoding
+CALL_LATENCY_BUDGET = 45
+
+ANALYSIS_MODEL = 'llama-3.3-70b-versatile'
+# Bump when the analysis prompt changes so cached results are not reused
+ANALYSIS_PROMPT_VERSION = 'analisis-resumen-2'
+
+# Whether a new report of an open incident reuses the incident's analysis
+# instead of asking the LLM again (see incident_index.py)
+REUSE_INCIDENT_ANALYSIS = os.environ.get('REUSE_INCIDENT_ANALYSIS', '1') != '0'
+
+# Shared by every session and batch worker in the process
+_stage_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="pipeline")
+_analysis_cache = TieredCache(
+    disk_dir=os.environ.get('LLM_CACHE_DIR', Path(__file__).parent / '.cache' / 'llm'),
+    max_entries=256
+)
+
+# Top-level fields that can be shown before the whole analysis has arrived
+PARTIAL_TEXT_FIELDS = ('tipo_emergencia', 'severidad_general', 'ubicacion', 'emocion', 'icono_emocion', 'justificacion')
+PARTIAL_LIST_FIELDS = ('detalles_clave', 'acciones_inmediatas')
+
+_partial_text = re.compile(r'"(\w+)"\s*:\s*"((?:[^"\\]|\\.)*)"')
+_partial_list = re.compile(r'"(\w+)"\s*:\s*\[((?:\s*"(?:[^"\\]|\\.)*"\s*,?)*)')
+_list_item = re.compile(r'"((?:[^"\\]|\\.)*)"')
+
+def parse_partial_analysis(text):
+    """Fields of an analysis whose values are complete in a JSON prefix"""
+    partial = {}
+    for key, value in _partial_text.findall(text):
+        if key in PARTIAL_TEXT_FIELDS:
+            partial[key] = json.loads(f'"{value}"')
+    for key, items in _partial_list.findall(text):
+        if key in PARTIAL_LIST_FIELDS:
+            partial[key] = [json.loads(f'"{item}"') for item in _list_item.findall(items)]
+    return partial
+
+def _stream_completion(response, on_partial, timings, started):
+    """Read a server-sent event stream of chat completion deltas and return the full text"""
+    content = []
+    last_partial = {}
+    with response:
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith('data:'):
+                continue
+            payload = line[len('data:'):].strip()
+            if payload == '[DONE]':
+                break
+            delta = json.loads(payload)['choices'][0].get('delta', {}).get('content')
+            if not delta:
+                continue
+            if not content and timings is not None:
+                timings['analysis_ttft'] = time.perf_counter() - started
+            content.append(delta)
+            
+            partial = parse_partial_analysis(''.join(content))
+            if partial != last_partial:
+                last_partial = partial
+                on_partial(partial)
+    return ''.join(content)
+
+def analyze_transcript_with_llm(transcript, api_key, timeout=CALL_LATENCY_BUDGET, on_partial=None, timings=None):
+    """Analyze transcript using LLM for emotions, keywords, priority and summary
+    
+    One structured request returns both the triage analysis and the summary
+    fields (see format_summary). Results are cached by transcript, prompt
+    version and model, so re-processing a call costs no tokens.
+    
+    With on_partial the response is streamed, and on_partial(fields) is
+    called with the fields parsed so far each time one completes. The time
+    to the first token is stored in timings['analysis_ttft'].
+    """
+    if not api_key:
+        return None
+    
+    cache_key = content_key(ANALYSIS_PROMPT_VERSION, ANALYSIS_MODEL, transcript)
+    cached = _analysis_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    headers = {
+        'Authorization': f'Bearer {api_key}',
+        'Content-Type': 'application/json'
+    }
+    
+    prompt = f"""Eres un asistente de despacho de emergencias en Colombia. Analiza esta transcripción de llamada de emergencia y extrae la siguiente información en formato JSON:
+
+Transcripción: "{transcript}"
+
+Responde SOLO con un objeto JSON válido (sin texto adicional, sin markdown, sin backticks) con esta estructura, en este orden:
+{{
+    "tipo_emergencia": "Médica" o "Incendio" o "Policía" o "Otro",
+    "severidad_general": "Crítico" o "Alto" o "Medio" o "Bajo",
+    "ubicacion": "cualquier información de ubicación mencionada, o cadena vacía",
+    "acciones_inmediatas": ["qué deben saber/hacer los respondedores"],
+    "detalles_clave": ["puntos principales de la llamada"],
+    "emocion": "ESTRÉS ALTO" o "ESTRÉS MODERADO" o "CALMA",
+    "icono_emocion": "🔴" o "🟡" o "🟢",
+    "palabras_criticas": [
+        {{"categoria": "nombre de categoría", "palabra": "palabra detectada", "severidad": "ALTA" o "MEDIA"}}
+    ],
+    "justificacion": "breve explicación de por qué se asignó esta severidad"
+}}
+
+Considera:
+- ESTRÉS ALTO (🔴): pánico evidente, gritos, urgencia extrema
+- ESTRÉS MODERADO (🟡): preocupación notable pero controlada
+- CALMA (🟢): tono tranquilo y descriptivo
+
+Palabras críticas a buscar (pero no limitarse a):
+- Armas: pistola, arma, cuchillo, disparo
+- Médico: sangre, inconsciente, infarto, no respira
+- Fuego: incendio, humo, explosión
+- Violencia: asalto, secuestro, golpes
+- Vulnerable: niño, bebé, anciano, embarazada
+
+Sé conciso pero incluye toda la información crítica."""
+
+    data = {
+        'model': ANALYSIS_MODEL,
+        'messages': [{'role': 'user', 'content': prompt}],
+        'temperature': 0.1,
+        'max_tokens': 1000
+    }
+    # JSON mode cannot be streamed; the prompt alone asks for JSON then
+    if on_partial:
+        data['stream'] = True
+    else:
+        data['response_format'] = {'type': 'json_object'}
+    
+    started = time.perf_counter()
+    response = get_client('groq').post(
+        'chat/completions',
+        headers=headers,
+        json=data,
+        deadline=timeout,
+        stream=bool(on_partial)
+    )
+    
+    if response.status_code != 200:
+        raise RuntimeError(response.text)
+    
+    if on_partial:
+        content = _stream_completion(response, on_partial, timings, started)
+    else:
+        content = response.json()['choices'][0]['message']['content']
+    
+    # Clean any markdown formatting or text around the object
+    content = content.replace('```json', '').replace('```', '').strip()
+    content = content[content.find('{'):content.rfind('}') + 1]
+    
+    analysis = json.loads(content)
+    _analysis_cache.put(cache_key, analysis)
+    return analysis
+
+def cached_analysis(transcript):
+    """The cached LLM analysis of a transcript, or None; never calls the LLM"""
+    return _analysis_cache.get(content_key(ANALYSIS_PROMPT_VERSION, ANALYSIS_MODEL, transcript))
+
+def incident_analysis(incident, transcript):
+    """Analysis for a new report of an incident, from the incident's cached LLM analysis.
+    
+    The emergency type, severity, details and actions are the incident's;
+    the caller's emotion is the rule-based one for this transcript, and its
+    critical words are left for reconcile() to fill in from this transcript.
+    Returns None if the incident's analysis is not cached.
+    """
+    analysis = cached_analysis(incident['transcript'])
+    if analysis is None:
+        return None
+    provisional = classify(transcript)
+    return dict(
+        analysis,
+        emocion=provisional['emocion'],
+        icono_emocion=provisional['icono_emocion'],
+        palabras_criticas=[],
+        justificacion=f"{analysis.get('justificacion', '')} (análisis de la llamada #{incident['id']}, mismo incidente)".strip()
+    )
+
+def _as_list(value):
+    if not value:
+        return []
+    return value if isinstance(value, list) else [value]
+
+def format_summary(analysis, location_text=None, partial=False):
+    """Render the summary fields of an analysis as the dispatcher's markdown summary
+    
+    With partial=True only the fields already present are rendered, for
+    showing an analysis that is still streaming in.
+    """
+    if partial:
+        lines = []
+        for key, label in (('tipo_emergencia', 'Tipo de Emergencia'), ('severidad_general', 'Nivel de Severidad'),
+                           ('ubicacion', 'Ubicación')):
+            if key in analysis:
+                lines.append(f"- **{label}**: {analysis[key] or location_text or 'No mencionada'}")
+        for key, label in (('detalles_clave', 'Detalles Clave'), ('acciones_inmediatas', 'Acciones Inmediatas Requeridas')):
+            if analysis.get(key):
+                lines.append(f"- **{label}**:")
+                lines.extend(f"    - {item}" for item in analysis[key])
+        return "\n".join(lines)
+    
+    detalles = _as_list(analysis.get('detalles_clave')) or ["Ver transcripción"]
+    acciones = _as_list(analysis.get('acciones_inmediatas')) or ["Pendiente de análisis"]
+    lines = [
+        f"- **Tipo de Emergencia**: {analysis.get('tipo_emergencia', 'Otro')}",
+        f"- **Nivel de Severidad**: {analysis.get('severidad_general', 'Medio')}",
+        f"- **Ubicación**: {analysis.get('ubicacion') or location_text or 'No mencionada'}",
+        "- **Detalles Clave**:",
+        *(f"    - {item}" for item in detalles),
+        "- **Acciones Inmediatas Requeridas**:",
+        *(f"    - {item}" for item in acciones),
+    ]
+    return "\n".join(lines)
+
+def transcribe_audio(audio_file, api_key, on_status=None, deadline=TRANSCRIPTION_DEADLINE):
+    """Transcribe audio with the configured backend (AssemblyAI by default)
+    
+    audio_file is the recording's bytes, a path to it or a seekable file.
+    on_status, if given, is called with the current status ('uploading',
+    'queued', 'processing', 'completed') as the transcription progresses,
+    for at most `deadline` seconds. See transcription_backends.py.
+    """
+    return get_transcription_backend().transcribe(
+        audio_file, api_key, on_status=on_status, deadline=deadline
+    )
+
+
+def _timed(timings, stage, func, *args):
+    """Call func, recording its wall time in timings[stage] when timings is given"""
+    started = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        if timings is not None:
+            timings[stage] = time.perf_counter() - started
+
+def run_post_transcription(transcript, groq_key, location_text, budget=CALL_LATENCY_BUDGET, timings=None,
+                           stream=False):
+    """Run the LLM analysis (which includes the summary) and geocoding concurrently.
+    
+    Yields (stage, result, error) tuples in completion order. Stages still
+    running when the budget expires are yielded with a TimeoutError. If a
+    timings dict is given, the timings of each stage that finished within
+    the budget are stored in it.
+    With stream=True the analysis is streamed and ('analysis_partial',
+    fields, None) is yielded as its fields arrive, before 'analysis'.
+    """
+    # Partial results and finished futures arrive through one queue, in order
+    events = queue.Queue()
+    on_partial = (lambda partial: events.put(('analysis_partial', partial, None))) if stream else None
+    
+    # Each stage writes its own timings, merged once it finishes: a stage past the
+    # budget keeps running and must not change the caller's dict afterwards
+    stage_timings = {'analysis': {}, 'coords': {}} if timings is not None else {}
+    futures = {
+        _stage_executor.submit(
+            _timed, stage_timings.get('analysis'), 'analysis', analyze_transcript_with_llm,
+            transcript, groq_key, budget, on_partial, stage_timings.get('analysis')
+        ): 'analysis',
+    }
+    if location_text:
+        futures[_stage_executor.submit(
+            _timed, stage_timings.get('coords'), 'geocode', geocode_location, location_text
+        )] = 'coords'
+    for future in futures:
+        future.add_done_callback(events.put)
+    
+    expires = time.monotonic() + budget
+    pending = set(futures)
+    while pending:
+        try:
+            event = events.get(timeout=max(expires - time.monotonic(), 0))
+        except queue.Empty:
+            for future in pending:
+                future.cancel()
+                yield futures[future], None, TimeoutError(f"excedió el presupuesto de {budget} s")
+            return
+        
+        if isinstance(event, tuple):
+            yield event
+            continue
+        pending.discard(event)
+        if timings is not None:
+            timings.update(stage_timings[futures[event]])
+        try:
+            yield futures[event], event.result(), None
+        except Exception as e:
+            yield futures[event], None, e
+
+def analysis_fields(llm_analysis):
+    """Map an analysis in the LLM's JSON format to call record fields"""
+    return {
+        'emotion': llm_analysis.get('emocion', 'CALMA'),
+        'emotion_icon': llm_analysis.get('icono_emocion', '🟢'),
+        'alerts': llm_analysis.get('palabras_criticas', []),
+        'severity': llm_analysis.get('severidad_general', 'Medio'),
+        'type': llm_analysis.get('tipo_emergencia', 'Otro'),
+        'justificacion': llm_analysis.get('justificacion', '')
+    }
+
+def build_call_record(call_id, start_time, transcript, summary, location_text, fields, timings=None,
+                      stage_errors=None, coords=None, incident_id=None):
+    """Assemble the record stored in the call history and priority queue"""
+    return {
+        'id': call_id,
+        'timestamp': start_time.strftime("%Y-%m-%d %H:%M:%S"),
+        'time': start_time.strftime("%H:%M"),
+        'transcript': transcript,
+        'summary': summary,
+        'location': location_text or "Desconocida",
+        'coords': list(coords) if coords else None,
+        'severity': fields['severity'],
+        'type': fields['type'],
+        'alerts': fields['alerts'],
+        'emotion': fields['emotion'],
+        'emotion_icon': fields['emotion_icon'],
+        'details': transcript[:100] + "...",
+        'justificacion': fields['justificacion'],
+        'timings': dict(timings or {}),
+        'stage_errors': list(stage_errors or []),
+        'incident_id': incident_id
+    }
+
+def stage_failures(results):
+    """Stages of run_post_transcription that failed or ran out of time, by timing name"""
+    return ['geocode' if stage == 'coords' else stage for stage, error in results if error is not None]
+
+def finish_timings(timings, start_time):
+    """Add the total time since the call arrived at start_time"""
+    timings['total'] = (datetime.now() - start_time).total_seconds()
+    return timings
+
+def process_call(audio_file, assemblyai_key, groq_key, call_id=None, budget=CALL_LATENCY_BUDGET,
+                 start_time=None, on_event=None, timings=None):
+    """Run the full pipeline for one recording without any UI.
+    
+    Returns (call_record, coords, timings). call_record is None if no
+    transcript could be produced; errors from the analysis and geocoding
+    stages only degrade the record to the rule-based analysis.
+    
+    on_event(kind, value), if given, is called with the progress: 'status'
+    with each transcription status, 'transcript' once it is available and
+    'analysis_partial' with the analysis fields as they stream in.
+    
+    timings, if given, holds durations measured before the call got here
+    (such as the time it waited in a queue); the returned timings add the
+    duration of every stage. The upload is timed from the 'uploading'
+    status to the next one and is not counted in 'transcription'.
+    
+    A call near an open incident (see incident_index.py) gets its
+    'incident_id'. If the location is geocoded without the network and the
+    incident's analysis is cached, that analysis is reused and the LLM and
+    geocoding stages are skipped.
+    """
+    start_time = start_time or datetime.now()
+    timings = dict(timings or {})
+    upload_started = []
+    
+    def on_status(status):
+        if status == 'uploading':
+            upload_started.append(time.perf_counter())
+        elif upload_started and 'upload' not in timings:
+            timings['upload'] = time.perf_counter() - upload_started[0]
+        if on_event:
+            on_event('status', status)
+    
+    transcript = _timed(timings, 'transcription', transcribe_audio, audio_file, assemblyai_key, on_status)
+    timings['transcription'] -= timings.get('upload', 0)
+    if not transcript:
+        return None, None, timings
+    if on_event:
+        on_event('transcript', transcript)
+    
+    location_text = _timed(timings, 'extraction', extract_location, transcript)
+    results = {}
+    errors = []
+    incident = None
+    
+    known_coords = geocode_offline(location_text) if location_text and REUSE_INCIDENT_ANALYSIS else None
+    if known_coords:
+        incident = find_incident(known_coords, start_time.timestamp())
+        reused = incident_analysis(incident, transcript) if incident else None
+        if reused:
+            results = {'analysis': reused, 'coords': known_coords}
+    
+    if not results:
+        for stage, result, error in run_post_transcription(
+            transcript, groq_key, location_text, budget=budget, timings=timings, stream=bool(on_event)
+        ):
+            if stage == 'analysis_partial':
+                on_event(stage, result)
+            else:
+                results[stage] = result
+                errors.append((stage, error))
+    
+    coords = results.get('coords')
+    if coords and not known_coords:
+        incident = find_incident(coords, start_time.timestamp())
+    
+    analysis = reconcile(classify(transcript), results.get('analysis'))
+    summary = format_summary(analysis, location_text)
+    call_record = build_call_record(
+        call_id, start_time, transcript, summary, location_text, analysis_fields(analysis),
+        finish_timings(timings, start_time), stage_failures(errors), coords,
+        incident['id'] if incident else None
+    )
+    return call_record, coords, timings
@@ -1,12 +1,31 @@
 import streamlit as st
-import requests
-import json
-from datetime import datetime
-import re
-import folium
-from streamlit_folium import st_folium
-from geopy.geocoders import Nominatim
-import pandas as pd
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+import html
+import importlib
+import math
+import threading
+import time
+
+from emergency_pipeline import (
+    analysis_fields,
+    build_call_record,
+    extract_location,
+    finish_timings,
+    format_summary,
+    run_post_transcription,
+    stage_failures,
+)
+from triage_rules import classify, keyword_spans, reconcile
+from transcription_backends import get_transcription_backend
+from call_store import get_call_store
+from priority_queue import SEVERITIES, URGENT_SEVERITIES, effective_severity, get_priority_queue
+from batch_processing import AUDIO_EXTENSIONS, BatchStats
+from job_queue import ensure_workers, get_job_queue
+from live_transcription import follow_file, socket_chunks, transcribe_live
+from metrics import REPORTED_PERCENTILES, get_metrics_server, stage_percentiles
+from incident_map import ACTIVE_WINDOW_HOURS, base_map, feature_group, get_incident_layer
+from incident_index import find_incident, get_incident_index
 
 # Configure the page
 st.set_page_config(
@@ -24,135 +43,52 @@ except:
     ASSEMBLYAI_API_KEY = "tu_clave_assemblyai_aqui"
     GROQ_API_KEY = "tu_clave_groq_aqui"
 
+# Calls and the priority queue live once per process and are shared by every session
+call_store = get_call_store()
+priority_queue = get_priority_queue()
+
+# Queued calls rendered at once
+QUEUE_PAGE_SIZE = 10
+
+# Calls are processed by background worker processes; the page polls their jobs
+job_queue = get_job_queue()
+ensure_workers(ASSEMBLYAI_API_KEY, GROQ_API_KEY)
+
+# Operations map, refreshed in place without reloading the page
+incident_layer = get_incident_layer()
+MAP_REFRESH_SECONDS = 10
+SEVERITY_ICONS = {'Crítico': '🔴', 'Alto': '🟠', 'Medio': '🟡', 'Bajo': '🟢'}
+
+# Imported on first use, so a new process serves its first page without them
+PRELOADED_MODULES = ('folium', 'streamlit_folium', 'pandas', 'geopy.geocoders')
+
+# Prometheus endpoint, when METRICS_PORT is set
+get_metrics_server(call_store)
+# Time windows of the "Rendimiento" panel, in hours (None for every call)
+PERFORMANCE_WINDOWS = {"Última hora": 1, "Últimas 24 horas": 24, "Últimos 7 días": 24 * 7, "Todo": None}
+# Days shown by default in the "Histórico" tab
+HISTORY_DAYS = 30
+HISTORY_COLUMNS = ['timestamp', 'type', 'severity', 'barrio', 'alerts']
+JOB_POLL_SECONDS = 1
+JOB_PROGRESS = {
+    'queued': (5, "En cola"),
+    'starting': (10, "Iniciando"),
+    'uploading': (20, "Subiendo audio"),
+    'processing': (50, "Transcribiendo"),
+    'completed': (70, "Transcripción completada"),
+    'analyzing': (80, "Analizando con IA"),
+}
+
 # Initialize session state
-if 'call_history' not in st.session_state:
-    st.session_state.call_history = []
-if 'priority_queue' not in st.session_state:
-    st.session_state.priority_queue = []
 if 'assemblyai_key' not in st.session_state:
     st.session_state.assemblyai_key = ASSEMBLYAI_API_KEY
 if 'groq_key' not in st.session_state:
     st.session_state.groq_key = GROQ_API_KEY
 
-def analyze_transcript_with_llm(transcript):
-    """Analyze transcript using LLM for emotions, keywords, and priority"""
-    api_key = st.session_state.get('groq_key', '')
-    
-    if not api_key:
-        return None
-    
-    headers = {
-        'Authorization': f'Bearer {api_key}',
-        'Content-Type': 'application/json'
-    }
-    
-    prompt = f"""Analiza esta transcripción de llamada de emergencia y extrae la siguiente información en formato JSON:
-
-Transcripción: "{transcript}"
-
-Responde SOLO con un objeto JSON válido (sin texto adicional, sin markdown, sin backticks) con esta estructura:
-{{
-    "emocion": "ESTRÉS ALTO" o "ESTRÉS MODERADO" o "CALMA",
-    "icono_emocion": "🔴" o "🟡" o "🟢",
-    "palabras_criticas": [
-        {{"categoria": "nombre de categoría", "palabra": "palabra detectada", "severidad": "ALTA" o "MEDIA"}}
-    ],
-    "severidad_general": "Crítico" o "Alto" o "Medio" o "Bajo",
-    "tipo_emergencia": "Médica" o "Incendio" o "Policía" o "Otro",
-    "justificacion": "breve explicación de por qué se asignó esta severidad"
-}}
-
-Considera:
-- ESTRÉS ALTO (🔴): pánico evidente, gritos, urgencia extrema
-- ESTRÉS MODERADO (🟡): preocupación notable pero controlada
-- CALMA (🟢): tono tranquilo y descriptivo
-
-Palabras críticas a buscar (pero no limitarse a):
-- Armas: pistola, arma, cuchillo, disparo
-- Médico: sangre, inconsciente, infarto, no respira
-- Fuego: incendio, humo, explosión
-- Violencia: asalto, secuestro, golpes
-- Vulnerable: niño, bebé, anciano, embarazada"""
-
-    data = {
-        'model': 'llama-3.3-70b-versatile',
-        'messages': [{'role': 'user', 'content': prompt}],
-        'temperature': 0.1,
-        'max_tokens': 500
-    }
-    
-    try:
-        response = requests.post(
-            'https://api.groq.com/openai/v1/chat/completions',
-            headers=headers,
-            json=data,
-            timeout=30
-        )
-        
-        if response.status_code != 200:
-            return None
-        
-        content = response.json()['choices'][0]['message']['content'].strip()
-        
-        # Clean any markdown formatting
-        content = content.replace('```json', '').replace('```', '').strip()
-        
-        analysis = json.loads(content)
-        return analysis
-    except Exception as e:
-        st.warning(f"Error en análisis LLM: {str(e)}")
-        return None
-
-def extract_location(text):
-    """Extract potential location information from text"""
-    # Colombian address patterns
-    patterns = [
-        r'(?:calle|carrera|avenida|transversal|diagonal|circunvalar)\s+\d+[a-z]?\s*#?\s*\d+-?\d*',
-        r'kr?\s*\.?\s*\d+[a-z]?\s*#?\s*\d+-?\d*',
-        r'cl?\s*\.?\s*\d+[a-z]?\s*#?\s*\d+-?\d*',
-        r'av?\s*\.?\s*\d+[a-z]?\s*#?\s*\d+-?\d*',
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            return match.group(0)
-    
-    # Also look for neighborhood/locality mentions
-    locality_pattern = r'(?:barrio|localidad|sector)\s+([A-ZÁÉÍÓÚÑ][a-záéíóúñ\s]+)'
-    locality_match = re.search(locality_pattern, text, re.IGNORECASE)
-    if locality_match:
-        return locality_match.group(0)
-    
-    return None
-
-def geocode_location(address):
-    """Convert address to coordinates"""
-    try:
-        geolocator = Nominatim(user_agent="emergency_app_colombia", timeout=10)
-        
-        # Try multiple variations
-        search_queries = [
-            f"{address}, Bogotá, Colombia",
-            f"{address}, Colombia",
-            f"Bogotá, {address}, Colombia"
-        ]
-        
-        for query in search_queries:
-            try:
-                location = geolocator.geocode(query)
-                if location:
-                    return location.latitude, location.longitude
-            except:
-                continue
-        
-        return None
-    except Exception as e:
-        st.warning(f"Error al geocodificar: {str(e)}")
-        return None
-
 def create_map(lat, lon, address):
     """Create map with emergency location"""
+    import folium
+    
     m = folium.Map(location=[lat, lon], zoom_start=16)
     
     # Add emergency location marker
@@ -175,138 +111,481 @@ def create_map(lat, lon, address):
     
     return m
 
-def transcribe_audio(audio_file):
-    """Transcribe audio using AssemblyAI's free tier"""
-    api_key = st.session_state.get('assemblyai_key', '')
+@st.cache_data(max_entries=64)
+def count_calls(version, severity, call_type):
+    """Calls matching the filters; version is the store version, so the result is reused until calls change"""
+    return call_store.count(severity=severity, type=call_type)
+
+@st.cache_data(max_entries=64)
+def calls_page(version, severity, call_type, page_size, page):
+    """One page of the history table as a DataFrame, cached per store version"""
+    import pandas as pd
     
-    if not api_key:
-        st.error("Por favor ingrese su clave API de AssemblyAI en la barra lateral")
-        return None
+    page_calls = call_store.list_calls(
+        limit=page_size, offset=(page - 1) * page_size, severity=severity, type=call_type
+    )
+    return pd.DataFrame([
+        {
+            'ID': call['id'],
+            'Hora': call['timestamp'],
+            'Tipo': call['type'],
+            'Severidad': call['severity'],
+            'Ubicación': call['location'],
+            'Emoción': call['emotion']
+        }
+        for call in page_calls
+    ], columns=['ID', 'Hora', 'Tipo', 'Severidad', 'Ubicación', 'Emoción'])
+
+@st.cache_data(max_entries=16)
+def performance_table(version, since):
+    """Stage latency percentiles as a DataFrame, cached per store version"""
+    import pandas as pd
     
-    headers = {'authorization': api_key}
+    rows = stage_percentiles(call_store, since=since)
+    return pd.DataFrame([
+        {
+            'Etapa': row['label'],
+            'Muestras': row['count'],
+            **{f'p{pct} (s)': row[f'p{pct}'] for pct in REPORTED_PERCENTILES}
+        }
+        for row in rows
+    ], columns=['Etapa', 'Muestras', *(f'p{pct} (s)' for pct in REPORTED_PERCENTILES)])
+
+@st.cache_data(max_entries=4)
+def archive_calls(version):
+    """Bring the Parquet call archive up to date, once per store version"""
+    import call_archive
     
-    # Upload audio file
-    with st.spinner('Subiendo audio...'):
-        upload_response = requests.post(
-            'https://api.assemblyai.com/v2/upload',
-            headers=headers,
-            data=audio_file
-        )
-        
-        if upload_response.status_code != 200:
-            st.error(f"Error al subir: {upload_response.text}")
-            return None
-            
-        audio_url = upload_response.json()['upload_url']
+    return call_archive.export_calls(call_store)
+
+@st.cache_data(max_entries=16)
+def history_report(version, since, until):
+    """Aggregations of the archived calls of the days from since up to until, cached per store version"""
+    import call_archive
     
-    # Request transcription with Spanish language
-    with st.spinner('Transcribiendo audio...'):
-        transcript_request = {
-            'audio_url': audio_url,
-            'language_code': 'es'  # Spanish
-        }
-        
-        transcript_response = requests.post(
-            'https://api.assemblyai.com/v2/transcript',
-            json=transcript_request,
-            headers=headers
+    table = call_archive.load_calls(since=since, until=until, columns=HISTORY_COLUMNS)
+    return {
+        'calls': table.num_rows,
+        'by_hour_type': call_archive.calls_by_hour(table, 'type'),
+        'by_hour_severity': call_archive.calls_by_hour(table, 'severity'),
+        'by_day': call_archive.calls_by_day(table),
+        'hot_spots': call_archive.hot_spots(table),
+        'alerts': call_archive.alert_frequencies(table),
+    }
+
+@st.cache_resource
+def preload_modules():
+    """Import PRELOADED_MODULES in a background thread, once per process"""
+    def preload():
+        for name in PRELOADED_MODULES:
+            importlib.import_module(name)
+    
+    thread = threading.Thread(target=preload, name="preload", daemon=True)
+    thread.start()
+    return thread
+
+@contextmanager
+def timed(timings, stage):
+    """Add the wall time of the block to timings[stage]"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0) + time.perf_counter() - started
+
+def highlight_keywords(text, palabras_criticas):
+    """Highlight critical keywords in text, in a single pass over it"""
+    parts = []
+    last = 0
+    for start, end, severidad in keyword_spans(text, palabras_criticas or []):
+        color = 'red' if severidad == 'ALTA' else 'orange'
+        parts.append(html.escape(text[last:start], quote=False))
+        parts.append(
+            f'<span style="background-color:{color};color:white;padding:2px 4px;border-radius:3px;font-weight:bold;">'
+            f'{html.escape(text[start:end], quote=False)}</span>'
         )
-        
-        if transcript_response.status_code != 200:
-            st.error(f"Error en solicitud de transcripción: {transcript_response.text}")
-            return None
-            
-        transcript_id = transcript_response.json()['id']
+        last = end
+    parts.append(html.escape(text[last:], quote=False))
+    return ''.join(parts)
+
+def api_keys_missing():
+    """Whether a key needed by the configured services is missing from the sidebar"""
+    needs_assemblyai = get_transcription_backend().requires_api_key
+    return (needs_assemblyai and not st.session_state.get('assemblyai_key')) or not st.session_state.get('groq_key')
+
+def save_call(call_record):
+    """Store a processed call and, if urgent, add it to the priority queue"""
+    call_record['id'] = call_store.add(call_record)
     
-    # Poll for completion
-    polling_endpoint = f'https://api.assemblyai.com/v2/transcript/{transcript_id}'
+    if call_record['severity'] in URGENT_SEVERITIES:
+        priority_queue.push(call_record)
     
-    progress_bar = st.progress(0)
-    status_text = st.empty()
+    return call_record['id']
+
+def render_analysis(fields, transcript, error=None, pending=False):
+    """Render alerts, emotion, severity and the highlighted transcript"""
+    palabras_criticas = fields['alerts']
     
-    while True:
-        polling_response = requests.get(polling_endpoint, headers=headers)
-        transcript_result = polling_response.json()
-        
-        status = transcript_result['status']
-        status_text.text(f"Estado: {status}")
-        
-        if status == 'completed':
-            progress_bar.progress(100)
-            status_text.empty()
-            return transcript_result['text']
-        elif status == 'error':
-            st.error(f"Error en transcripción: {transcript_result.get('error', 'Error desconocido')}")
-            return None
+    if pending:
+        st.info("⏳ Clasificación preliminar por palabras clave - analizando llamada con IA...")
+    if error:
+        st.warning(f"Error en análisis LLM: {str(error)}")
+    
+    # Alert section
+    if palabras_criticas:
+        st.error("🚨 PALABRAS CRÍTICAS DETECTADAS")
+        alert_cols = st.columns(min(len(palabras_criticas), 4))
+        for i, alert in enumerate(palabras_criticas[:4]):
+            with alert_cols[i]:
+                st.markdown(f"""
+                <div style='background-color:#ff4444;padding:10px;border-radius:5px;text-align:center;color:white;'>
+                    <b>{alert.get('categoria', 'ALERTA').upper()}</b><br/>
+                    {alert.get('palabra', '')}
+                </div>
+                """, unsafe_allow_html=True)
+    
+    # Emotion analysis
+    col_em1, col_em2 = st.columns([1, 3])
+    with col_em1:
+        st.info(f"{fields['emotion_icon']} Estado Emocional: **{fields['emotion']}**")
+    with col_em2:
+        st.info(f"🎯 Severidad: **{fields['severity']}** | Tipo: **{fields['type']}**")
+    
+    if fields['justificacion']:
+        st.caption(f"💡 {fields['justificacion']}")
+    
+    # Display transcript with highlights
+    st.success("✅ Transcripción completada")
+    highlighted_text = highlight_keywords(transcript, palabras_criticas)
+    st.markdown(highlighted_text, unsafe_allow_html=True)
+
+def render_location_map(location_text, coords, key, error=None):
+    """Render the map of a geocoded location, or why there is none"""
+    st.subheader("🗺️ Mapa de Ubicación")
+    st.info(f"📍 Ubicación detectada: **{location_text}**")
+    
+    if error:
+        st.warning(f"Error al geocodificar: {str(error)}")
+    elif coords:
+        try:
+            from streamlit_folium import st_folium
+            
+            emergency_map = create_map(coords[0], coords[1], location_text)
+            # Use a unique key and return_on_hover=False to prevent reloading
+            map_data = st_folium(
+                emergency_map, 
+                width=700, 
+                height=400, 
+                key=key,
+                returned_objects=[]
+            )
+        except Exception as e:
+            st.warning(f"No se pudo mostrar el mapa: {str(e)}")
+            st.write("Coordenadas:", coords)
+    else:
+        st.warning(f"No se pudo geocodificar la ubicación: {location_text}")
+
+def call_fields(call):
+    """Analysis fields of a stored call record, as render_analysis expects them"""
+    return {
+        'emotion': call['emotion'],
+        'emotion_icon': call.get('emotion_icon', '⚪'),
+        'alerts': call['alerts'],
+        'severity': call['severity'],
+        'type': call['type'],
+        'justificacion': call.get('justificacion', '')
+    }
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def render_pending_job(job_id):
+    """Progress of a queued or running call job, refreshed until it finishes"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return
+    if job['status'] in ('done', 'error'):
+        # Render the result once, outside the polling fragment
+        st.rerun()
+    
+    st.subheader("📝 Transcripción")
+    percent, label = JOB_PROGRESS.get(job['stage'], (50, job['stage']))
+    st.progress(percent, text=f"Estado: {label}")
+    
+    if job['transcript']:
+        # The transcript is ready: show the rule-based triage while the LLM works
+        st.subheader("🤖 Análisis Inteligente")
+        render_analysis(analysis_fields(classify(job['transcript'])), job['transcript'], pending=True)
         
-        progress_bar.progress(50)
-        import time
-        time.sleep(3)
+        st.divider()
+        st.subheader("📋 Resumen de Emergencia")
+        if job['partial']:
+            st.info("⏳ Recibiendo resumen de emergencia...")
+            st.markdown(format_summary(job['partial'], extract_location(job['transcript']), partial=True))
+        else:
+            st.info("⏳ Generando resumen de emergencia...")
 
-def generate_summary(transcript):
-    """Generate summary using Groq's free API"""
-    api_key = st.session_state.get('groq_key', '')
+def render_job_result(job):
+    """Render a finished call job, recording how long the first rendering took"""
+    timings = {}
+    with timed(timings, 'render'):
+        call = render_job_call(job)
+    rendered = st.session_state.setdefault('rendered_jobs', set())
+    if call and job['id'] not in rendered:
+        rendered.add(job['id'])
+        call_store.add_timing(call['id'], 'render', timings['render'])
+
+def render_job_call(job):
+    """Render a finished call job from its stored call record and return the call"""
+    if job['status'] == 'error':
+        st.error(f"Error al procesar la llamada: {job['error']}")
+        return
+    call = call_store.get(job['call_id'])
+    if call is None:
+        st.warning("La llamada ya no está en el historial")
+        return
     
-    if not api_key:
-        st.error("Por favor ingrese su clave API de Groq en la barra lateral")
-        return None
+    if call.get('incident_id'):
+        st.info(f"🔗 Mismo incidente que la llamada #{call['incident_id']}")
     
-    headers = {
-        'Authorization': f'Bearer {api_key}',
-        'Content-Type': 'application/json'
-    }
+    st.subheader("🤖 Análisis Inteligente")
+    render_analysis(call_fields(call), call['transcript'])
     
-    prompt = f"""Eres un asistente de despacho de emergencias en Colombia. Analiza esta transcripción de llamada de emergencia y proporciona un resumen estructurado.
+    st.divider()
+    
+    st.subheader("📋 Resumen de Emergencia")
+    st.success("✅ Resumen generado")
+    st.markdown(call['summary'])
+    timings = job['timings'] or {}
+    if 'analysis_ttft' in timings:
+        st.caption(f"⏱️ Primer token en {timings['analysis_ttft']:.2f} s · análisis completo en {timings.get('analysis', 0):.2f} s")
+    
+    st.divider()
+    
+    if call['location'] != "Desconocida":
+        render_location_map(call['location'], job['coords'], f"map_job_{job['id']}")
+    else:
+        st.warning("⚠️ No se detectó ninguna ubicación específica en la llamada")
+    
+    st.divider()
+    st.button("📋 Copiar Resumen al Portapapeles", width="stretch", key=f"copy_job_{job['id']}")
+    st.success(f"✅ Llamada #{call['id']} procesada y guardada en el historial")
 
-Transcripción: {transcript}
+def batch_stats(jobs):
+    """Throughput and stage latency of a batch of finished jobs"""
+    stats = BatchStats()
+    for job in jobs:
+        stats.record(job['timings'] or {}, job['status'] == 'done')
+    # Measured on the jobs' own clock, from first submission to last result
+    stats.started = min(job['submitted_at'] for job in jobs)
+    stats.finished = max(job['finished_at'] for job in jobs)
+    return stats
 
-Proporciona un resumen en el siguiente formato:
-- **Tipo de Emergencia**: [Médica/Incendio/Policía/Otro]
-- **Nivel de Severidad**: [Crítico/Alto/Medio/Bajo]
-- **Ubicación**: [Extrae cualquier información de ubicación mencionada]
-- **Detalles Clave**: [Puntos principales de la llamada]
-- **Acciones Inmediatas Requeridas**: [Qué deben saber/hacer los respondedores]
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def render_pending_batch(job_ids):
+    """Progress of a batch of call jobs, refreshed until all of them finish"""
+    jobs = job_queue.get_many(job_ids)
+    finished = [job for job in jobs if job['status'] in ('done', 'error')]
+    if len(finished) == len(jobs):
+        st.rerun()
+    st.progress(len(finished) / max(len(jobs), 1), text=f"{len(finished)} de {len(jobs)} llamadas procesadas")
+    render_batch_log(finished)
 
-Sé conciso pero incluye toda la información crítica."""
+def render_batch_log(jobs):
+    for job in jobs:
+        if job['status'] == 'done':
+            call = call_store.get(job['call_id'])
+            if call:
+                st.write(f"✅ {job['name']}: Llamada #{call['id']} - {call['severity']} - {call['type']}")
+        else:
+            st.warning(f"❌ {job['name']}: {job['error'] or 'sin transcripción o resumen'}")
 
-    data = {
-        'model': 'llama-3.3-70b-versatile',
-        'messages': [{'role': 'user', 'content': prompt}],
-        'temperature': 0.3,
-        'max_tokens': 1000
-    }
+@st.fragment(run_every=MAP_REFRESH_SECONDS)
+def render_operations_map():
+    """City-wide map of the active incidents"""
+    from streamlit_folium import st_folium
     
-    with st.spinner('Generando resumen de emergencia...'):
-        response = requests.post(
-            'https://api.groq.com/openai/v1/chat/completions',
-            headers=headers,
-            json=data
-        )
+    priority_queue.sync(call_store)
+    incident_layer.refresh(call_store, priority_queue)
+    # The clustered layer is rebuilt only when an incident changed
+    if st.session_state.get('incident_revision') != incident_layer.revision:
+        st.session_state.incident_group = feature_group(incident_layer.markers())
+        st.session_state.incident_revision = incident_layer.revision
+    
+    counts = incident_layer.counts()
+    for col, severity in zip(st.columns(len(SEVERITIES)), SEVERITIES):
+        col.metric(f"{SEVERITY_ICONS[severity]} {severity}", counts.get(severity, 0))
+    
+    # Same base map and key on every run: only the incident layer is replaced
+    st_folium(
+        base_map(),
+        key="operations_map",
+        feature_group_to_add=st.session_state.incident_group,
+        height=600,
+        use_container_width=True,
+        returned_objects=[]
+    )
+    st.caption(
+        f"{sum(counts.values())} incidentes activos: llamadas abiertas de las últimas {ACTIVE_WINDOW_HOURS} horas "
+        f"y la cola de prioridad. Se actualiza cada {MAP_REFRESH_SECONDS} s."
+    )
+
+    # Calls outside the priority queue have no Resolver button there, so they are resolved here
+    others = {call_id: marker for call_id, marker in incident_layer.markers().items() if call_id not in priority_queue}
+    if others:
+        col1, col2 = st.columns([3, 1], vertical_alignment="bottom")
+        with col1:
+            call_id = st.selectbox(
+                "Llamadas fuera de la cola de prioridad",
+                list(others),
+                format_func=lambda call_id: others[call_id]['label'],
+                key="map_resolve_call"
+            )
+        with col2:
+            # Resolved in the callback, so the rerun it triggers already drops the marker;
+            # every call about the incident is resolved with it
+            st.button(
+                "✅ Resolver",
+                key="map_resolve",
+                on_click=call_store.resolve_incident,
+                args=(others[call_id]['incident_id'],)
+            )
+
+def render_history():
+    """Calls per hour, hot spots and alerts over the archived call history"""
+    today = date.today()
+    col1, col2 = st.columns(2)
+    with col1:
+        since = st.date_input("Desde", value=today - timedelta(days=HISTORY_DAYS), max_value=today)
+    with col2:
+        until = st.date_input("Hasta", value=today, max_value=today)
+    
+    # Calls are archived as they arrive, so the current day is always included
+    version = call_store.version()
+    archive_calls(version)
+    report = history_report(version, since.isoformat(), (until + timedelta(days=1)).isoformat())
+    if not report['calls']:
+        st.info("No hay llamadas archivadas en este periodo.")
+        return
+    
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Llamadas en el periodo", report['calls'])
+    col2.metric("Alertas", int(report['alerts'].sum()))
+    col3.metric("Zona con más llamadas", report['hot_spots'].index[0] if len(report['hot_spots']) else "-")
+    
+    st.subheader("Llamadas por hora del día")
+    grouping = st.radio("Agrupar por", ["Tipo", "Severidad"], horizontal=True)
+    st.bar_chart(report['by_hour_type'] if grouping == "Tipo" else report['by_hour_severity'])
+    
+    st.subheader("Llamadas por día")
+    st.line_chart(report['by_day'])
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.subheader("Zonas con más llamadas")
+        st.dataframe(report['hot_spots'], use_container_width=True)
+    with col2:
+        st.subheader("Alertas por categoría")
+        st.bar_chart(report['alerts'])
+    
+    st.download_button(
+        "⬇️ Descargar llamadas por día (CSV)",
+        report['by_day'].to_csv(),
+        file_name=f"llamadas_{since}_{until}.csv",
+        mime="text/csv"
+    )
+    st.caption("Calculado sobre el archivo Parquet de llamadas. Para reportes por línea de comandos: python call_archive.py report")
+
+def render_call_analysis(transcript, start_time):
+    """Run and render the post-transcription stages, saving the call when done"""
+    # A live call is ready for analysis when it ends, so totals count from here
+    arrived = datetime.now()
+    timings = {}
+    
+    # Location extraction is local, so geocoding can start with the LLM stages
+    with timed(timings, 'extraction'):
+        location_text = extract_location(transcript)
+    
+    # Panels are filled in as each stage finishes
+    with timed(timings, 'render'):
+        st.subheader("🤖 Análisis Inteligente")
+        analysis_panel = st.empty()
+        
+        st.divider()
         
-        if response.status_code != 200:
-            st.error(f"Error al generar resumen: {response.text}")
-            return None
+        st.subheader("📋 Resumen de Emergencia")
+        summary_panel = st.empty()
+        summary_panel.info("⏳ Generando resumen de emergencia...")
         
-        return response.json()['choices'][0]['message']['content']
-
-def highlight_keywords(text, palabras_criticas):
-    """Highlight critical keywords in text"""
-    if not palabras_criticas:
-        return text
-    
-    highlighted = text
-    for item in palabras_criticas:
-        palabra = item.get('palabra', '')
-        severidad = item.get('severidad', 'MEDIA')
-        color = 'red' if severidad == 'ALTA' else 'orange'
+        st.divider()
         
-        highlighted = re.sub(
-            f'({re.escape(palabra)})',
-            f'<span style="background-color:{color};color:white;padding:2px 4px;border-radius:3px;font-weight:bold;">\\1</span>',
-            highlighted,
-            flags=re.IGNORECASE
-        )
-    return highlighted
+        map_panel = st.empty()
+        if location_text:
+            map_panel.info(f"📍 Ubicación detectada: **{location_text}** - generando mapa...")
+        else:
+            map_panel.warning("⚠️ No se detectó ninguna ubicación específica en la llamada")
+        
+        # Rule-based triage is shown right away and refined when the LLM answers
+        provisional = classify(transcript)
+        fields = analysis_fields(provisional)
+        with analysis_panel.container():
+            render_analysis(fields, transcript, pending=True)
+    
+    analysis = provisional
+    summary = None
+    coords = None
+    errors = []
+    
+    for stage, result, error in run_post_transcription(
+        transcript, st.session_state.get('groq_key'), location_text, timings=timings, stream=True
+    ):
+        if stage != 'analysis_partial':
+            errors.append((stage, error))
+        
+        with timed(timings, 'render'):
+            if stage == 'analysis_partial':
+                # Streamed fields are shown as soon as each one is complete
+                with summary_panel.container():
+                    st.info("⏳ Recibiendo resumen de emergencia...")
+                    st.markdown(format_summary(result, location_text, partial=True))
+            
+            elif stage == 'analysis':
+                # The same LLM response carries the analysis and the summary
+                analysis = reconcile(provisional, result)
+                fields = analysis_fields(analysis)
+                with analysis_panel.container():
+                    render_analysis(fields, transcript, error=error)
+                
+                summary = format_summary(analysis, location_text)
+                with summary_panel.container():
+                    if result:
+                        st.success("✅ Resumen generado")
+                    else:
+                        st.warning("⚠️ Resumen preliminar: análisis LLM no disponible")
+                    st.markdown(summary)
+                    if 'analysis_ttft' in timings:
+                        st.caption(f"⏱️ Primer token en {timings['analysis_ttft']:.2f} s · análisis completo en {timings.get('analysis', 0):.2f} s")
+            
+            elif stage == 'coords':
+                coords = result
+                with map_panel.container():
+                    render_location_map(location_text, result, f"map_{start_time.timestamp()}", error)
+    
+    st.divider()
+    
+    # Copy summary button
+    st.button("📋 Copiar Resumen al Portapapeles", width="stretch")
+    
+    # Calls near an open incident are grouped with it
+    incident = find_incident(coords, start_time.timestamp()) if coords else None
+    
+    # Save to history and priority queue
+    call_id = save_call(build_call_record(
+        None, start_time, transcript, summary or format_summary(analysis, location_text), location_text, fields,
+        finish_timings(timings, arrived), stage_failures(errors), coords, incident['id'] if incident else None
+    ))
+    
+    st.success(f"✅ Llamada #{call_id} procesada y guardada en el historial")
+    if incident:
+        st.info(f"🔗 Mismo incidente que la llamada #{incident['id']}")
 
 # Sidebar
 with st.sidebar:
@@ -326,11 +605,13 @@ GROQ_API_KEY = "tu_clave_aqui"
     
     # Call history section
     st.header("📋 Historial de Llamadas")
-    if st.session_state.call_history:
-        st.metric("Total de Llamadas Hoy", len(st.session_state.call_history))
+    calls_today = call_store.count(since=datetime.now().strftime("%Y-%m-%d"))
+    if calls_today:
+        st.metric("Total de Llamadas Hoy", calls_today)
         if st.button("Limpiar Historial"):
-            st.session_state.call_history = []
-            st.session_state.priority_queue = []
+            call_store.clear()
+            priority_queue.clear()
+            get_incident_index().clear()
             st.rerun()
     else:
         st.info("No hay llamadas procesadas aún")
@@ -340,26 +621,26 @@ st.title("🚨 Sistema de Transcripción de Emergencias")
 st.markdown("### Centro de Despacho 123 - Colombia")
 
 # Priority Queue Dashboard
-if st.session_state.priority_queue:
+# Calls finished by background workers join the queue here
+priority_queue.sync(call_store)
+if len(priority_queue):
     st.header("🚦 Cola de Prioridad de Emergencias Activas")
     
-    # Sort by severity
-    severity_order = {'Crítico': 0, 'Alto': 1, 'Medio': 2, 'Bajo': 3}
-    sorted_queue = sorted(
-        st.session_state.priority_queue,
-        key=lambda x: severity_order.get(x.get('severity', 'Bajo'), 4)
-    )
+    # Only one page of the queue is rendered, already ordered by severity and waiting time
+    queue_pages = max(math.ceil(len(priority_queue) / QUEUE_PAGE_SIZE), 1)
+    queue_page = 1
+    if queue_pages > 1:
+        queue_page = st.number_input("Página de la cola", min_value=1, max_value=queue_pages, value=1)
+        st.caption(f"{len(priority_queue)} llamadas activas · página {queue_page} de {queue_pages}")
     
-    for i, call in enumerate(sorted_queue):
-        severity_colors = {
-            'Crítico': '🔴',
-            'Alto': '🟠',
-            'Medio': '🟡',
-            'Bajo': '🟢'
-        }
+    for call in priority_queue.ordered(limit=QUEUE_PAGE_SIZE, offset=(queue_page - 1) * QUEUE_PAGE_SIZE):
+        severity = effective_severity(call)
+        escalated = f" (escalada desde {call['severity']})" if severity != call['severity'] else ""
+        reports = priority_queue.reports(call['id'])
+        reported = f" - {reports} llamadas" if reports > 1 else ""
         
         with st.expander(
-            f"{severity_colors.get(call['severity'], '⚪')} Llamada #{call['id']} - {call['type']} - {call['severity']} - {call['time']}"
+            f"{SEVERITY_ICONS.get(severity, '⚪')} Llamada #{call['id']} - {call['type']} - {severity}{escalated}{reported} - {call['time']}"
         ):
             col1, col2 = st.columns([2, 1])
             with col1:
@@ -367,18 +648,24 @@ if st.session_state.priority_queue:
                 st.write(f"**Detalles:** {call.get('details', 'N/A')}")
             with col2:
                 if st.button(f"✅ Resolver", key=f"resolve_{call['id']}"):
-                    st.session_state.priority_queue = [c for c in st.session_state.priority_queue if c['id'] != call['id']]
+                    # Every call about the incident is resolved with it
+                    priority_queue.remove(call['id'])
+                    call_store.resolve_incident(call.get('incident_id') or call['id'])
                     st.rerun()
 
 st.divider()
 
-# Tabs
-tab1, tab2 = st.tabs(["📁 Procesar Audio", "📊 Analíticas"])
+# Tabs; switching tabs reruns the page so the analytics, the map and the history only run while open
+tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(
+    ["📁 Procesar Audio", "📊 Analíticas", "📦 Procesamiento por Lotes", "🔴 Llamada en Vivo", "🗺️ Mapa Operativo", "📈 Histórico"],
+    key="main_tab",
+    on_change="rerun"
+)
 
 with tab1:
     uploaded_file = st.file_uploader(
         "Cargar Audio de Emergencia",
-        type=['mp3', 'wav', 'm4a', 'flac', 'ogg'],
+        type=AUDIO_EXTENSIONS,
         help="Formatos soportados: MP3, WAV, M4A, FLAC, OGG"
     )
     
@@ -386,206 +673,220 @@ with tab1:
         st.audio(uploaded_file, format=f'audio/{uploaded_file.name.split(".")[-1]}')
         
         if st.button("🎙️ Procesar Llamada de Emergencia", type="primary", width="stretch"):
-            if not st.session_state.get('assemblyai_key') or not st.session_state.get('groq_key'):
+            if api_keys_missing():
                 st.error("⚠️ Por favor ingrese ambas claves API en la barra lateral")
             else:
-                start_time = datetime.now()
-                call_id = len(st.session_state.call_history) + 1
-                
-                # Transcribe
-                st.subheader("📝 Transcripción")
-                transcript = transcribe_audio(uploaded_file.getvalue())
-                
-                if transcript:
-                    # Analyze with LLM
-                    st.subheader("🤖 Análisis Inteligente")
-                    with st.spinner('Analizando llamada con IA...'):
-                        llm_analysis = analyze_transcript_with_llm(transcript)
-                    
-                    if llm_analysis:
-                        emotion = llm_analysis.get('emocion', 'CALMA')
-                        emotion_icon = llm_analysis.get('icono_emocion', '🟢')
-                        palabras_criticas = llm_analysis.get('palabras_criticas', [])
-                        severity = llm_analysis.get('severidad_general', 'Medio')
-                        emergency_type = llm_analysis.get('tipo_emergencia', 'Otro')
-                        justificacion = llm_analysis.get('justificacion', '')
-                    else:
-                        # Fallback to defaults if LLM fails
-                        emotion = "CALMA"
-                        emotion_icon = "🟢"
-                        palabras_criticas = []
-                        severity = "Medio"
-                        emergency_type = "Otro"
-                        justificacion = "Análisis LLM no disponible"
-                    
-                    # Alert section
-                    if palabras_criticas:
-                        st.error("🚨 PALABRAS CRÍTICAS DETECTADAS")
-                        alert_cols = st.columns(min(len(palabras_criticas), 4))
-                        for i, alert in enumerate(palabras_criticas[:4]):
-                            with alert_cols[i]:
-                                st.markdown(f"""
-                                <div style='background-color:#ff4444;padding:10px;border-radius:5px;text-align:center;color:white;'>
-                                    <b>{alert.get('categoria', 'ALERTA').upper()}</b><br/>
-                                    {alert.get('palabra', '')}
-                                </div>
-                                """, unsafe_allow_html=True)
-                    
-                    # Emotion analysis
-                    col_em1, col_em2 = st.columns([1, 3])
-                    with col_em1:
-                        st.info(f"{emotion_icon} Estado Emocional: **{emotion}**")
-                    with col_em2:
-                        st.info(f"🎯 Severidad: **{severity}** | Tipo: **{emergency_type}**")
-                    
-                    if justificacion:
-                        st.caption(f"💡 {justificacion}")
-                    
-                    # Display transcript with highlights
-                    st.success("✅ Transcripción completada")
-                    highlighted_text = highlight_keywords(transcript, palabras_criticas)
-                    st.markdown(highlighted_text, unsafe_allow_html=True)
-                    
-                    # Extract location
-                    location_text = extract_location(transcript)
-                    
-                    st.divider()
-                    
-                    # Generate summary
-                    st.subheader("📋 Resumen de Emergencia")
-                    summary = generate_summary(transcript)
-                    
-                    if summary:
-                        st.success("✅ Resumen generado")
-                        st.markdown(summary)
-                        
-                        st.divider()
-                        
-                        # Map section - only show if location found
-                        if location_text:
-                            st.subheader("🗺️ Mapa de Ubicación")
-                            st.info(f"📍 Ubicación detectada: **{location_text}**")
-                            
-                            with st.spinner("Generando mapa..."):
-                                coords = geocode_location(location_text)
-                                if coords:
-                                    try:
-                                        emergency_map = create_map(coords[0], coords[1], location_text)
-                                        # Use a unique key and return_on_hover=False to prevent reloading
-                                        map_data = st_folium(
-                                            emergency_map, 
-                                            width=700, 
-                                            height=400, 
-                                            key=f"map_{call_id}_{start_time.timestamp()}",
-                                            returned_objects=[]
-                                        )
-                                    except Exception as e:
-                                        st.warning(f"No se pudo mostrar el mapa: {str(e)}")
-                                        st.write("Coordenadas:", coords)
-                                else:
-                                    st.warning(f"No se pudo geocodificar la ubicación: {location_text}")
-                        else:
-                            st.warning("⚠️ No se detectó ninguna ubicación específica en la llamada")
-                        
-                        st.divider()
-                        
-                        # Copy summary button
-                        st.button("📋 Copiar Resumen al Portapapeles", width="stretch")
-                        
-                        # Save to history and priority queue
-                        call_record = {
-                            'id': call_id,
-                            'timestamp': start_time.strftime("%Y-%m-%d %H:%M:%S"),
-                            'time': start_time.strftime("%H:%M"),
-                            'transcript': transcript,
-                            'summary': summary,
-                            'location': location_text or "Desconocida",
-                            'severity': severity,
-                            'type': emergency_type,
-                            'alerts': palabras_criticas,
-                            'emotion': emotion,
-                            'details': transcript[:100] + "...",
-                            'justificacion': justificacion
-                        }
-                        
-                        st.session_state.call_history.append(call_record)
-                        
-                        if severity in ['Crítico', 'Alto']:
-                            st.session_state.priority_queue.append(call_record)
-                        
-                        st.success(f"✅ Llamada #{call_id} procesada y guardada en el historial")
+                # Processed in the background; it keeps going across reruns
+                st.session_state.current_job = job_queue.submit(uploaded_file.name, uploaded_file)
+    
+    current_job = job_queue.get(st.session_state.current_job) if st.session_state.get('current_job') else None
+    if current_job and current_job['status'] in ('queued', 'running'):
+        render_pending_job(current_job['id'])
+    elif current_job:
+        render_job_result(current_job)
 
 with tab2:
-    st.header("📊 Analíticas de Llamadas")
-    
-    if st.session_state.call_history:
-        # Create metrics
-        col1, col2, col3, col4 = st.columns(4)
+    if tab2.open:
+        st.header("📊 Analíticas de Llamadas")
         
-        with col1:
-            st.metric("Total de Llamadas", len(st.session_state.call_history))
+        totals = call_store.summary()
         
-        with col2:
-            critical_calls = sum(1 for call in st.session_state.call_history if call['severity'] == 'Crítico')
-            st.metric("Llamadas Críticas", critical_calls)
-        
-        with col3:
-            high_stress_calls = sum(1 for call in st.session_state.call_history if 'ALTO' in call['emotion'])
-            st.metric("Llamadas con Estrés Alto", high_stress_calls)
-        
-        with col4:
-            total_alerts = sum(len(call['alerts']) for call in st.session_state.call_history)
-            st.metric("Total de Alertas", total_alerts)
-        
-        st.divider()
-        
-        # Call history table
-        st.subheader("Historial de Llamadas Recientes")
-        df = pd.DataFrame([
-            {
-                'ID': call['id'],
-                'Hora': call['timestamp'],
-                'Tipo': call['type'],
-                'Severidad': call['severity'],
-                'Ubicación': call['location'],
-                'Emoción': call['emotion']
-            }
-            for call in st.session_state.call_history
-        ])
-        st.dataframe(df, use_container_width=True)
-        
-        st.divider()
-        
-        # Detailed view
-        st.subheader("Detalles de Llamada")
-        selected_call_id = st.selectbox(
-            "Seleccionar llamada para ver detalles",
-            options=[call['id'] for call in st.session_state.call_history],
-            format_func=lambda x: f"Llamada #{x}"
-        )
-        
-        selected_call = next((call for call in st.session_state.call_history if call['id'] == selected_call_id), None)
-        
-        if selected_call:
-            col1, col2 = st.columns(2)
+        if totals['total']:
+            # Create metrics
+            col1, col2, col3, col4 = st.columns(4)
             
             with col1:
-                st.markdown("**Transcripción:**")
-                st.text_area("Transcripción completa", selected_call['transcript'], height=200, key=f"detail_transcript_{selected_call_id}", label_visibility="collapsed")
+                st.metric("Total de Llamadas", totals['total'])
             
             with col2:
-                st.markdown("**Resumen:**")
-                st.markdown(selected_call['summary'])
+                st.metric("Llamadas Críticas", totals['critical'])
+            
+            with col3:
+                st.metric("Llamadas con Estrés Alto", totals['high_stress'])
+            
+            with col4:
+                st.metric("Total de Alertas", totals['alerts'])
+            
+            st.divider()
+            
+            # Call history table, read one page at a time from the store
+            st.subheader("Historial de Llamadas Recientes")
+            filter_col1, filter_col2, filter_col3 = st.columns(3)
+            with filter_col1:
+                severity_filter = st.selectbox("Severidad", ["Todas", "Crítico", "Alto", "Medio", "Bajo"])
+            with filter_col2:
+                type_filter = st.selectbox("Tipo", ["Todos", "Médica", "Incendio", "Policía", "Otro"])
+            with filter_col3:
+                page_size = st.selectbox("Filas por página", [25, 50, 100])
+            
+            severity = None if severity_filter == "Todas" else severity_filter
+            call_type = None if type_filter == "Todos" else type_filter
+            version = call_store.version()
+            matching_calls = count_calls(version, severity, call_type)
+            page_count = max(math.ceil(matching_calls / page_size), 1)
+            page = st.number_input("Página", min_value=1, max_value=page_count, value=1)
+            
+            df = calls_page(version, severity, call_type, page_size, page)
+            st.dataframe(df, use_container_width=True)
+            st.caption(f"{matching_calls} llamadas · página {page} de {page_count}")
+            
+            st.divider()
+            
+            # Detailed view
+            st.subheader("Detalles de Llamada")
+            selected_call_id = st.selectbox(
+                "Seleccionar llamada para ver detalles",
+                options=df['ID'].tolist(),
+                format_func=lambda x: f"Llamada #{x}"
+            )
+            
+            selected_call = call_store.get(selected_call_id) if selected_call_id else None
+            
+            if selected_call:
+                col1, col2 = st.columns(2)
                 
-                if selected_call['alerts']:
-                    st.markdown("**Alertas Detectadas:**")
-                    for alert in selected_call['alerts']:
-                        categoria = alert.get('categoria', 'Alerta')
-                        palabra = alert.get('palabra', alert.get('keyword', 'N/A'))
-                        st.markdown(f"- ⚠️ {categoria.title()}: {palabra}")
+                with col1:
+                    st.markdown("**Transcripción:**")
+                    with st.container(height=200):
+                        st.markdown(highlight_keywords(selected_call['transcript'], selected_call['alerts']), unsafe_allow_html=True)
+                
+                with col2:
+                    st.markdown("**Resumen:**")
+                    st.markdown(selected_call['summary'])
+                    
+                    if selected_call['alerts']:
+                        st.markdown("**Alertas Detectadas:**")
+                        for alert in selected_call['alerts']:
+                            categoria = alert.get('categoria', 'Alerta')
+                            palabra = alert.get('palabra', alert.get('keyword', 'N/A'))
+                            st.markdown(f"- ⚠️ {categoria.title()}: {palabra}")
+            
+            st.divider()
+            
+            # Stage latency over the stored calls, from every session and worker
+            st.subheader("⏱️ Rendimiento")
+            window = st.selectbox("Periodo", list(PERFORMANCE_WINDOWS), index=1)
+            hours = PERFORMANCE_WINDOWS[window]
+            # Whole minutes, so the cached table is reused between reruns
+            since = (datetime.now() - timedelta(hours=hours)).strftime("%Y-%m-%d %H:%M:00") if hours else None
+            performance = performance_table(version, since)
+            if performance.empty:
+                st.info("No hay tiempos registrados en este periodo.")
+            else:
+                st.dataframe(performance, hide_index=True, use_container_width=True)
+                st.caption("Percentiles por etapa en segundos. \"Total hasta despacho\" va desde la llegada de la llamada hasta que su resumen está listo.")
+        else:
+            st.info("No hay datos de llamadas disponibles aún. Procese algunas llamadas de emergencia para ver analíticas.")
+
+with tab3:
+    st.header("📦 Procesamiento por Lotes")
+    
+    batch_files = st.file_uploader(
+        "Cargar Audios de Emergencia",
+        type=AUDIO_EXTENSIONS,
+        accept_multiple_files=True,
+        key="batch_uploader",
+        help="Seleccione varias grabaciones para procesarlas en paralelo"
+    )
+    job_counts = job_queue.counts()
+    st.caption(
+        f"Las llamadas se procesan en segundo plano, compartiendo los procesos de trabajo con los demás despachadores "
+        f"({job_counts.get('queued', 0)} en cola, {job_counts.get('running', 0)} en proceso)."
+    )
+    
+    if batch_files and st.button(f"📦 Procesar {len(batch_files)} Llamadas", type="primary", width="stretch"):
+        if api_keys_missing():
+            st.error("⚠️ Por favor ingrese ambas claves API en la barra lateral")
+        else:
+            st.session_state.batch_jobs = [job_queue.submit(f.name, f) for f in batch_files]
+    
+    batch_jobs = job_queue.get_many(st.session_state.get('batch_jobs', []))
+    if any(job['status'] in ('queued', 'running') for job in batch_jobs):
+        render_pending_batch([job['id'] for job in batch_jobs])
+    elif batch_jobs:
+        stats = batch_stats(batch_jobs)
+        st.progress(1.0, text=f"{len(batch_jobs)} de {len(batch_jobs)} llamadas procesadas")
+        render_batch_log(batch_jobs)
+        
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Llamadas Procesadas", stats.completed)
+        col2.metric("Llamadas Fallidas", stats.failed)
+        col3.metric("Llamadas por Minuto", f"{stats.calls_per_minute:.1f}")
+        
+        st.subheader("Latencia por Etapa (s)")
+        st.dataframe(stats.stage_summary(), use_container_width=True)
+
+with tab4:
+    st.header("🔴 Llamada en Vivo")
+    st.caption("Audio PCM de 16 bits mono. La severidad y la ubicación se actualizan mientras la persona habla.")
+    
+    live_source = st.radio("Origen del audio", ["Socket local", "Archivo en escritura"], horizontal=True)
+    if live_source == "Socket local":
+        live_port = st.number_input("Puerto", min_value=1024, max_value=65535, value=9000)
     else:
-        st.info("No hay datos de llamadas disponibles aún. Procese algunas llamadas de emergencia para ver analíticas.")
+        live_path = st.text_input("Ruta del archivo")
+    live_rate = st.selectbox("Frecuencia de muestreo (Hz)", [16000, 8000], index=0)
+    
+    if st.button("🎧 Escuchar Llamada", type="primary", width="stretch"):
+        if api_keys_missing():
+            st.error("⚠️ Por favor ingrese ambas claves API en la barra lateral")
+        elif live_source == "Archivo en escritura" and not live_path:
+            st.error("⚠️ Indique la ruta del archivo")
+        else:
+            start_time = datetime.now()
+            if live_source == "Socket local":
+                chunks = socket_chunks(port=int(live_port))
+                st.info(f"⏳ Esperando audio en el puerto {int(live_port)}...")
+            else:
+                chunks = follow_file(live_path)
+            
+            live_status = st.empty()
+            live_alerts = st.empty()
+            live_text = st.empty()
+            
+            def on_live_update(snapshot):
+                severity = snapshot['severity'] or "Sin determinar"
+                location = snapshot['location'] or "Sin detectar"
+                gaps = f" | ⚠️ Segmentos sin transcribir: **{snapshot['gaps']}**" if snapshot['gaps'] else ""
+                live_status.info(f"🎯 Severidad provisional: **{severity}** | 📍 Ubicación: **{location}**{gaps}")
+                if snapshot['keywords']:
+                    live_alerts.error("🚨 " + ", ".join(
+                        f"{item['categoria'].upper()}: {item['palabra']}" for item in snapshot['keywords']
+                    ))
+                live_text.markdown(highlight_keywords(snapshot['transcript'], snapshot['keywords']), unsafe_allow_html=True)
+            
+            try:
+                live = transcribe_live(
+                    chunks, st.session_state.get('assemblyai_key'), on_live_update, sample_rate=live_rate
+                )
+            except Exception as e:
+                st.error(f"Error en la transcripción en vivo: {str(e)}")
+                live = None
+            
+            if live and live.transcribed:
+                st.success("✅ Llamada finalizada")
+                if live.gaps:
+                    st.warning(f"⚠️ {live.gaps} segmentos no se pudieron transcribir: {live.last_error}")
+                st.divider()
+                render_call_analysis(live.transcript, start_time)
+            elif live and live.gaps:
+                st.error(f"Error en la transcripción en vivo: {live.last_error}")
+            elif live:
+                st.warning("⚠️ No se recibió audio con voz")
+
+with tab5:
+    if tab5.open:
+        st.header("🗺️ Mapa Operativo")
+        render_operations_map()
+
+with tab6:
+    if tab6.open:
+        st.header("📈 Histórico de Llamadas")
+        render_history()
 
 # Footer
 st.divider()
-st.caption("Sistema de Transcripción de Emergencias Colombia | Solo para propósitos de demostración")
\ No newline at end of file
+st.caption("Sistema de Transcripción de Emergencias Colombia | Solo para propósitos de demostración")
+
+# After the first page is out, so the first map or table does not wait for the imports
+preload_modules()
\ No newline at end of file
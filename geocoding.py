@@ -0,0 +1,286 @@
+"""Geocoding of Colombian addresses with a persistent cache and an offline index.
+
+geocode_location resolves an address in three steps, stopping at the first
+that answers:
+
+1. The geocode cache, keyed by the normalized address, in memory and under
+   .cache/geocode (GEOCODE_CACHE_DIR overrides it). Entries expire after
+   GEOCODE_CACHE_TTL.
+2. The offline index, if GEOCODER_GAZETTEER points to a gazetteer CSV.
+   It resolves calle/carrera addresses without any network hop.
+3. Nominatim, through one shared client throttled to its policy of one
+   request per second. NOMINATIM_URL points it at another server (such as
+   a self-hosted Nominatim or the stand-in in stand_in_services.py), and
+   NOMINATIM_MIN_INTERVAL changes the throttle.
+
+geocode_offline stops after the first two steps, for callers that cannot
+wait for the network.
+
+place_name gives the barrio an address mentions, for grouping calls by
+barrio (see call_archive.py).
+
+The gazetteer CSV has the columns calle,carrera,barrio,lat,lon. Rows with
+calle and carrera are street intersections, and rows with barrio are
+neighborhood centers. Addresses between known intersections are
+interpolated with a local affine fit of the street grid.
+"""
+import csv
+import math
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from location_extraction import normalize_location
+from tiered_cache import TieredCache, content_key
+
+GEOCODE_CACHE_TTL = 30 * 24 * 3600
+NOMINATIM_MIN_INTERVAL = float(os.environ.get('NOMINATIM_MIN_INTERVAL', 1.0))
+
+# Nearest known intersections used to interpolate an address, and how far
+# away (in blocks) they may be
+INTERPOLATION_NEIGHBORS = 6
+INTERPOLATION_RADIUS = 10
+
+# Diagonals run like calles and transversals like carreras
+_CALLE_AXES = ('calle', 'diagonal')
+
+_grid_pattern = re.compile(
+    r'\b(calle|diagonal|carrera|transversal) (\d+)([a-z]?)(?: bis)?( sur| este)? (\d+)([a-z]?)'
+)
+_place_pattern = re.compile(r'\b(?:barrio|localidad|sector) ([a-z ]+)')
+# Words that end a place name mentioned without a gazetteer, and the most it keeps
+_PLACE_STOPWORDS = {'al', 'cerca', 'con', 'donde', 'en', 'frente', 'junto', 'por', 'que', 'y'}
+PLACE_NAME_WORDS = 3
+
+_geocode_cache = TieredCache(
+    disk_dir=os.environ.get('GEOCODE_CACHE_DIR', Path(__file__).parent / '.cache' / 'geocode'),
+    max_entries=2048,
+    max_disk_entries=50000,
+    ttl=GEOCODE_CACHE_TTL
+)
+
+def normalize_address(address):
+    """Canonical form of an address, used as cache and index key"""
+    return normalize_location(address)
+
+def _grid_number(digits, letter):
+    """Street number with its letter suffix as a fraction (45a -> 45.2)"""
+    return int(digits) + (ord(letter) - ord('a') + 1) * 0.2 if letter else float(digits)
+
+def parse_grid_address(normalized):
+    """(calle, carrera) grid position of a normalized address, or None"""
+    match = _grid_pattern.search(normalized)
+    if not match:
+        return None
+
+    axis, number, letter, quadrant, cross, cross_letter = match.groups()
+    primary = _grid_number(number, letter)
+    secondary = _grid_number(cross, cross_letter)
+    if axis in _CALLE_AXES:
+        calle, carrera = primary, secondary
+        if quadrant == ' sur':
+            calle = -calle
+    else:
+        carrera, calle = primary, secondary
+        if quadrant == ' este':
+            carrera = -carrera
+    return calle, carrera
+
+def _solve3(m, v):
+    """Solve a 3x3 linear system by Cramer's rule, or None if it is singular"""
+    def det(a):
+        return (a[0][0] * (a[1][1] * a[2][2] - a[1][2] * a[2][1])
+                - a[0][1] * (a[1][0] * a[2][2] - a[1][2] * a[2][0])
+                + a[0][2] * (a[1][0] * a[2][1] - a[1][1] * a[2][0]))
+
+    d = det(m)
+    if abs(d) < 1e-9:
+        return None
+    solution = []
+    for col in range(3):
+        replaced = [row[:col] + [v[i]] + row[col + 1:] for i, row in enumerate(m)]
+        solution.append(det(replaced) / d)
+    return solution
+
+class OfflineAddressIndex:
+    """Resolves grid addresses and barrio names from a local gazetteer"""
+
+    def __init__(self, intersections, barrios):
+        self.intersections = intersections
+        self.barrios = barrios
+
+    @classmethod
+    def from_csv(cls, path):
+        intersections = {}
+        barrios = {}
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                coords = (float(row['lat']), float(row['lon']))
+                if row.get('calle') and row.get('carrera'):
+                    grid = parse_grid_address(normalize_address(f"calle {row['calle']} {row['carrera']}"))
+                    if grid:
+                        intersections[grid] = coords
+                elif row.get('barrio'):
+                    barrios[normalize_address(row['barrio'])] = coords
+        return cls(intersections, barrios)
+
+    def lookup(self, normalized):
+        """Coordinates for a normalized address, or None if it cannot be resolved offline"""
+        grid = parse_grid_address(normalized)
+        if grid:
+            if grid in self.intersections:
+                return self.intersections[grid]
+            coords = self._interpolate(grid)
+            if coords:
+                return coords
+
+        barrio = self.barrio_of(normalized)
+        return self.barrios[barrio] if barrio else None
+
+    def barrio_of(self, normalized):
+        """The known barrio a normalized address mentions, or None"""
+        place = _place_pattern.search(normalized)
+        if place:
+            name = place.group(1).strip()
+            # Longest known barrio name the mention starts with
+            for barrio in sorted(self.barrios, key=len, reverse=True):
+                if name == barrio or name.startswith(barrio + ' '):
+                    return barrio
+        return None
+
+    def _interpolate(self, grid):
+        """Fit lat/lon as an affine function of (calle, carrera) on nearby intersections"""
+        nearby = sorted(
+            (math.dist(grid, known), known) for known in self.intersections
+            if math.dist(grid, known) <= INTERPOLATION_RADIUS
+        )[:INTERPOLATION_NEIGHBORS]
+        if len(nearby) < 3:
+            return None
+
+        points = [(known, self.intersections[known]) for _, known in nearby]
+        # Normal equations for value = a * calle + b * carrera + c
+        ata = [[0.0] * 3 for _ in range(3)]
+        atb_lat = [0.0] * 3
+        atb_lon = [0.0] * 3
+        for (calle, carrera), (lat, lon) in points:
+            row = (calle, carrera, 1.0)
+            for i in range(3):
+                for j in range(3):
+                    ata[i][j] += row[i] * row[j]
+                atb_lat[i] += row[i] * lat
+                atb_lon[i] += row[i] * lon
+
+        lat_coef = _solve3(ata, atb_lat)
+        lon_coef = _solve3(ata, atb_lon)
+        if not lat_coef or not lon_coef:
+            return None
+        calle, carrera = grid
+        return (
+            lat_coef[0] * calle + lat_coef[1] * carrera + lat_coef[2],
+            lon_coef[0] * calle + lon_coef[1] * carrera + lon_coef[2]
+        )
+
+_offline_index = None
+_offline_index_loaded = False
+_nominatim = None
+_nominatim_lock = threading.Lock()
+_last_nominatim_request = 0.0
+
+def get_offline_index():
+    """Offline index from GEOCODER_GAZETTEER, loaded once, or None if not configured"""
+    global _offline_index, _offline_index_loaded
+    if not _offline_index_loaded:
+        with _nominatim_lock:
+            if not _offline_index_loaded:
+                path = os.environ.get('GEOCODER_GAZETTEER')
+                _offline_index = OfflineAddressIndex.from_csv(path) if path else None
+                _offline_index_loaded = True
+    return _offline_index
+
+def _nominatim_geocode(query):
+    """Geocode one query with the shared client, at most one request per second"""
+    global _nominatim, _last_nominatim_request
+    with _nominatim_lock:
+        if _nominatim is None:
+            # geopy is only loaded when an address is not known locally
+            from geopy.geocoders import Nominatim
+            server = urlsplit(os.environ.get('NOMINATIM_URL', 'https://nominatim.openstreetmap.org'))
+            _nominatim = Nominatim(
+                user_agent="emergency_app_colombia", timeout=10, domain=server.netloc, scheme=server.scheme
+            )
+        wait = _last_nominatim_request + NOMINATIM_MIN_INTERVAL - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        try:
+            return _nominatim.geocode(query)
+        finally:
+            _last_nominatim_request = time.monotonic()
+
+def geocode_offline(address):
+    """Coordinates of an address from the cache or the offline index, without
+    asking Nominatim; None if they are not known locally"""
+    normalized = normalize_address(address)
+    cached = _geocode_cache.get(content_key(normalized))
+    if cached is not None:
+        return tuple(cached['coords']) if cached['coords'] else None
+
+    index = get_offline_index()
+    return index.lookup(normalized) if index else None
+
+def place_name(address):
+    """Normalized name of the barrio an address mentions: a gazetteer barrio if
+    the offline index knows it, else the first words after barrio, localidad
+    or sector; None if it mentions none"""
+    normalized = normalize_address(address)
+    index = get_offline_index()
+    barrio = index.barrio_of(normalized) if index else None
+    if barrio:
+        return barrio
+
+    place = _place_pattern.search(normalized)
+    if not place:
+        return None
+    words = []
+    for word in place.group(1).split():
+        if word in _PLACE_STOPWORDS or len(words) == PLACE_NAME_WORDS:
+            break
+        words.append(word)
+    return " ".join(words) or None
+
+def geocode_location(address):
+    """Convert address to coordinates"""
+    normalized = normalize_address(address)
+    cache_key = content_key(normalized)
+    cached = _geocode_cache.get(cache_key)
+    if cached is not None:
+        return tuple(cached['coords']) if cached['coords'] else None
+
+    index = get_offline_index()
+    coords = index.lookup(normalized) if index else None
+    failed = False
+
+    if coords is None:
+        # Try multiple variations
+        search_queries = [
+            f"{address}, Bogotá, Colombia",
+            f"{address}, Colombia",
+            f"Bogotá, {address}, Colombia"
+        ]
+
+        for query in search_queries:
+            try:
+                location = _nominatim_geocode(query)
+            except Exception:
+                failed = True
+                continue
+            if location:
+                coords = (location.latitude, location.longitude)
+                break
+
+    # A miss is only remembered when Nominatim actually answered
+    if coords or not failed:
+        _geocode_cache.put(cache_key, {'coords': list(coords) if coords else None})
+    return coords
@@ -0,0 +1,249 @@
+"""Shared HTTP clients for the external services (AssemblyAI and Groq).
+
+Each service gets one ServiceClient per process, holding a keep-alive
+connection pool, so uploads, polls and completions reuse connections
+instead of paying a TCP and TLS handshake per request. Around every request
+the client adds:
+
+* connect and read timeouts per service,
+* retry with full-jitter exponential backoff on 429, 5xx and connection
+  errors, honoring Retry-After and the caller's deadline. Requests that
+  are not idempotent (POST) are only repeated when the service cannot
+  have acted on them: connect errors, 429 and 503, unless the caller
+  passes idempotent=True,
+* a circuit breaker that fails fast after repeated failures and lets one
+  trial request through after a cool-down,
+* a limit on concurrent requests to the service; a streamed response
+  holds its slot until it is closed.
+
+Responses with other status codes are returned to the caller unchanged.
+
+ASSEMBLYAI_BASE_URL and GROQ_BASE_URL point a service elsewhere, such as
+the stand-in servers in stand_in_services.py.
+"""
+import os
+import random
+import threading
+import time
+import weakref
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Statuses that mean the service rejected the request without acting on it
+UNPROCESSED_STATUSES = {429, 503}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of sending a request while a service's circuit is open"""
+
+class CircuitBreaker:
+    """Opens after failure_threshold consecutive failures, for reset_timeout seconds"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return 'half-open'
+            return 'open'
+
+    def allow(self):
+        """Whether a request may be sent now; in half-open state only one trial is let through"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+def _retry_after(response):
+    """Seconds requested by a Retry-After header, or None"""
+    try:
+        return max(float(response.headers.get('Retry-After')), 0)
+    except (TypeError, ValueError):
+        return None
+
+def _not_sent(error):
+    """Whether a requests exception means the request never reached the service"""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+def _hold_slot(response, slots):
+    """Release one of slots once response is closed or garbage collected"""
+    release = weakref.finalize(response, slots.release)
+    # A weak reference, so the wrapper does not keep the response alive
+    ref = weakref.ref(response)
+
+    def close():
+        target = ref()
+        if target is not None:
+            requests.Response.close(target)
+        release()
+
+    response.close = close
+
+def _rewind(kwargs, position):
+    """Seek a file-like request body back so a retry sends it whole"""
+    data = kwargs.get('data')
+    if position is not None and hasattr(data, 'seek'):
+        data.seek(position)
+
+class ServiceClient:
+    """Pooled, retrying, circuit-broken HTTP client for one service"""
+
+    def __init__(self, name, base_url, connect_timeout=5, read_timeout=60, max_retries=3,
+                 backoff_base=0.5, backoff_max=8, max_concurrency=8, breaker=None):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def request(self, method, path, timeout=None, deadline=None, retry=True, idempotent=None, **kwargs):
+        """Send a request and return the response.
+
+        timeout overrides the read timeout of this service. deadline, in
+        seconds from now, bounds the whole call including retries.
+        idempotent (by default, whether the method is) allows repeating a
+        request the service may already have acted on. Raises
+        CircuitOpenError when the circuit is open and requests exceptions
+        when the last attempt could not connect.
+        """
+        url = path if path.startswith('http') else f"{self.base_url}/{path.lstrip('/')}"
+        expires = time.monotonic() + deadline if deadline else None
+        data = kwargs.get('data')
+        position = data.tell() if hasattr(data, 'tell') and hasattr(data, 'seek') else None
+        attempts = self.max_retries + 1 if retry else 1
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+
+        response = None
+        error = None
+        for attempt in range(attempts):
+            if not self.breaker.allow():
+                # Opened during our own retries: report the last real failure
+                if attempt:
+                    break
+                raise CircuitOpenError(f"Servicio {self.name} no disponible temporalmente")
+
+            read_timeout = timeout or self.timeout[1]
+            if expires:
+                read_timeout = max(min(read_timeout, expires - time.monotonic()), 0.1)
+
+            response = None
+            error = None
+            _rewind(kwargs, position)
+            self._slots.acquire()
+            try:
+                response = self.session.request(
+                    method, url, timeout=(self.timeout[0], read_timeout), **kwargs
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            except Exception:
+                self._slots.release()
+                # Not retried, but it must still close a half-open trial
+                self.breaker.record_failure()
+                raise
+            if error is None and kwargs.get('stream'):
+                # The body is read after we return, so it counts against the limit until closed
+                _hold_slot(response, self._slots)
+            else:
+                self._slots.release()
+
+            if error is None and response.status_code not in RETRY_STATUSES:
+                self.breaker.record_success()
+                return response
+            # Throttling is the service working as intended, not a fault
+            if error is not None or response.status_code != 429:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+
+            # Repeating a request the service may have acted on could act twice
+            if not idempotent and not (
+                _not_sent(error) if error is not None else response.status_code in UNPROCESSED_STATUSES
+            ):
+                break
+            wait = self._backoff(attempt)
+            if response is not None:
+                wait = max(wait, _retry_after(response) or 0)
+            if attempt == attempts - 1 or (expires and time.monotonic() + wait >= expires):
+                break
+            if response is not None:
+                response.close()
+            time.sleep(wait)
+
+        if error is not None:
+            raise error
+        return response
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+# Per-service settings; uploads and completions can take a while to answer
+SERVICES = {
+    'assemblyai': {
+        'base_url': 'https://api.assemblyai.com/v2',
+        'read_timeout': 120,
+        'max_concurrency': 16,
+    },
+    'groq': {
+        'base_url': 'https://api.groq.com/openai/v1',
+        'read_timeout': 60,
+        'max_concurrency': 8,
+    },
+}
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(name):
+    """Process-wide client for a service in SERVICES"""
+    with _clients_lock:
+        if name not in _clients:
+            settings = dict(SERVICES[name])
+            settings['base_url'] = os.environ.get(f'{name.upper()}_BASE_URL', settings['base_url'])
+            _clients[name] = ServiceClient(name, **settings)
+        return _clients[name]
@@ -0,0 +1,140 @@
+"""Spatio-temporal index of recent calls, for grouping reports of one incident.
+
+Several people often call about the same emergency. A call placed within
+DUPLICATE_RADIUS_M metres and DUPLICATE_WINDOW seconds after an open call
+belongs to that call's incident. Its record gets 'incident_id' (the id of
+the incident's first call), the priority queue counts it as another report
+of the queued incident instead of queueing it again, and the pipeline can
+reuse the incident's analysis instead of asking the LLM again.
+
+Calls are bucketed in a grid of cells about DUPLICATE_RADIUS_M wide, each
+cell holding its calls sorted by arrival time. A lookup reads the cells
+around a point and bisects each one to the time window, so it costs
+O(log n) plus the calls actually in range, however many calls are indexed.
+Calls older than the window are pruned as the index is used.
+
+The index is kept per process and caught up from the call store before
+each lookup, so calls saved by other processes count too.
+"""
+import bisect
+import math
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from call_store import get_call_store
+from priority_queue import SEVERITIES, arrival_time
+
+DUPLICATE_RADIUS_M = float(os.environ.get('DUPLICATE_RADIUS_M', 150))
+DUPLICATE_WINDOW = float(os.environ.get('DUPLICATE_WINDOW_MINUTES', 15)) * 60
+METERS_PER_DEGREE = 111_320
+EARTH_RADIUS_M = 6_371_000
+
+def distance_m(a, b):
+    """Great-circle distance in metres between two (lat, lon) points"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (*a, *b))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(h))
+
+class IncidentIndex:
+    """Grid of recent geocoded calls, each cell sorted by arrival time"""
+
+    def __init__(self, radius_m=DUPLICATE_RADIUS_M, window=DUPLICATE_WINDOW):
+        self.radius_m = radius_m
+        self.window = window
+        self.cell_deg = radius_m / METERS_PER_DEGREE
+        self._times = defaultdict(list)     # cell -> arrival times, ascending
+        self._entries = defaultdict(list)   # cell -> (call_id, incident_id, coords), same order
+        self._lock = threading.Lock()
+        # Highest call id already read from the call store by sync()
+        self._synced_id = 0
+
+    def _cell(self, coords):
+        return (math.floor(coords[0] / self.cell_deg), math.floor(coords[1] / self.cell_deg))
+
+    def add(self, call_id, coords, when, incident_id=None):
+        """Index a call; incident_id is that of the incident it belongs to, if not its own"""
+        cell = self._cell(coords)
+        with self._lock:
+            times = self._times[cell]
+            position = bisect.bisect_right(times, when)
+            times.insert(position, when)
+            self._entries[cell].insert(position, (call_id, incident_id or call_id, tuple(coords)))
+
+    def nearby(self, coords, when):
+        """(distance, call_id, incident_id) of the calls within the radius that
+        arrived in the window before when, nearest first"""
+        lat_cell, lon_cell = self._cell(coords)
+        # A degree of longitude shrinks away from the equator, so look further
+        lon_reach = math.ceil(1 / max(math.cos(math.radians(coords[0])), 0.01))
+        found = []
+        with self._lock:
+            for cell in ((lat_cell + i, lon_cell + j) for i in (-1, 0, 1) for j in range(-lon_reach, lon_reach + 1)):
+                times = self._times.get(cell)
+                if not times:
+                    continue
+                start = bisect.bisect_left(times, when - self.window)
+                end = bisect.bisect_right(times, when)
+                for call_id, incident_id, other in self._entries[cell][start:end]:
+                    distance = distance_m(coords, other)
+                    if distance <= self.radius_m:
+                        found.append((distance, call_id, incident_id))
+        return sorted(found)
+
+    def prune(self, now=None):
+        """Forget calls too old to be matched by a new call"""
+        oldest = (now or time.time()) - self.window
+        with self._lock:
+            for cell in list(self._times):
+                cut = bisect.bisect_left(self._times[cell], oldest)
+                if cut:
+                    del self._times[cell][:cut]
+                    del self._entries[cell][:cut]
+                if not self._times[cell]:
+                    del self._times[cell]
+                    del self._entries[cell]
+
+    def sync(self, store, now=None):
+        """Index geocoded open calls added to the store since the last sync"""
+        since = datetime.fromtimestamp((now or time.time()) - self.window).strftime("%Y-%m-%d %H:%M:%S")
+        for call_record in store.list_open(SEVERITIES, after_id=self._synced_id, since=since):
+            self._synced_id = max(self._synced_id, call_record['id'])
+            if call_record.get('coords'):
+                self.add(call_record['id'], call_record['coords'], arrival_time(call_record),
+                         call_record.get('incident_id'))
+
+    def clear(self):
+        with self._lock:
+            self._times.clear()
+            self._entries.clear()
+            self._synced_id = 0
+
+def find_incident(coords, when, store=None):
+    """The first call of the open incident a call at coords and time when belongs to, or None"""
+    store = store or get_call_store()
+    index = get_incident_index()
+    index.sync(store)
+    index.prune()
+    checked = set()
+    for _, _, incident_id in index.nearby(coords, when):
+        if incident_id in checked:
+            continue
+        checked.add(incident_id)
+        incident = store.get(incident_id)
+        # An incident resolved since it was indexed no longer takes reports
+        if incident and not incident.get('resolved'):
+            return incident
+    return None
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_incident_index():
+    """Process-wide index, filled from the call store by find_incident"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = IncidentIndex()
+        return _index
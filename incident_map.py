@@ -0,0 +1,163 @@
+"""Operations map of the active incidents, shared by every dispatcher session.
+
+An incident is an unresolved call from the last ACTIVE_WINDOW_HOURS, or
+any call still in the priority queue, whose location was geocoded.
+IncidentLayer keeps one marker per incident for the whole process and
+updates them by diff: markers are built only for calls that appeared
+since the last update (or whose severity aged), and dropped for calls that
+were resolved. Its revision changes only when a marker did. Only calls in
+the priority queue age; every other call shows its stored severity, and
+calls outside the queue are resolved from the map page.
+
+The page draws the base map from a fixed spec (base_map), so its Leaflet
+code is identical on every run and st_folium keeps the map, its view and
+its tiles in the browser. The incidents go in a separate FeatureGroup with
+marker clustering, passed as feature_group_to_add, which st_folium swaps
+in place without reloading the map. Folium objects are built per session
+and never shared, because st_folium attaches layers to the map it renders.
+
+st_folium renders the FeatureGroup to JavaScript on every run, and folium
+compiles a template per element, so the markers are sent as one data array
+that the browser turns into markers (FastMarkerCluster) instead of one
+folium.Marker each. folium is imported on first use, so the app only loads
+it when the map is shown.
+"""
+import html
+import threading
+import time
+from datetime import datetime, timedelta
+
+from priority_queue import effective_severity
+
+BOGOTA_CENTER = (4.65, -74.1)
+ACTIVE_WINDOW_HOURS = 6
+# Most recent calls read from the store for the map
+MAX_INCIDENTS = 1000
+SEVERITY_COLORS = {'Crítico': 'red', 'Alto': 'orange', 'Medio': 'blue', 'Bajo': 'green'}
+TYPE_ICONS = {'Médica': 'ambulance', 'Incendio': 'fire', 'Policía': 'shield', 'Otro': 'exclamation'}
+
+# Builds a marker from a row of feature_group's data array, in the browser
+MARKER_CALLBACK = """function (row) {
+    var marker = L.marker(new L.LatLng(row[0], row[1]), {
+        icon: L.AwesomeMarkers.icon({markerColor: row[2], icon: row[3], prefix: 'fa', iconColor: 'white'})
+    });
+    marker.bindTooltip(row[4]);
+    marker.bindPopup(row[5], {maxWidth: 260});
+    return marker;
+}"""
+
+def base_map():
+    """The operations map without incidents; the same every time it is built"""
+    import folium
+    return folium.Map(location=BOGOTA_CENTER, zoom_start=12, control_scale=True)
+
+def active_calls(store, queue, now=None, hours=ACTIVE_WINDOW_HOURS):
+    """Open recent calls and every queued call, by id"""
+    since = (datetime.fromtimestamp(now or time.time()) - timedelta(hours=hours)).strftime("%Y-%m-%d %H:%M:%S")
+    calls = {
+        call['id']: call for call in store.list_calls(limit=MAX_INCIDENTS, since=since)
+        if not call.get('resolved')
+    }
+    calls.update((call['id'], call) for call in queue.ordered())
+    return calls
+
+def _marker_spec(call, severity):
+    """Everything needed to draw a call's marker, as plain data"""
+    popup = (
+        f"<b>Llamada #{call['id']}</b> · {html.escape(call['time'])}<br>"
+        f"{html.escape(call['type'])} · <b>{html.escape(severity)}</b><br>"
+        f"{html.escape(call['location'])}"
+    )
+    return {
+        'coords': tuple(call['coords']),
+        'severity': severity,
+        'color': SEVERITY_COLORS.get(severity, 'gray'),
+        'icon': TYPE_ICONS.get(call['type'], TYPE_ICONS['Otro']),
+        'tooltip': html.escape(f"#{call['id']} {call['type']} - {severity}"),
+        'popup': popup,
+        'label': f"#{call['id']} {call['type']} - {severity} - {call['location']}",
+        'incident_id': call.get('incident_id') or call['id'],
+    }
+
+class IncidentLayer:
+    """Markers of the active incidents, updated by diff"""
+
+    def __init__(self):
+        self._markers = {}   # call_id -> marker spec
+        self._lock = threading.Lock()
+        self._source = None
+        self.revision = 0
+
+    def sync(self, calls, queued=(), now=None):
+        """Diff calls (id -> record) into the markers; returns (added, removed) counts.
+
+        Calls whose id is in queued show their severity after aging.
+        """
+        with self._lock:
+            # Further reports of an incident on the map share its marker
+            active = {
+                call_id: (call, effective_severity(call, now) if call_id in queued else call['severity'])
+                for call_id, call in calls.items()
+                if call.get('coords') and call.get('incident_id') not in calls
+            }
+            removed = [call_id for call_id in self._markers if call_id not in active]
+            for call_id in removed:
+                del self._markers[call_id]
+            added = [
+                call_id for call_id, (call, severity) in active.items()
+                if call_id not in self._markers or self._markers[call_id]['severity'] != severity
+            ]
+            for call_id in added:
+                self._markers[call_id] = _marker_spec(*active[call_id])
+            if added or removed:
+                self.revision += 1
+            return len(added), len(removed)
+
+    def refresh(self, store, queue, now=None):
+        """Sync from the store and queue if calls changed or a minute passed since the last sync"""
+        now = now or time.time()
+        # Aging can change a severity without any write, so resync each minute
+        source = (store.version(), len(queue), int(now // 60))
+        if source == self._source:
+            return 0, 0
+        self._source = source
+        return self.sync(active_calls(store, queue, now), queue, now)
+
+    def markers(self):
+        with self._lock:
+            return dict(self._markers)
+
+    def counts(self):
+        """Active incidents on the map per severity"""
+        with self._lock:
+            counts = {}
+            for marker in self._markers.values():
+                counts[marker['severity']] = counts.get(marker['severity'], 0) + 1
+            return counts
+
+def feature_group(markers):
+    """A clustered FeatureGroup drawing the given marker specs"""
+    import folium
+    from folium.plugins import FastMarkerCluster
+
+    group = folium.FeatureGroup(name="Incidentes")
+    FastMarkerCluster(
+        [
+            [*marker['coords'], marker['color'], marker['icon'], marker['tooltip'], marker['popup']]
+            for marker in markers.values()
+        ],
+        callback=MARKER_CALLBACK,
+        options={'disableClusteringAtZoom': 17}
+    ).add_to(group)
+    return group
+
+_layer = None
+_layer_lock = threading.Lock()
+
+def get_incident_layer():
+    """Process-wide incident layer"""
+    global _layer
+    with _layer_lock:
+        if _layer is None:
+            _layer = IncidentLayer()
+        return _layer
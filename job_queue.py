@@ -0,0 +1,319 @@
+"""Background processing of calls by a pool of worker processes.
+
+Jobs are rows in a SQLite database (JOB_QUEUE_PATH, default .data/jobs.db)
+and the audio of each job is spooled to a directory next to it. Worker
+processes claim queued jobs one at a time, run the whole pipeline
+(transcription, analysis with the summary, geocoding), save the call to the
+call store and record progress, the transcript, partial results and stage
+timings in the job row. The UI only submits jobs and polls them, so a slow
+service never blocks a dispatcher's page, a rerun does not abort the work
+and every dispatcher shares the same workers.
+
+The app starts JOB_WORKERS worker processes (2 by default). With
+JOB_WORKERS=0 it starts none, and workers run separately, on this or
+another machine sharing the data directory:
+
+    python job_queue.py --workers 4
+
+Workers read the API keys from ASSEMBLYAI_API_KEY and GROQ_API_KEY.
+"""
+import argparse
+import atexit
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+from audio_upload import UploadBody
+from transcription_backends import get_transcription_backend
+from transcription_wait import get_webhook_receiver
+
+DEFAULT_QUEUE_PATH = Path(__file__).parent / '.data' / 'jobs.db'
+JOB_POLL_INTERVAL = 0.5
+# A job running longer than this is assumed orphaned by a dead worker
+STALE_JOB_SECONDS = 15 * 60
+# Finished jobs are kept this long for the UI to pick up their results
+JOB_RETENTION_SECONDS = 24 * 3600
+
+# Columns stored as JSON
+JSON_FIELDS = ('partial', 'coords', 'timings')
+
+def _now():
+    return time.time()
+
+class JobQueue:
+    """Queue of call processing jobs in a SQLite database shared by processes"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.spool_dir = self.path.parent / 'jobs'
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT,
+                    audio_path TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    stage TEXT,
+                    submitted_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    worker TEXT,
+                    transcript TEXT,
+                    partial TEXT,
+                    call_id INTEGER,
+                    coords TEXT,
+                    timings TEXT,
+                    error TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, id);
+            """)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _to_job(row):
+        job = dict(row)
+        for field in JSON_FIELDS:
+            if job[field] is not None:
+                job[field] = json.loads(job[field])
+        return job
+
+    def submit(self, name, audio):
+        """Spool a recording (bytes, path or seekable file) and queue it; returns the job id"""
+        suffix = Path(name).suffix if name else ''
+        audio_path = self.spool_dir / f"{uuid.uuid4().hex}{suffix}"
+        with open(audio_path, 'wb') as f:
+            for chunk in UploadBody(audio):
+                f.write(chunk)
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO jobs (name, audio_path, stage, submitted_at) VALUES (?, ?, 'queued', ?)",
+                (name, str(audio_path), _now())
+            )
+            return cursor.lastrowid
+
+    def get(self, job_id):
+        row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_job(row) if row else None
+
+    def get_many(self, job_ids):
+        """Jobs with the given ids, in the order given"""
+        if not job_ids:
+            return []
+        placeholders = ", ".join("?" for _ in job_ids)
+        rows = self._connect().execute(f"SELECT * FROM jobs WHERE id IN ({placeholders})", list(job_ids)).fetchall()
+        jobs = {row['id']: self._to_job(row) for row in rows}
+        return [jobs[job_id] for job_id in job_ids if job_id in jobs]
+
+    def claim(self, worker):
+        """Mark the oldest queued job as running for worker and return it, or None"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "UPDATE jobs SET status = 'running', stage = 'starting', worker = ?, started_at = ? "
+                "WHERE id = (SELECT id FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1) "
+                "RETURNING *",
+                (worker, _now())
+            ).fetchone()
+        return self._to_job(row) if row else None
+
+    def update(self, job_id, **fields):
+        """Record progress of a running job"""
+        columns = ", ".join(f"{field} = ?" for field in fields)
+        values = [json.dumps(v, ensure_ascii=False) if k in JSON_FIELDS else v for k, v in fields.items()]
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", values + [job_id])
+
+    def finish(self, job_id, status, **fields):
+        """End a job as 'done' or 'error' and delete its spooled audio"""
+        job = self.get(job_id)
+        self.update(job_id, status=status, stage=status, finished_at=_now(), **fields)
+        if job:
+            Path(job['audio_path']).unlink(missing_ok=True)
+
+    def fail(self, job_id, error, **fields):
+        """End a job as 'error' with the given message"""
+        self.finish(job_id, 'error', error=str(error), **fields)
+
+    def requeue_stale(self, max_age=STALE_JOB_SECONDS):
+        """Put back in the queue running jobs whose worker has stopped answering"""
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE jobs SET status = 'queued', stage = 'queued', worker = NULL "
+                "WHERE status = 'running' AND started_at < ?",
+                (_now() - max_age,)
+            ).rowcount
+
+    def prune(self, max_age=JOB_RETENTION_SECONDS):
+        """Forget finished jobs older than max_age"""
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'error') AND finished_at < ?",
+                (_now() - max_age,)
+            )
+
+    def counts(self):
+        """Number of jobs per status"""
+        return dict(self._connect().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+def process_job(queue, job, assemblyai_key, groq_key):
+    """Run the pipeline for one claimed job and record the outcome"""
+    # Imported here so that importing job_queue stays cheap for the UI
+    from call_store import get_call_store
+    from emergency_pipeline import process_call
+
+    def on_event(kind, value):
+        if kind == 'status':
+            queue.update(job['id'], stage=value)
+        elif kind == 'transcript':
+            queue.update(job['id'], stage='analyzing', transcript=value)
+        elif kind == 'analysis_partial':
+            queue.update(job['id'], partial=value)
+
+    try:
+        call_record, coords, timings = process_call(
+            job['audio_path'], assemblyai_key, groq_key,
+            start_time=datetime.fromtimestamp(job['submitted_at']), on_event=on_event,
+            timings={'queue_wait': job['started_at'] - job['submitted_at']}
+        )
+    except Exception as e:
+        queue.fail(job['id'], e)
+        return
+
+    if call_record is None:
+        queue.fail(job['id'], "sin transcripción", timings=timings)
+        return
+    try:
+        call_id = get_call_store().add(call_record)
+        queue.finish(job['id'], 'done', call_id=call_id, coords=list(coords) if coords else None, timings=timings)
+    except Exception as e:
+        queue.fail(job['id'], f"Error al guardar la llamada: {e}", timings=timings)
+
+def run_worker(path, assemblyai_key, groq_key, poll_interval=JOB_POLL_INTERVAL, stop=None):
+    """Worker loop: claim and process jobs until stop is set"""
+    queue = JobQueue(path)
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    queue.requeue_stale()
+    while not (stop and stop.is_set()):
+        job = queue.claim(worker)
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+        # A failing job must not stop the worker; it is recorded and the loop goes on
+        try:
+            process_job(queue, job, assemblyai_key, groq_key)
+        except Exception as e:
+            try:
+                queue.fail(job['id'], e)
+            except Exception:
+                # The queue itself is unavailable; requeue_stale will pick the job up again
+                time.sleep(poll_interval)
+
+class _ParentGone:
+    """Stop flag for run_worker, set once the process that started the worker has exited"""
+
+    def __init__(self, parent_pid):
+        self.parent_pid = parent_pid
+
+    def is_set(self):
+        return os.getppid() != self.parent_pid
+
+def _worker_process(path, assemblyai_key, groq_key, parent_pid):
+    """Body of a worker process started by start_workers"""
+    # Exit through sys.exit on terminate(), so a local transcription pool is shut down too
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    run_worker(path, assemblyai_key, groq_key, stop=_ParentGone(parent_pid))
+
+def stop_workers(workers, timeout=5):
+    """Terminate worker processes and wait for them to exit"""
+    for process in workers:
+        if process.is_alive():
+            process.terminate()
+    for process in workers:
+        process.join(timeout)
+        if process.is_alive():
+            process.kill()
+
+def start_workers(count, path, assemblyai_key, groq_key):
+    """Start count worker processes; they exit with the process that started them"""
+    # This process serves the AssemblyAI webhooks (if enabled) for its workers
+    get_webhook_receiver()
+    context = multiprocessing.get_context('spawn')
+    workers = []
+    for _ in range(count):
+        # Not daemonic: the local transcription backend starts its own process pool
+        process = context.Process(
+            target=_worker_process, args=(str(path), assemblyai_key, groq_key, os.getpid()), name="job-worker"
+        )
+        process.start()
+        workers.append(process)
+    atexit.register(stop_workers, workers)
+    return workers
+
+_queue = None
+_workers = []
+_queue_lock = threading.Lock()
+
+def queue_path():
+    return os.environ.get('JOB_QUEUE_PATH', DEFAULT_QUEUE_PATH)
+
+def get_job_queue():
+    """Process-wide job queue at JOB_QUEUE_PATH"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue(queue_path())
+            _queue.prune()
+        return _queue
+
+def ensure_workers(assemblyai_key, groq_key):
+    """Start JOB_WORKERS worker processes once per process, replacing any that died"""
+    count = int(os.environ.get('JOB_WORKERS', 2))
+    with _queue_lock:
+        _workers[:] = [process for process in _workers if process.is_alive()]
+        missing = count - len(_workers)
+        if missing > 0:
+            _workers.extend(start_workers(missing, queue_path(), assemblyai_key, groq_key))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Procesa llamadas de la cola de trabajos.")
+    parser.add_argument('--workers', type=int, default=max((os.cpu_count() or 2) // 2, 1))
+    args = parser.parse_args(argv)
+
+    assemblyai_key = os.environ.get('ASSEMBLYAI_API_KEY')
+    groq_key = os.environ.get('GROQ_API_KEY')
+    if get_transcription_backend().requires_api_key and not assemblyai_key:
+        parser.error("defina ASSEMBLYAI_API_KEY en el entorno")
+    if not groq_key:
+        parser.error("defina GROQ_API_KEY en el entorno")
+
+    workers = start_workers(args.workers, queue_path(), assemblyai_key, groq_key)
+    print(f"{len(workers)} procesos atendiendo la cola {queue_path()}")
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        for process in workers:
+            process.join()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,301 @@
+"""Live transcription of calls in progress.
+
+Audio arrives as raw 16-bit mono PCM, either from a file that is still
+being written or from a local TCP socket. The stream is cut into segments
+at pauses in speech, each segment is transcribed as soon as it closes
+(several can be in flight at once), and the cheap analysis stages, location
+extraction and rule-based keyword triage, are rerun on every new segment so
+severity and location show up while the caller is still talking.
+
+Segments go through transcribe_audio like any other recording, so the
+per-segment latency is that of the transcription service. A segment that
+fails to transcribe leaves a gap marker in the transcript and the call
+goes on.
+
+From the command line, to listen on a socket and print partial results:
+
+    python live_transcription.py --port 9000
+
+The AssemblyAI key is read from the ASSEMBLYAI_API_KEY environment variable.
+"""
+import argparse
+import io
+import math
+import os
+import socket
+import sys
+import time
+import wave
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from emergency_pipeline import extract_location, transcribe_audio
+from transcription_backends import get_transcription_backend
+from triage_rules import find_keywords, fold, severity_for
+
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+CHUNK_SIZE = 3200  # 100 ms at 16 kHz
+
+FRAME_MS = 30
+# Frames quieter than this RMS count as silence
+SILENCE_RMS = 500
+# A segment is closed at the first pause this long once it reaches the minimum length
+PAUSE_MS = 300
+MIN_SEGMENT_SECONDS = 3
+MAX_SEGMENT_SECONDS = 10
+# Characters of the previous text rescanned with each new segment, so words
+# and addresses split across a boundary are still found
+ANALYSIS_OVERLAP = 80
+# Seconds to wait for the audio connection, and for data once connected
+ACCEPT_TIMEOUT = 60
+RECV_TIMEOUT = 5.0
+# Stands in the transcript for a segment that could not be transcribed
+GAP_MARKER = "[…]"
+
+def follow_file(path, chunk_size=CHUNK_SIZE, poll_interval=0.1, idle_timeout=5.0):
+    """Yield chunks of a file as it grows, ending after idle_timeout without new data.
+
+    A WAV header at the start of the file is skipped.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(12)
+        if header.startswith(b'RIFF') and header[8:12] == b'WAVE':
+            _skip_to_wav_data(f)
+        else:
+            f.seek(0)
+
+        last_data = time.monotonic()
+        while True:
+            chunk = f.read(chunk_size)
+            if chunk:
+                last_data = time.monotonic()
+                yield chunk
+            elif time.monotonic() - last_data > idle_timeout:
+                return
+            else:
+                time.sleep(poll_interval)
+
+def _skip_to_wav_data(f):
+    """Advance a file positioned after the RIFF header to the start of its samples"""
+    while True:
+        chunk_header = f.read(8)
+        if len(chunk_header) < 8:
+            return
+        size = int.from_bytes(chunk_header[4:], 'little')
+        if chunk_header[:4] == b'data':
+            return
+        f.seek(size + (size % 2), io.SEEK_CUR)
+
+def socket_chunks(host='127.0.0.1', port=9000, chunk_size=CHUNK_SIZE,
+                  accept_timeout=ACCEPT_TIMEOUT, idle_timeout=RECV_TIMEOUT):
+    """Accept one connection on a local socket and yield its audio until it
+    closes or sends nothing for idle_timeout seconds.
+
+    Raises TimeoutError if nobody connects within accept_timeout seconds, so
+    the caller (and the port) is never held indefinitely.
+    """
+    with socket.create_server((host, port)) as server:
+        server.settimeout(accept_timeout)
+        try:
+            conn, _ = server.accept()
+        except socket.timeout:
+            raise TimeoutError(f"No se recibió conexión de audio en el puerto {port} en {accept_timeout} s") from None
+        with conn:
+            conn.settimeout(idle_timeout)
+            while True:
+                try:
+                    chunk = conn.recv(chunk_size)
+                except socket.timeout:
+                    return
+                if not chunk:
+                    return
+                yield chunk
+
+def frame_rms(frame):
+    """Root mean square amplitude of a frame of 16-bit samples"""
+    samples = array('h', frame[:len(frame) - len(frame) % SAMPLE_WIDTH])
+    if not samples:
+        return 0
+    return math.sqrt(sum(s * s for s in samples) / len(samples))
+
+def pcm_to_wav(pcm, sample_rate=SAMPLE_RATE):
+    """Wrap raw 16-bit mono PCM in a WAV container"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(SAMPLE_WIDTH)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm)
+    return buffer.getvalue()
+
+class Segmenter:
+    """Cuts a PCM stream into segments at pauses in speech"""
+
+    def __init__(self, sample_rate=SAMPLE_RATE):
+        self.frame_bytes = sample_rate * SAMPLE_WIDTH * FRAME_MS // 1000
+        self.min_bytes = sample_rate * SAMPLE_WIDTH * MIN_SEGMENT_SECONDS
+        self.max_bytes = sample_rate * SAMPLE_WIDTH * MAX_SEGMENT_SECONDS
+        self.pause_frames = PAUSE_MS // FRAME_MS
+        self._pending = bytearray()
+        self._segment = bytearray()
+        self._silent_frames = 0
+
+    def feed(self, chunk):
+        """Add audio and return the list of segments it completed"""
+        self._pending.extend(chunk)
+        segments = []
+        while len(self._pending) >= self.frame_bytes:
+            frame = bytes(self._pending[:self.frame_bytes])
+            del self._pending[:self.frame_bytes]
+            self._segment.extend(frame)
+
+            if frame_rms(frame) < SILENCE_RMS:
+                self._silent_frames += 1
+            else:
+                self._silent_frames = 0
+
+            paused = self._silent_frames >= self.pause_frames and len(self._segment) >= self.min_bytes
+            if paused or len(self._segment) >= self.max_bytes:
+                segments.append(bytes(self._segment))
+                self._segment.clear()
+                self._silent_frames = 0
+        return segments
+
+    def flush(self):
+        """Return whatever audio is left as a final segment, or None"""
+        self._segment.extend(self._pending)
+        self._pending.clear()
+        segment = bytes(self._segment) if self._segment else None
+        self._segment.clear()
+        return segment
+
+class LiveAnalysis:
+    """Partial transcript plus the cheap analysis, updated one segment at a time"""
+
+    def __init__(self):
+        self.segments = []
+        self.location = None
+        self.keywords = []
+        self.severity = None
+        self.gaps = 0
+        self.last_error = None
+
+    @property
+    def transcript(self):
+        return ' '.join(self.segments)
+
+    @property
+    def transcribed(self):
+        """Number of segments with transcribed text"""
+        return len(self.segments) - self.gaps
+
+    def add_gap(self, error):
+        """Mark a segment that could not be transcribed"""
+        self.segments.append(GAP_MARKER)
+        self.gaps += 1
+        self.last_error = str(error)
+
+    def add_segment(self, text):
+        """Append a transcribed segment and rescan only the new text"""
+        text = (text or '').strip()
+        if not text:
+            return
+        window = self.transcript[-ANALYSIS_OVERLAP:] + ' ' + text
+        self.segments.append(text)
+
+        location = extract_location(window)
+        if location:
+            self.location = location
+
+        known = {fold(item['palabra']) for item in self.keywords}
+        for item in find_keywords(window):
+            if fold(item['palabra']) not in known:
+                known.add(fold(item['palabra']))
+                # Spans refer to the scan window, not the whole transcript
+                self.keywords.append({k: item[k] for k in ('categoria', 'palabra', 'severidad')})
+        self.severity = severity_for(self.keywords) if self.keywords else None
+
+    def snapshot(self):
+        return {
+            'transcript': self.transcript,
+            'segments': len(self.segments),
+            'location': self.location,
+            'keywords': list(self.keywords),
+            'severity': self.severity,
+            'gaps': self.gaps
+        }
+
+def transcribe_live(chunks, api_key, on_update=None, sample_rate=SAMPLE_RATE,
+                    transcribe_segment=None, max_in_flight=3):
+    """Transcribe a live PCM stream segment by segment.
+
+    on_update(snapshot) is called after every segment, in audio order.
+    transcribe_segment(wav_bytes) defaults to transcribe_audio with api_key.
+    A segment it fails on becomes a gap (LiveAnalysis.add_gap) instead of
+    ending the call. Returns the final LiveAnalysis.
+    """
+    if transcribe_segment is None:
+        def transcribe_segment(wav_bytes):
+            return transcribe_audio(wav_bytes, api_key)
+
+    analysis = LiveAnalysis()
+    segmenter = Segmenter(sample_rate)
+    in_flight = deque()
+
+    def apply(future):
+        try:
+            text = future.result()
+        except Exception as e:
+            analysis.add_gap(e)
+        else:
+            analysis.add_segment(text)
+        if on_update:
+            on_update(analysis.snapshot())
+
+    with ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="live") as pool:
+        def submit(segment):
+            in_flight.append(pool.submit(transcribe_segment, pcm_to_wav(segment, sample_rate)))
+
+        for chunk in chunks:
+            for segment in segmenter.feed(chunk):
+                submit(segment)
+            # Apply finished segments in order without blocking the audio stream
+            while in_flight and in_flight[0].done():
+                apply(in_flight.popleft())
+
+        remainder = segmenter.flush()
+        if remainder:
+            submit(remainder)
+        while in_flight:
+            apply(in_flight.popleft())
+
+    return analysis
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Transcribe una llamada en vivo (PCM 16 bits mono).")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--port', type=int, help="puerto local donde recibir el audio")
+    source.add_argument('--file', help="archivo que se está escribiendo con el audio")
+    parser.add_argument('--sample-rate', type=int, default=SAMPLE_RATE)
+    args = parser.parse_args(argv)
+
+    api_key = os.environ.get('ASSEMBLYAI_API_KEY')
+    if get_transcription_backend().requires_api_key and not api_key:
+        parser.error("defina ASSEMBLYAI_API_KEY en el entorno")
+
+    chunks = socket_chunks(port=args.port) if args.port else follow_file(args.file)
+
+    def on_update(snapshot):
+        print(f"[{snapshot['segments']}] severidad: {snapshot['severity'] or '-'} "
+              f"ubicación: {snapshot['location'] or '-'} segmentos sin transcribir: {snapshot['gaps']}")
+        print(f"    {snapshot['transcript'][-200:]}")
+
+    analysis = transcribe_live(chunks, api_key, on_update, sample_rate=args.sample_rate)
+    print()
+    print(analysis.transcript)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,196 @@
+"""Extraction and normalization of locations mentioned in a call.
+
+All patterns are compiled once at import into a single matcher, which
+scans the accent-folded transcript in one pass and returns every candidate
+address or place with its span in the original text and a confidence.
+Street numbers may be digits or spoken ("calle cuarenta y cinco"); a
+spoken plate number is only taken after "con" or a separator like "#" or
+"número", since after a bare space it is usually not part of the address.
+
+normalize_location turns any way of writing an address into one key, so
+"Carrera 7 # 45-12", "kr 7 45 12" and "carrera siete número cuarenta y
+cinco doce" all become "carrera 7 45 12". Geocoding uses it as its cache
+and index key.
+"""
+import re
+
+from triage_rules import fold
+
+STREET_TYPES = {
+    'calle': 'calle', 'cl': 'calle', 'cll': 'calle', 'clle': 'calle',
+    'carrera': 'carrera', 'cra': 'carrera', 'kr': 'carrera', 'kra': 'carrera', 'cr': 'carrera',
+    'avenida': 'avenida', 'av': 'avenida', 'avda': 'avenida',
+    'transversal': 'transversal', 'tv': 'transversal', 'tr': 'transversal',
+    'diagonal': 'diagonal', 'dg': 'diagonal',
+    'circunvalar': 'circunvalar',
+}
+
+# Spoken numbers, after folding. "un"/"una" are left out: as street
+# numbers they are rare and as articles they are everywhere.
+UNITS = {
+    'uno': 1, 'dos': 2, 'tres': 3, 'cuatro': 4, 'cinco': 5,
+    'seis': 6, 'siete': 7, 'ocho': 8, 'nueve': 9,
+}
+TEENS = {
+    'diez': 10, 'once': 11, 'doce': 12, 'trece': 13, 'catorce': 14, 'quince': 15,
+    'dieciseis': 16, 'diecisiete': 17, 'dieciocho': 18, 'diecinueve': 19,
+    'veinte': 20, 'veintiuno': 21, 'veintiun': 21, 'veintidos': 22, 'veintitres': 23,
+    'veinticuatro': 24, 'veinticinco': 25, 'veintiseis': 26, 'veintisiete': 27,
+    'veintiocho': 28, 'veintinueve': 29,
+}
+TENS = {
+    'treinta': 30, 'cuarenta': 40, 'cincuenta': 50, 'sesenta': 60,
+    'setenta': 70, 'ochenta': 80, 'noventa': 90,
+}
+HUNDREDS = {
+    'cien': 100, 'ciento': 100, 'doscientos': 200, 'trescientos': 300, 'cuatrocientos': 400,
+    'quinientos': 500, 'seiscientos': 600, 'setecientos': 700, 'ochocientos': 800,
+    'novecientos': 900,
+}
+# Ordinals name streets too ("carrera séptima")
+ORDINALS = {
+    'primera': 1, 'segunda': 2, 'tercera': 3, 'cuarta': 4, 'quinta': 5,
+    'sexta': 6, 'septima': 7, 'octava': 8, 'novena': 9, 'decima': 10,
+}
+NUMBER_WORDS = {**UNITS, **TEENS, **TENS, **HUNDREDS, **ORDINALS}
+
+# Words that end a place name ("barrio kennedy que queda ...")
+PLACE_STOPWORDS = {
+    'que', 'y', 'o', 'por', 'donde', 'cerca', 'hay', 'esta', 'es', 'en', 'a', 'al',
+    'con', 'porque', 'pero', 'como', 'frente', 'junto', 'para', 'se', 'me', 'nos',
+}
+
+def _alternation(words):
+    return '|'.join(sorted(map(re.escape, words), key=len, reverse=True))
+
+_number_word = rf'(?:{_alternation(NUMBER_WORDS)})'
+_spoken = rf'{_number_word}(?:\s+(?:y\s+)?{_number_word})*'
+_digits = r'\d+[a-z]?\b'
+_number = rf'(?:\d+[a-z]?|{_spoken})\b'
+_via = rf'(?:{_alternation(STREET_TYPES)})'
+_plate_separator = r'\s*(?:#|n°|no\.?|nro\.?|num\.?|numero)\s*'
+# After a plate number: "-12" or " 12"; spoken ones are already part of _spoken
+_plate_suffix = rf'(?:\s*-\s*\d+\b|\s+{_digits})?'
+
+_location_pattern = re.compile(
+    rf'\b(?P<address>(?P<via>{_via})\.?\s*{_number}(?:\s+bis)?(?:\s+(?:sur|este))?'
+    rf'(?:\s+con\s+(?:{_via}\.?\s*)?{_number}'
+    rf'|{_plate_separator}{_number}{_plate_suffix}'
+    # Without a separator only digits: "calle 10 tres personas" is not "calle 10 # 3"
+    rf'|\s+{_digits}{_plate_suffix})?)'
+    rf'|\b(?P<place>(?:barrio|localidad|sector|urbanizacion|conjunto)\s+[a-zñ]+(?:\s+[a-zñ]+){{0,3}})'
+)
+_number_phrase = re.compile(_spoken)
+_stripped_words = re.compile(r'\b(?:no|nro|num|numero)\b\.?|n°')
+
+def spoken_numbers(words):
+    """Values of a sequence of number words, splitting where a new number starts.
+
+    ['cuarenta', 'y', 'cinco', 'doce'] -> [45, 12]
+    """
+    numbers = []
+    current = None
+    # What the current number can still take: 'tens', 'units' or nothing
+    accepts = ()
+    for word in words:
+        if word == 'y':
+            continue
+        value = NUMBER_WORDS[word]
+        if current is not None and word in TENS and 'tens' in accepts:
+            current += value
+            accepts = ('units',)
+        elif current is not None and (word in UNITS or word in TEENS) and accepts:
+            if word in TEENS and 'tens' not in accepts:
+                numbers.append(current)
+                current, accepts = value, ()
+            else:
+                current += value
+                accepts = ()
+        else:
+            if current is not None:
+                numbers.append(current)
+            current = value
+            if word in HUNDREDS and word != 'cien':
+                accepts = ('tens', 'units')
+            elif word in TENS:
+                accepts = ('units',)
+            else:
+                accepts = ()
+    if current is not None:
+        numbers.append(current)
+    return numbers
+
+def _replace_spoken(text):
+    return _number_phrase.sub(
+        lambda m: ' '.join(str(n) for n in spoken_numbers(m.group(0).split())), text
+    )
+
+def normalize_location(text):
+    """Canonical key of an address or place name, used for caching and geocoding"""
+    text = _replace_spoken(fold(text))
+    text = _stripped_words.sub(' ', text)
+    tokens = [STREET_TYPES.get(token, token) for token in re.findall(r'\d+[a-z]?|[a-zñ]+', text)]
+    # "calle 45 con carrera 7" names the same corner as "calle 45 7"
+    canonical = []
+    skip_via = False
+    for token in tokens:
+        if token == 'con':
+            skip_via = True
+            continue
+        if skip_via and token in STREET_TYPES.values():
+            skip_via = False
+            continue
+        skip_via = False
+        canonical.append(token)
+    return ' '.join(canonical)
+
+def _confidence(kind, via, key):
+    """Rough likelihood that a candidate really is the caller's location"""
+    if kind == 'place':
+        return 0.6
+    numbers = sum(token[0].isdigit() for token in key.split())
+    confidence = {1: 0.5, 2: 0.8}.get(numbers, 0.95)
+    # Abbreviations like "cr" and "av" are more often false positives
+    if via not in STREET_TYPES.values():
+        confidence -= 0.1
+    return round(confidence, 2)
+
+def _trim_place(folded, start, end):
+    """End of a place mention, cut before the first stopword after its name"""
+    words = list(re.finditer(r'[a-zñ]+', folded[start:end]))
+    for word in words[2:]:
+        if word.group(0) in PLACE_STOPWORDS:
+            return start + word.start() - 1
+    return end
+
+def find_locations(text):
+    """Every candidate location in text, in order of appearance.
+
+    Each is a dict with 'texto' (as written), 'clave' (normalized key),
+    'tipo' ('direccion' or 'lugar'), 'confianza', 'inicio' and 'fin'.
+    """
+    folded = fold(text)
+    candidates = []
+    for match in _location_pattern.finditer(folded):
+        kind = 'place' if match.group('place') else 'address'
+        start, end = match.span()
+        if kind == 'place':
+            end = _trim_place(folded, start, end)
+        written = text[start:end]
+        key = normalize_location(written)
+        candidates.append({
+            'texto': written,
+            'clave': key,
+            'tipo': 'lugar' if kind == 'place' else 'direccion',
+            'confianza': _confidence(kind, match.group('via'), key),
+            'inicio': start,
+            'fin': end
+        })
+    return candidates
+
+def extract_location(text):
+    """Most likely location in text as written, or None"""
+    candidates = find_locations(text)
+    if not candidates:
+        return None
+    return max(candidates, key=lambda c: c['confianza'])['texto']
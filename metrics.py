@@ -0,0 +1,170 @@
+"""Latency metrics of the call pipeline.
+
+Every processed call carries the duration in seconds of each stage of the
+pipeline in call_record['timings'], and the names of the stages that
+failed in call_record['stage_errors']. The call store keeps them in a
+table of their own, so calls processed by worker processes and by other
+dispatcher sessions all count. This module turns them into percentiles
+for the "Rendimiento" panel and into Prometheus histograms.
+
+With METRICS_PORT set, the app serves the histograms in the Prometheus
+text format at http://<host>:METRICS_PORT/metrics. They can also be served
+without the app, for example next to the workers:
+
+    python metrics.py --port 9100
+"""
+import argparse
+import math
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# In pipeline order; total is from the call's arrival to its record being ready
+PIPELINE_STAGES = [
+    'queue_wait', 'upload', 'transcription', 'extraction', 'analysis_ttft',
+    'analysis', 'geocode', 'render', 'total',
+]
+STAGE_LABELS = {
+    'queue_wait': "Espera en cola",
+    'upload': "Subida de audio",
+    'transcription': "Transcripción",
+    'extraction': "Extracción de ubicación",
+    'analysis_ttft': "Análisis IA (primer token)",
+    'analysis': "Análisis IA",
+    'geocode': "Geocodificación",
+    'render': "Presentación",
+    'total': "Total hasta despacho",
+}
+# Upper bounds in seconds of the histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+REPORTED_PERCENTILES = (50, 95, 99)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers, or None if it is empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100 * len(ordered)) - 1, 0)
+    return ordered[rank]
+
+def _stage_order(stage):
+    return PIPELINE_STAGES.index(stage) if stage in PIPELINE_STAGES else len(PIPELINE_STAGES)
+
+def stage_percentiles(store, since=None):
+    """One row per stage with its label, sample count and p50/p95/p99 in seconds"""
+    timings = store.stage_timings(since=since)
+    return [
+        {
+            'stage': stage,
+            'label': STAGE_LABELS.get(stage, stage),
+            'count': len(times),
+            **{f'p{pct}': percentile(times, pct) for pct in REPORTED_PERCENTILES}
+        }
+        for stage, times in sorted(timings.items(), key=lambda item: _stage_order(item[0]))
+    ]
+
+def _number(value):
+    return repr(float(value)) if value != math.inf else '+Inf'
+
+def _label(value):
+    """A label value escaped as the Prometheus text format requires"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def render_prometheus(store, buckets=LATENCY_BUCKETS):
+    """Stage histograms, stage failures and call totals in the Prometheus text format"""
+    histograms = store.stage_histograms(buckets)
+    lines = [
+        "# HELP emergencia_stage_duration_seconds Duration of each stage of call processing.",
+        "# TYPE emergencia_stage_duration_seconds histogram",
+    ]
+    for stage in sorted(histograms, key=_stage_order):
+        histogram = histograms[stage]
+        for bound, count in zip(buckets, histogram['buckets']):
+            lines.append(f'emergencia_stage_duration_seconds_bucket{{stage="{_label(stage)}",le="{_number(bound)}"}} {count}')
+        lines.append(f'emergencia_stage_duration_seconds_bucket{{stage="{_label(stage)}",le="+Inf"}} {histogram["count"]}')
+        lines.append(f'emergencia_stage_duration_seconds_sum{{stage="{_label(stage)}"}} {_number(histogram["sum"])}')
+        lines.append(f'emergencia_stage_duration_seconds_count{{stage="{_label(stage)}"}} {histogram["count"]}')
+
+    lines += [
+        "# HELP emergencia_stage_failures_total Calls in which a stage failed or ran out of time.",
+        "# TYPE emergencia_stage_failures_total counter",
+    ]
+    for stage in sorted(histograms, key=_stage_order):
+        lines.append(f'emergencia_stage_failures_total{{stage="{_label(stage)}"}} {histograms[stage]["failures"]}')
+
+    summary = store.summary()
+    lines += [
+        "# HELP emergencia_calls_total Processed calls by severity.",
+        "# TYPE emergencia_calls_total counter",
+    ]
+    for severity, count in sorted(summary['by_severity'].items()):
+        lines.append(f'emergencia_calls_total{{severity="{_label(severity)}"}} {count}')
+    return "\n".join(lines) + "\n"
+
+class MetricsServer:
+    """Local HTTP server answering GET /metrics from a call store"""
+
+    def __init__(self, store, host='0.0.0.0', port=9100):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+
+                body = render_prometheus(server.store).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', PROMETHEUS_CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.store = store
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metrics", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+_server = None
+_server_lock = threading.Lock()
+
+def get_metrics_server(store):
+    """Process-wide metrics server if METRICS_PORT is set, otherwise None"""
+    global _server
+    port = os.environ.get('METRICS_PORT')
+    if not port:
+        return None
+
+    with _server_lock:
+        if _server is None:
+            _server = MetricsServer(store, port=int(port))
+        return _server
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sirve las métricas de latencia en formato Prometheus.")
+    parser.add_argument('--port', type=int, default=int(os.environ.get('METRICS_PORT', 9100)))
+    args = parser.parse_args(argv)
+
+    from call_store import get_call_store
+    server = MetricsServer(get_call_store(), port=args.port)
+    print(f"Métricas en http://localhost:{server.port}/metrics")
+    try:
+        server._thread.join()
+    except KeyboardInterrupt:
+        server.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
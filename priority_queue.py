@@ -0,0 +1,204 @@
+"""Priority queue of open emergency calls, shared by every dispatcher session.
+
+Calls are kept in an indexed binary heap, so insertion and resolving a
+call by id are O(log n) and the most urgent call is always at the top.
+
+Calls are ordered by severity and then arrival time, with aging: every
+AGING_INTERVAL a call waits counts as one severity level, so an "Alto"
+call that has waited that long ranks with a "Crítico" call arriving now.
+The heap key is arrival time + severity rank * AGING_INTERVAL, which
+never changes while the call waits, so aging needs no re-sorting.
+
+Several calls about one incident (see incident_index.py) take one place
+in the queue: a call about an incident that already has a queued call
+counts as another report of that call, and raises its severity if the new
+report is more severe.
+"""
+import heapq
+import threading
+import time
+from datetime import datetime
+
+from call_store import get_call_store
+
+SEVERITY_RANK = {'Crítico': 0, 'Alto': 1, 'Medio': 2, 'Bajo': 3}
+SEVERITIES = list(SEVERITY_RANK)
+URGENT_SEVERITIES = ['Crítico', 'Alto']
+
+# Seconds of waiting that escalate a call by one severity level
+AGING_INTERVAL = 10 * 60
+
+def arrival_time(call_record):
+    """Epoch seconds at which a call arrived, from its timestamp"""
+    return datetime.strptime(call_record['timestamp'], "%Y-%m-%d %H:%M:%S").timestamp()
+
+def effective_severity(call_record, now=None):
+    """Severity after aging, never above Crítico"""
+    rank = SEVERITY_RANK.get(call_record.get('severity'), len(SEVERITIES))
+    waited = (now or time.time()) - arrival_time(call_record)
+    return SEVERITIES[max(min(rank, len(SEVERITIES) - 1) - int(waited // AGING_INTERVAL), 0)]
+
+class PriorityQueue:
+    """Indexed min-heap of call records keyed by aged priority"""
+
+    def __init__(self):
+        self._heap = []       # [key, call_id]
+        self._position = {}   # call_id -> index in _heap
+        self._calls = {}      # call_id -> call_record
+        self._incidents = {}  # incident id -> id of its queued call
+        self._reports = {}    # call_id -> ids of the other calls reporting its incident
+        self._lock = threading.Lock()
+        # Highest call id already read from the call store by sync()
+        self._synced_id = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __contains__(self, call_id):
+        return call_id in self._position
+
+    @staticmethod
+    def _rank(call_record):
+        return SEVERITY_RANK.get(call_record.get('severity'), len(SEVERITIES))
+
+    @classmethod
+    def _key(cls, call_record):
+        return (arrival_time(call_record) + cls._rank(call_record) * AGING_INTERVAL, call_record['id'])
+
+    def _swap(self, i, j):
+        heap = self._heap
+        heap[i], heap[j] = heap[j], heap[i]
+        self._position[heap[i][1]] = i
+        self._position[heap[j][1]] = j
+
+    def _sift_up(self, i):
+        while i > 0:
+            parent = (i - 1) // 2
+            if self._heap[i][0] >= self._heap[parent][0]:
+                break
+            self._swap(i, parent)
+            i = parent
+
+    def _sift_down(self, i):
+        size = len(self._heap)
+        while True:
+            smallest = i
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < size and self._heap[child][0] < self._heap[smallest][0]:
+                    smallest = child
+            if smallest == i:
+                return
+            self._swap(i, smallest)
+            i = smallest
+
+    def push(self, call_record):
+        """Add a call, or update it if its id is already queued.
+        
+        A call about an incident that already has a queued call is added to
+        that call as another report instead.
+        """
+        with self._lock:
+            call_id = call_record['id']
+            queued_id = self._incidents.get(call_record.get('incident_id') or call_id)
+            if queued_id is not None and queued_id != call_id:
+                self._add_report(queued_id, call_record)
+                return
+            if call_id in self._position:
+                # Keep a severity raised by further reports of the incident
+                queued = self._calls[call_id]
+                if self._rank(queued) < self._rank(call_record):
+                    call_record = dict(call_record, severity=queued['severity'])
+                self._remove(call_id)
+            self._insert(call_record)
+
+    def _insert(self, call_record):
+        call_id = call_record['id']
+        self._calls[call_id] = call_record
+        self._incidents[call_record.get('incident_id') or call_id] = call_id
+        self._heap.append([self._key(call_record), call_id])
+        self._position[call_id] = len(self._heap) - 1
+        self._sift_up(len(self._heap) - 1)
+
+    def _add_report(self, queued_id, call_record):
+        self._reports.setdefault(queued_id, set()).add(call_record['id'])
+        queued = self._calls[queued_id]
+        if self._rank(call_record) < self._rank(queued):
+            # Re-keyed with the queued call's arrival time, so it keeps its wait
+            self._remove(queued_id)
+            self._insert(dict(queued, severity=call_record['severity']))
+
+    def _remove(self, call_id):
+        i = self._position.pop(call_id)
+        call_record = self._calls.pop(call_id)
+        self._incidents.pop(call_record.get('incident_id') or call_id, None)
+        last = self._heap.pop()
+        if i < len(self._heap):
+            self._heap[i] = last
+            self._position[last[1]] = i
+            self._sift_up(i)
+            self._sift_down(self._position[last[1]])
+
+    def remove(self, call_id):
+        """Take a call out of the queue; returns False if it was not queued"""
+        with self._lock:
+            if call_id not in self._position:
+                return False
+            self._remove(call_id)
+            self._reports.pop(call_id, None)
+            return True
+
+    def reports(self, call_id):
+        """Number of calls reporting a queued call's incident, itself included"""
+        with self._lock:
+            return 1 + len(self._reports.get(call_id, ()))
+
+    def peek(self):
+        """The most urgent call, or None"""
+        with self._lock:
+            return self._calls[self._heap[0][1]] if self._heap else None
+
+    def ordered(self, limit=None, offset=0):
+        """Calls in priority order, from offset, at most limit of them.
+
+        Walks the heap from the root with a frontier of candidate nodes, so
+        a page costs O((offset + limit) log) however long the queue is.
+        """
+        with self._lock:
+            heap = self._heap
+            count = len(heap) if limit is None else min(offset + limit, len(heap))
+            result = []
+            frontier = [(heap[0][0], 0)] if heap else []
+            while frontier and len(result) < count:
+                _, i = heapq.heappop(frontier)
+                result.append(self._calls[heap[i][1]])
+                for child in (2 * i + 1, 2 * i + 2):
+                    if child < len(heap):
+                        heapq.heappush(frontier, (heap[child][0], child))
+            return result[offset:]
+
+    def sync(self, store):
+        """Queue urgent calls added to the store since the last sync, by this or other processes"""
+        for call_record in store.list_open(URGENT_SEVERITIES, after_id=self._synced_id):
+            self.push(call_record)
+            self._synced_id = max(self._synced_id, call_record['id'])
+
+    def clear(self):
+        with self._lock:
+            self._heap = []
+            self._position = {}
+            self._calls = {}
+            self._incidents = {}
+            self._reports = {}
+            self._synced_id = 0
+
+_queue = None
+_queue_lock = threading.Lock()
+
+def get_priority_queue():
+    """Process-wide queue, rebuilt from the open urgent calls in the call store"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = PriorityQueue()
+            _queue.sync(get_call_store())
+        return _queue
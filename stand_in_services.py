@@ -0,0 +1,405 @@
+"""Local stand-ins for AssemblyAI, Groq and Nominatim.
+
+Each stand-in is a small HTTP server that speaks just enough of the real
+API for the pipeline: uploads and transcripts for AssemblyAI, chat
+completions (streamed or not) for Groq and /search for Nominatim. A
+profile sets how long each service takes to answer and how often it fails
+or throttles, so the benchmark (benchmark.py) and development runs can
+exercise the whole pipeline without network access or API quota.
+
+The transcription stand-in does not decode audio. Each recording gets one
+of the scripted calls in SCRIPTS, picked and filled in from the
+recording's hash, so the same recording always gets the same transcript.
+The analysis comes from the rule-based triage in triage_rules.py.
+
+To point the app at them:
+
+    python stand_in_services.py --profile realistic
+
+prints the environment variables to set.
+"""
+import argparse
+import hashlib
+import io
+import itertools
+import json
+import multiprocessing
+import random
+import re
+import sys
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from location_extraction import extract_location
+from triage_rules import classify
+
+# Seconds of latency (with +/- jitter), failure and throttling rates, and
+# the service-specific pace: transcription time per second of audio and
+# streamed tokens per second (0 for no extra delay)
+PROFILES = {
+    'fast': {
+        'assemblyai': {'latency': 0.01},
+        'groq': {'latency': 0.02},
+        'nominatim': {'latency': 0.01},
+    },
+    'realistic': {
+        'assemblyai': {'latency': 0.15, 'jitter': 0.05, 'realtime_factor': 0.05},
+        'groq': {'latency': 0.35, 'jitter': 0.1, 'tokens_per_second': 300},
+        'nominatim': {'latency': 0.25, 'jitter': 0.1},
+    },
+    'degraded': {
+        'assemblyai': {'latency': 0.5, 'jitter': 0.3, 'realtime_factor': 0.15,
+                       'error_rate': 0.05, 'throttle_rate': 0.05},
+        'groq': {'latency': 1.0, 'jitter': 0.5, 'tokens_per_second': 120,
+                 'error_rate': 0.1, 'throttle_rate': 0.1},
+        'nominatim': {'latency': 0.8, 'jitter': 0.4, 'error_rate': 0.1},
+    },
+}
+
+SCRIPTS = [
+    "Por favor ayúdenme, mi papá se desmayó y no respira, estamos en la calle {calle} # {carrera}-{placa}, "
+    "es un anciano de ochenta años.",
+    "Hay un incendio en un edificio en la carrera {carrera} con calle {calle}, sale mucho humo y hay gente "
+    "atrapada en el tercer piso.",
+    "Acaban de asaltar una tienda en la avenida {carrera} # {calle}-{placa}, el ladrón tenía una pistola "
+    "y hay un herido.",
+    "Buenas tardes, hubo un choque leve en la calle {calle} con carrera {carrera}, nadie está herido pero "
+    "los carros bloquean la vía.",
+    "Mi vecina está gritando y escucho golpes, creo que la están golpeando, vivo en la calle {calle} "
+    "# {carrera}-{placa}.",
+    "Mi bebé tiene fiebre muy alta y está convulsionando, estoy en la transversal {carrera} # {calle}-{placa}, "
+    "por favor manden una ambulancia.",
+]
+ACTIONS = {
+    'Médica': ["Enviar ambulancia", "Dar instrucciones de primeros auxilios por teléfono"],
+    'Incendio': ["Enviar bomberos", "Evacuar el edificio"],
+    'Policía': ["Enviar patrulla", "Mantener a la persona en línea"],
+    'Otro': ["Enviar unidad de tránsito"],
+}
+# Rough size of a second of compressed call audio, for non-WAV recordings
+COMPRESSED_BYTES_PER_SECOND = 4000
+# Bogotá, for the made-up coordinates of the geocoding stand-in
+BOGOTA_BOUNDS = (4.50, 4.80, -74.20, -74.00)
+
+_prompt_transcript = re.compile(r'Transcripción: "(.*?)"\n\nResponde', re.DOTALL)
+_token = re.compile(r'\s*\S{1,4}')
+
+class ServiceProfile:
+    """Delay and failure behaviour of one stand-in"""
+
+    def __init__(self, latency=0.05, jitter=0.0, error_rate=0.0, throttle_rate=0.0,
+                 realtime_factor=0.0, tokens_per_second=0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.realtime_factor = realtime_factor
+        self.tokens_per_second = tokens_per_second
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self):
+        with self._lock:
+            seconds = self.latency + self._random.uniform(-self.jitter, self.jitter)
+        time.sleep(max(seconds, 0))
+
+    def failure(self):
+        """429, 503 or None for a request that should succeed"""
+        with self._lock:
+            roll = self._random.random()
+        if roll < self.throttle_rate:
+            return 429
+        if roll < self.throttle_rate + self.error_rate:
+            return 503
+        return None
+
+def _read_body(request):
+    if 'chunked' in request.headers.get('Transfer-Encoding', ''):
+        chunks = []
+        while True:
+            size = int(request.rfile.readline().split(b';')[0], 16)
+            chunk = request.rfile.read(size)
+            request.rfile.readline()
+            if not size:
+                return b''.join(chunks)
+            chunks.append(chunk)
+    return request.rfile.read(int(request.headers.get('Content-Length', 0)))
+
+def _send_json(request, status, payload, headers=None):
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    request.send_response(status)
+    request.send_header('Content-Type', 'application/json')
+    request.send_header('Content-Length', str(len(body)))
+    for name, value in (headers or {}).items():
+        request.send_header(name, value)
+    request.end_headers()
+    request.wfile.write(body)
+
+class StandInServer:
+    """Threaded HTTP server that delays or fails requests per its profile,
+    then answers them with handle()"""
+
+    name = None
+
+    def __init__(self, profile, host='127.0.0.1', port=0):
+        self.profile = profile
+        self.requests = 0
+        self._lock = threading.Lock()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, so the pipeline's connection pools are exercised
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                stand_in._dispatch(self, 'GET')
+
+            def do_POST(self):
+                stand_in._dispatch(self, 'POST')
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self.url = f"http://{host}:{self.port}"
+        self._thread = threading.Thread(target=self._server.serve_forever, name=self.name, daemon=True)
+        self._thread.start()
+
+    def _dispatch(self, request, method):
+        with self._lock:
+            self.requests += 1
+        # The body is read first so the connection can be reused after an error
+        body = _read_body(request) if method == 'POST' else b''
+        self.profile.delay()
+        status = self.profile.failure()
+        if status:
+            _send_json(request, status, {'error': "stand-in failure"}, {'Retry-After': '1'} if status == 429 else None)
+            return
+        url = urlsplit(request.path)
+        self.handle(request, method, url.path, parse_qs(url.query), body)
+
+    def handle(self, request, method, path, query, body):
+        raise NotImplementedError
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+def _audio_seconds(audio):
+    try:
+        with wave.open(io.BytesIO(audio)) as wav:
+            return wav.getnframes() / wav.getframerate()
+    except (wave.Error, EOFError):
+        return len(audio) / COMPRESSED_BYTES_PER_SECOND
+
+def scripted_transcript(digest):
+    """The scripted call for a recording with this SHA-256 digest"""
+    numbers = [int(digest[i:i + 4], 16) for i in range(0, 16, 4)]
+    return SCRIPTS[numbers[0] % len(SCRIPTS)].format(
+        calle=numbers[1] % 180 + 1, carrera=numbers[2] % 120 + 1, placa=numbers[3] % 90 + 10
+    )
+
+class AssemblyAIStandIn(StandInServer):
+    """/v2/upload and /v2/transcript; transcripts take realtime_factor x audio length"""
+
+    name = 'assemblyai'
+
+    def __init__(self, profile, **kwargs):
+        self._uploads = {}
+        self._transcripts = {}
+        self._ids = itertools.count(1)
+        super().__init__(profile, **kwargs)
+
+    def handle(self, request, method, path, query, body):
+        if method == 'POST' and path == '/v2/upload':
+            upload_id = next(self._ids)
+            # Only what the transcript needs is kept, not the audio
+            self._uploads[f"{self.url}/v2/files/{upload_id}"] = (hashlib.sha256(body).hexdigest(), _audio_seconds(body))
+            _send_json(request, 200, {'upload_url': f"{self.url}/v2/files/{upload_id}"})
+        elif method == 'POST' and path == '/v2/transcript':
+            upload = self._uploads.get(json.loads(body).get('audio_url'))
+            if upload is None:
+                _send_json(request, 400, {'error': "audio_url desconocida"})
+                return
+            digest, seconds = upload
+            transcript_id = f"t{next(self._ids)}"
+            self._transcripts[transcript_id] = {
+                'ready_at': time.monotonic() + seconds * self.profile.realtime_factor,
+                'text': scripted_transcript(digest)
+            }
+            _send_json(request, 200, {'id': transcript_id, 'status': 'queued'})
+        elif method == 'GET' and path.startswith('/v2/transcript/'):
+            transcript_id = path.rsplit('/', 1)[1]
+            transcript = self._transcripts.get(transcript_id)
+            if transcript is None:
+                _send_json(request, 404, {'error': "transcripción no encontrada"})
+            elif time.monotonic() < transcript['ready_at']:
+                _send_json(request, 200, {'id': transcript_id, 'status': 'processing'})
+            else:
+                _send_json(request, 200, {'id': transcript_id, 'status': 'completed', 'text': transcript['text']})
+        else:
+            _send_json(request, 404, {'error': "ruta no encontrada"})
+
+def scripted_analysis(transcript):
+    """An analysis in the LLM's format, from the rule-based triage"""
+    analysis = classify(transcript)
+    location = extract_location(transcript) or ""
+    return {
+        'tipo_emergencia': analysis['tipo_emergencia'],
+        'severidad_general': analysis['severidad_general'],
+        'ubicacion': location,
+        'acciones_inmediatas': ACTIONS.get(analysis['tipo_emergencia'], ACTIONS['Otro']),
+        'detalles_clave': [transcript.split(',')[0]],
+        'emocion': analysis['emocion'],
+        'icono_emocion': analysis['icono_emocion'],
+        'palabras_criticas': analysis['palabras_criticas'],
+        'justificacion': analysis['justificacion'],
+    }
+
+class GroqStandIn(StandInServer):
+    """/openai/v1/chat/completions, streamed as server-sent events when asked"""
+
+    name = 'groq'
+
+    def handle(self, request, method, path, query, body):
+        if method != 'POST' or path != '/openai/v1/chat/completions':
+            _send_json(request, 404, {'error': "ruta no encontrada"})
+            return
+        data = json.loads(body)
+        match = _prompt_transcript.search(data['messages'][-1]['content'])
+        content = json.dumps(scripted_analysis(match.group(1) if match else ""), ensure_ascii=False)
+        tokens = _token.findall(content)
+        pace = 1 / self.profile.tokens_per_second if self.profile.tokens_per_second else 0
+
+        if not data.get('stream'):
+            time.sleep(pace * len(tokens))
+            _send_json(request, 200, {'choices': [{'message': {'role': 'assistant', 'content': content}}]})
+            return
+
+        request.send_response(200)
+        request.send_header('Content-Type', 'text/event-stream')
+        request.send_header('Connection', 'close')
+        request.end_headers()
+        for token in tokens:
+            time.sleep(pace)
+            event = {'choices': [{'delta': {'content': token}}]}
+            request.wfile.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode('utf-8'))
+            request.wfile.flush()
+        request.wfile.write(b"data: [DONE]\n\n")
+        request.close_connection = True
+
+class NominatimStandIn(StandInServer):
+    """/search with made-up but stable coordinates inside Bogotá"""
+
+    name = 'nominatim'
+
+    def handle(self, request, method, path, query, body):
+        if path != '/search':
+            _send_json(request, 404, {'error': "ruta no encontrada"})
+            return
+        text = query.get('q', [''])[0]
+        digest = hashlib.sha256(text.encode('utf-8')).digest()
+        south, north, west, east = BOGOTA_BOUNDS
+        lat = south + (north - south) * digest[0] / 255
+        lon = west + (east - west) * digest[1] / 255
+        _send_json(request, 200, [{
+            'place_id': int.from_bytes(digest[:4], 'big'),
+            'lat': f"{lat:.6f}",
+            'lon': f"{lon:.6f}",
+            'display_name': text,
+        }])
+
+class StandInServices:
+    """The three stand-ins, started together with a named or custom profile"""
+
+    def __init__(self, profile='realistic', seed=0, host='127.0.0.1', ports=(0, 0, 0)):
+        settings = PROFILES[profile] if isinstance(profile, str) else profile
+        self.servers = [
+            cls(ServiceProfile(seed=seed + i, **settings.get(cls.name, {})), host=host, port=port)
+            for i, (cls, port) in enumerate(zip((AssemblyAIStandIn, GroqStandIn, NominatimStandIn), ports))
+        ]
+        self.assemblyai, self.groq, self.nominatim = self.servers
+
+    def environment(self):
+        """Environment variables that point the pipeline at the stand-ins"""
+        return {
+            'ASSEMBLYAI_BASE_URL': f"{self.assemblyai.url}/v2",
+            'GROQ_BASE_URL': f"{self.groq.url}/openai/v1",
+            'NOMINATIM_URL': self.nominatim.url,
+        }
+
+    def request_counts(self):
+        return {server.name: server.requests for server in self.servers}
+
+    def close(self):
+        for server in self.servers:
+            server.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def _serve(profile, seed, connection):
+    services = StandInServices(profile, seed)
+    connection.send(services.environment())
+    # Serve until asked for the request counts
+    connection.recv()
+    connection.send(services.request_counts())
+    services.close()
+
+class StandInProcess:
+    """StandInServices in a child process, so that measuring the pipeline
+    does not also measure the stand-ins' CPU and memory"""
+
+    def __init__(self, profile='realistic', seed=0):
+        context = multiprocessing.get_context('spawn')
+        self._connection, child = context.Pipe()
+        self._process = context.Process(target=_serve, args=(profile, seed, child), daemon=True, name="stand-ins")
+        self._process.start()
+        self._environment = self._connection.recv()
+        self._counts = None
+
+    def environment(self):
+        return dict(self._environment)
+
+    def request_counts(self):
+        if self._counts is None:
+            self._connection.send('stop')
+            self._counts = self._connection.recv()
+        return self._counts
+
+    def close(self):
+        self.request_counts()
+        self._process.join(timeout=5)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inicia servidores locales que imitan AssemblyAI, Groq y Nominatim.")
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='realistic')
+    parser.add_argument('--port', type=int, default=8701,
+                        help="puerto del primero; los otros usan los dos siguientes")
+    args = parser.parse_args(argv)
+
+    services = StandInServices(args.profile, ports=(args.port, args.port + 1, args.port + 2))
+    for name, value in services.environment().items():
+        print(f"export {name}={value}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        services.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,235 @@
+"""Startup and rerun benchmark of the Streamlit app.
+
+Measures what a new replica and each dispatcher click cost, in a fresh
+Python process:
+
+* import: importing streamlit, before the app runs;
+* first run: the app's first run in the process, with every import it
+  triggers, as on the cold start of a new container;
+* tabs: the first run with each tab open, and p50/p95 of the reruns that
+  follow, as when a dispatcher clicks something on that tab.
+
+It also lists the heavy libraries (pandas, folium...) that the first run
+waited for, leaving out those the app preloads in the background after
+serving the page. The app runs under streamlit's AppTest against an
+in-memory call store filled with --calls synthetic calls from the last
+hours, without worker processes:
+
+    python startup_benchmark.py
+    python startup_benchmark.py --calls 2000 --reruns 30
+
+The result is compared with benchmarks/startup.json. The run fails (exit
+status 1) if the import, the first run or a tab's first run or p50 rerun
+takes longer than --tolerance over the baseline. --update-baseline stores
+the result as the new baseline instead.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+APP_PATH = Path(__file__).parent / 'emergency_transcription.py'
+BASELINE_PATH = Path(__file__).parent / 'benchmarks' / 'startup.json'
+DEFAULT_TOLERANCE = 0.25
+# Time changes smaller than this (seconds) are noise, whatever the ratio
+TIME_SLACK = 0.05
+HEAVY_MODULES = ('pandas', 'pyarrow', 'folium', 'streamlit_folium', 'geopy')
+# Thread of preload_modules() in emergency_transcription.py
+PRELOAD_THREAD = 'preload'
+
+# The app's tabs, as labelled in emergency_transcription.py
+TAB_KEY = 'main_tab'
+TABS = {
+    'audio': "📁 Procesar Audio",
+    'analytics': "📊 Analíticas",
+    'batch': "📦 Procesamiento por Lotes",
+    'live': "🔴 Llamada en Vivo",
+    'map': "🗺️ Mapa Operativo",
+    'history': "📈 Histórico",
+}
+
+def seed_calls(store, count, seed=0):
+    """Add count synthetic calls from the last six hours, spread over Bogotá"""
+    rng = random.Random(seed)
+    now = datetime.now()
+    for i in range(count):
+        arrived = now - timedelta(minutes=rng.uniform(0, 360))
+        severity = rng.choice(['Crítico', 'Alto', 'Medio', 'Bajo'])
+        store.add({
+            'timestamp': arrived.strftime("%Y-%m-%d %H:%M:%S"),
+            'time': arrived.strftime("%H:%M"),
+            'transcript': "Hay un incendio con humo en la calle 45 con carrera 12, hay heridos",
+            'summary': "- **Tipo de Emergencia**: Incendio",
+            'location': f"calle {rng.randint(1, 200)} # {rng.randint(1, 100)}-{rng.randint(1, 99)}",
+            'coords': [4.55 + rng.random() * 0.2, -74.2 + rng.random() * 0.15],
+            'severity': severity,
+            'type': rng.choice(['Médica', 'Incendio', 'Policía', 'Otro']),
+            'alerts': [{'categoria': 'fuego', 'palabra': 'incendio', 'severidad': 'ALTA'}],
+            'emotion': rng.choice(['CALMA', 'ESTRÉS MODERADO', 'ESTRÉS ALTO']),
+            'emotion_icon': '🟡',
+            'details': "Hay un incendio con humo...",
+            'justificacion': "sintética",
+            'timings': {'transcription': rng.uniform(2, 20), 'analysis': rng.uniform(1, 5), 'total': rng.uniform(5, 30)},
+            'stage_errors': [],
+            'incident_id': None,
+        })
+
+class _ImportRecorder:
+    """Import hook that records which thread first imported each heavy module"""
+
+    def __init__(self):
+        self.threads = {}
+
+    def find_spec(self, name, path=None, target=None):
+        # importlib.util.find_spec asks the finders too; only count imports
+        if name in HEAVY_MODULES and sys._getframe(2).f_code.co_name == '_find_and_load_unlocked':
+            self.threads.setdefault(name, threading.current_thread().name)
+        return None
+
+def _timed_run(app, tab=None):
+    if tab:
+        app.session_state[TAB_KEY] = tab
+    started = time.perf_counter()
+    app.run()
+    elapsed = time.perf_counter() - started
+    if app.exception:
+        raise RuntimeError(app.exception[0].value)
+    return elapsed
+
+def measure(calls=500, reruns=10, seed=0):
+    """Measure this process's import, first run and reruns; call in a fresh process"""
+    if 'streamlit' in sys.modules:
+        raise RuntimeError("El benchmark de arranque debe ejecutarse en un proceso nuevo")
+    os.environ['CALL_STORE_URL'] = 'memory://'
+    os.environ['JOB_WORKERS'] = '0'
+    scratch = Path(tempfile.mkdtemp())
+    os.environ['JOB_QUEUE_PATH'] = str(scratch / 'jobs.db')
+    os.environ['CALL_ARCHIVE_DIR'] = str(scratch / 'archive')
+    os.environ.pop('METRICS_PORT', None)
+
+    started = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+    import_time = time.perf_counter() - started
+
+    from call_store import get_call_store
+    from metrics import percentile
+    seed_calls(get_call_store(), calls, seed)
+
+    recorder = _ImportRecorder()
+    sys.meta_path.insert(0, recorder)
+    app = AppTest.from_file(str(APP_PATH), default_timeout=300)
+    first_run = _timed_run(app)
+    sys.meta_path.remove(recorder)
+    loaded = [name for name, thread in recorder.threads.items() if thread != PRELOAD_THREAD]
+
+    tabs = {}
+    for name, label in TABS.items():
+        first_open = _timed_run(app, label)
+        times = [_timed_run(app, label) for _ in range(reruns)]
+        tabs[name] = {'first': first_open, 'p50': percentile(times, 50), 'p95': percentile(times, 95)}
+
+    return {
+        'calls': calls,
+        'reruns': reruns,
+        'import': import_time,
+        'first_run': first_run,
+        'heavy_modules': loaded,
+        'tabs': tabs,
+        'date': time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+def run_benchmark(calls=500, reruns=10, seed=0):
+    """Run measure() in a new Python process and return its result"""
+    completed = subprocess.run(
+        [sys.executable, __file__, '--measure', '--calls', str(calls), '--reruns', str(reruns), '--seed', str(seed)],
+        capture_output=True, text=True, cwd=Path(__file__).parent
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"El proceso de medición falló:\n{completed.stderr[-2000:]}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def compare(result, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Regressions of result against baseline, as a list of messages"""
+    measured = {'import': result['import'], 'primera ejecución': result['first_run']}
+    expected = {'import': baseline['import'], 'primera ejecución': baseline['first_run']}
+    for name, tab in baseline['tabs'].items():
+        if name not in result['tabs']:
+            continue
+        for key in ('first', 'p50'):
+            label = f"pestaña {name} {'primera' if key == 'first' else key}"
+            measured[label] = result['tabs'][name][key]
+            expected[label] = tab[key]
+    return [
+        f"{label}: {measured[label]:.3f} s (línea base {expected[label]:.3f} s)"
+        for label in measured
+        if measured[label] > expected[label] * (1 + tolerance) + TIME_SLACK
+    ]
+
+def report(result):
+    """Plain-text summary of a result"""
+    lines = [
+        f"Llamadas en el historial: {result['calls']}  reejecuciones por pestaña: {result['reruns']}",
+        f"Import de streamlit: {result['import']:.2f} s",
+        f"Primera ejecución: {result['first_run']:.2f} s",
+        "Librerías pesadas que esperó la primera ejecución: " + (", ".join(result['heavy_modules']) or "ninguna"),
+        f"{'pestaña':<12}{'primera (s)':>12}{'p50 (s)':>10}{'p95 (s)':>10}",
+    ]
+    for name, tab in result['tabs'].items():
+        lines.append(f"{name:<12}{tab['first']:>12.3f}{tab['p50']:>10.3f}{tab['p95']:>10.3f}")
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mide el arranque y las reejecuciones de la aplicación.")
+    parser.add_argument('--calls', type=int, default=500, help="llamadas sintéticas en el historial")
+    parser.add_argument('--reruns', type=int, default=10, help="reejecuciones medidas por pestaña")
+    parser.add_argument('--seed', type=int, default=0, help="semilla de las llamadas sintéticas")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="empeoramiento relativo permitido frente a la línea base")
+    parser.add_argument('--baseline', default=BASELINE_PATH, help="archivo JSON de la línea base")
+    parser.add_argument('--update-baseline', action='store_true', help="guardar el resultado como línea base")
+    parser.add_argument('--measure', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.measure:
+        print(json.dumps(measure(args.calls, args.reruns, args.seed)))
+        return 0
+
+    result = run_benchmark(args.calls, args.reruns, args.seed)
+    print(report(result))
+
+    if args.update_baseline:
+        Path(args.baseline).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\nLínea base actualizada en {args.baseline}")
+        return 0
+
+    try:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        print("\nNo hay línea base; use --update-baseline para crearla")
+        return 0
+    if baseline['calls'] != result['calls']:
+        print(f"\nLa línea base es de {baseline['calls']} llamadas; no es comparable")
+        return 0
+
+    regressions = compare(result, baseline, args.tolerance)
+    if regressions:
+        print("\n❌ Regresiones frente a la línea base:")
+        for regression in regressions:
+            print(f"  - {regression}")
+        return 1
+    print("\n✅ Sin regresiones frente a la línea base")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
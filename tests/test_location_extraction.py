@@ -0,0 +1,17 @@
+from location_extraction import extract_location, normalize_location
+
+def test_spoken_number_after_space_is_not_a_plate():
+    assert extract_location("Estoy en la calle 10 tres personas heridas") == "calle 10"
+
+def test_spoken_plate_after_separator():
+    location = extract_location("carrera siete número cuarenta y cinco doce")
+
+    assert normalize_location(location) == "carrera 7 45 12"
+
+def test_spoken_street_after_con():
+    location = extract_location("calle cuarenta y cinco con carrera siete")
+
+    assert normalize_location(location) == "calle 45 7"
+
+def test_digit_plate_without_separator():
+    assert normalize_location(extract_location("kr 7 45 12 dos heridos")) == "carrera 7 45 12"
@@ -0,0 +1,34 @@
+from triage_rules import classify, keyword_spans, reconcile
+
+def llm_result(severity, justificacion="Según el LLM"):
+    return {
+        'emocion': 'CALMA',
+        'icono_emocion': '🟢',
+        'palabras_criticas': [],
+        'severidad_general': severity,
+        'tipo_emergencia': 'Otro',
+        'justificacion': justificacion
+    }
+
+def test_llm_severity_stands_without_critical_words():
+    provisional = classify("Buenas tardes, hay un semáforo dañado en la esquina")
+    assert provisional['palabras_criticas'] == []
+
+    merged = reconcile(provisional, llm_result('Bajo'))
+
+    assert merged['severidad_general'] == 'Bajo'
+    assert merged['justificacion'] == "Según el LLM"
+
+def test_critical_words_raise_llm_severity():
+    provisional = classify("Hay un incendio y un herido con mucha sangre")
+
+    merged = reconcile(provisional, llm_result('Bajo'))
+
+    assert merged['severidad_general'] == 'Crítico'
+    assert "elevada de Bajo a Crítico por palabras críticas detectadas" in merged['justificacion']
+
+def test_highlight_matches_whole_words_only():
+    text = "El arma estaba en el armario"
+    palabras = [{'palabra': 'arma', 'severidad': 'ALTA'}]
+
+    assert keyword_spans(text, palabras) == [(3, 7, 'ALTA')]
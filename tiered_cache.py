@@ -0,0 +1,103 @@
+"""Content-addressed cache with an in-memory LRU tier and an on-disk tier.
+
+Values must be JSON-serializable. Keys are built with content_key() from
+everything that determines the value (for example transcript, prompt
+version and model), so a changed input never hits a stale entry. An
+optional TTL expires entries whose source can change over time.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+def content_key(*parts):
+    """SHA-256 hex digest identifying the given parts"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+class TieredCache:
+    """LRU dictionary backed by one JSON file per entry on disk"""
+
+    def __init__(self, disk_dir=None, max_entries=256, max_disk_entries=10000, ttl=None):
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_writes = 0
+
+    def _path(self, key):
+        return self.disk_dir / key[:2] / f"{key}.json"
+
+    def _fresh(self, stored_at):
+        return self.ttl is None or time.time() - stored_at < self.ttl
+
+    def get(self, key):
+        """Cached value for key, or None if missing or expired"""
+        with self._lock:
+            if key in self._memory:
+                stored_at, value = self._memory[key]
+                if self._fresh(stored_at):
+                    self._memory.move_to_end(key)
+                    return value
+                del self._memory[key]
+
+        if not self.disk_dir:
+            return None
+        try:
+            entry = json.loads(self._path(key).read_text(encoding='utf-8'))
+            stored_at, value = entry['stored_at'], entry['value']
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        if not self._fresh(stored_at):
+            return None
+
+        self._remember(key, value, stored_at)
+        return value
+
+    def put(self, key, value):
+        stored_at = time.time()
+        self._remember(key, value, stored_at)
+        if not self.disk_dir:
+            return
+
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Write then rename so readers never see a partial file
+            tmp = path.with_suffix(f".{threading.get_ident()}.tmp")
+            tmp.write_text(json.dumps({'stored_at': stored_at, 'value': value}, ensure_ascii=False), encoding='utf-8')
+            os.replace(tmp, path)
+        except OSError:
+            return
+
+        with self._lock:
+            self._disk_writes += 1
+            prune = self._disk_writes % 100 == 0
+        if prune:
+            self.prune_disk()
+
+    def _remember(self, key, value, stored_at):
+        with self._lock:
+            self._memory[key] = (stored_at, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def prune_disk(self):
+        """Delete the least recently written disk entries beyond max_disk_entries"""
+        if not self.disk_dir or not self.disk_dir.exists():
+            return
+        entries = sorted(self.disk_dir.glob('*/*.json'), key=lambda p: p.stat().st_mtime)
+        for path in entries[:max(len(entries) - self.max_disk_entries, 0)]:
+            try:
+                path.unlink()
+            except OSError:
+                pass
@@ -0,0 +1,200 @@
+"""Transcription backends.
+
+The backend is chosen with the TRANSCRIPTION_BACKEND environment variable:
+
+* assemblyai (default) uploads the recording to AssemblyAI and waits for
+  the transcript (see audio_upload.py and transcription_wait.py).
+* local runs a Whisper model with CTranslate2 (faster-whisper) on this
+  machine, with int8 weights, in a pool of worker processes. Each worker
+  loads the model once and reuses it; voice activity detection skips the
+  silence before decoding. It needs no network and no API key, so calls
+  keep being transcribed during an internet outage, and throughput grows
+  with the number of cores. Settings: LOCAL_WHISPER_MODEL (default
+  small), LOCAL_WHISPER_WORKERS and LOCAL_WHISPER_THREADS (CPU threads per
+  worker, default 2).
+
+Other backends can be added with register_backend(name, factory).
+"""
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from audio_upload import UploadBody, upload_audio
+from http_client import get_client
+from transcription_wait import (
+    TRANSCRIPTION_DEADLINE,
+    estimate_audio_duration,
+    get_webhook_receiver,
+    wait_for_transcript,
+)
+
+class TranscriptionBackend:
+    """Interface of a transcription backend"""
+
+    # Whether transcribe() needs the AssemblyAI key
+    requires_api_key = False
+
+    def transcribe(self, audio_file, api_key, on_status=None, deadline=TRANSCRIPTION_DEADLINE):
+        """Transcript text of a recording (bytes, path or seekable file).
+
+        on_status, if given, is called with the current status as the
+        transcription progresses. Raises RuntimeError on failure.
+        """
+        raise NotImplementedError
+
+class AssemblyAIBackend(TranscriptionBackend):
+    """AssemblyAI's cloud transcription"""
+
+    requires_api_key = True
+
+    def transcribe(self, audio_file, api_key, on_status=None, deadline=TRANSCRIPTION_DEADLINE):
+        if not api_key:
+            raise RuntimeError("Falta la clave API de AssemblyAI")
+
+        def report(status):
+            if on_status:
+                on_status(status)
+
+        headers = {'authorization': api_key}
+        receiver = get_webhook_receiver()
+        # The shared client keeps connections alive across upload, request and polls
+        client = get_client('assemblyai')
+
+        # Upload audio file, streamed in chunks
+        report('uploading')
+        audio_url = upload_audio(client, api_key, audio_file)
+
+        # Request transcription with Spanish language
+        transcript_request = {
+            'audio_url': audio_url,
+            'language_code': 'es'  # Spanish
+        }
+        if receiver:
+            transcript_request.update(receiver.request_fields())
+
+        transcript_response = client.post('transcript', headers=headers, json=transcript_request)
+
+        if transcript_response.status_code != 200:
+            raise RuntimeError(f"Error en solicitud de transcripción: {transcript_response.text}")
+
+        transcript_id = transcript_response.json()['id']
+        report(transcript_response.json().get('status', 'queued'))
+
+        def fetch(transcript_id):
+            response = client.get(f'transcript/{transcript_id}', headers=headers)
+            if response.status_code != 200:
+                raise RuntimeError(f"Error al consultar transcripción: {response.status_code} {response.text}")
+            return response.json()
+
+        transcript_result = wait_for_transcript(
+            fetch,
+            transcript_id,
+            audio_duration=estimate_audio_duration(audio_file),
+            deadline=deadline,
+            on_status=report,
+            receiver=receiver
+        )
+
+        if transcript_result['status'] == 'error':
+            raise RuntimeError(f"Error en transcripción: {transcript_result.get('error', 'Error desconocido')}")
+
+        return transcript_result['text']
+
+# Model of the current worker process, loaded by _load_model
+_worker_model = None
+
+def _load_model(model_name, cpu_threads):
+    """Process pool initializer: load the model once for this worker"""
+    global _worker_model
+    from faster_whisper import WhisperModel
+    _worker_model = WhisperModel(model_name, device='cpu', compute_type='int8', cpu_threads=cpu_threads)
+
+def _transcribe_in_worker(audio):
+    """Worker body: decode audio (bytes or path) with the loaded model"""
+    segments, _ = _worker_model.transcribe(
+        io.BytesIO(audio) if isinstance(audio, bytes) else audio,
+        language='es',
+        beam_size=1,
+        vad_filter=True,
+        vad_parameters={'min_silence_duration_ms': 500}
+    )
+    return ' '.join(segment.text.strip() for segment in segments)
+
+class LocalWhisperBackend(TranscriptionBackend):
+    """Whisper on local CPUs with CTranslate2 int8, in a process pool"""
+
+    def __init__(self, model_name='small', workers=None, cpu_threads=2):
+        try:
+            import faster_whisper  # noqa: F401
+        except ImportError:
+            raise RuntimeError(
+                "La transcripción local requiere faster-whisper (pip install faster-whisper)"
+            ) from None
+        self.model_name = model_name
+        self.cpu_threads = cpu_threads
+        self.workers = workers or max((os.cpu_count() or 1) // cpu_threads, 1)
+        # spawn: forking a process with Streamlit's threads running is unsafe
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_load_model,
+            initargs=(model_name, cpu_threads)
+        )
+
+    def transcribe(self, audio_file, api_key, on_status=None, deadline=TRANSCRIPTION_DEADLINE):
+        if on_status:
+            on_status('processing')
+        # Paths are opened by the worker; anything else is sent as bytes
+        if isinstance(audio_file, (str, os.PathLike)):
+            audio = os.fspath(audio_file)
+        elif isinstance(audio_file, (bytes, bytearray)):
+            audio = bytes(audio_file)
+        else:
+            audio = b''.join(UploadBody(audio_file))
+
+        future = None
+        try:
+            future = self._pool.submit(_transcribe_in_worker, audio)
+            text = future.result(timeout=deadline)
+        except FutureTimeoutError:
+            future.cancel()
+            raise RuntimeError("Tiempo de espera agotado en la transcripción local") from None
+        except Exception as e:
+            raise RuntimeError(f"Error en transcripción local: {e}") from e
+
+        if on_status:
+            on_status('completed')
+        return text
+
+def _local_backend():
+    workers = os.environ.get('LOCAL_WHISPER_WORKERS')
+    return LocalWhisperBackend(
+        model_name=os.environ.get('LOCAL_WHISPER_MODEL', 'small'),
+        workers=int(workers) if workers else None,
+        cpu_threads=int(os.environ.get('LOCAL_WHISPER_THREADS', 2))
+    )
+
+_backend_factories = {
+    'assemblyai': AssemblyAIBackend,
+    'local': _local_backend,
+}
+_backend = None
+_backend_lock = threading.Lock()
+
+def register_backend(name, factory):
+    """Make TRANSCRIPTION_BACKEND=<name> use factory()"""
+    _backend_factories[name] = factory
+
+def get_transcription_backend():
+    """Process-wide backend configured by TRANSCRIPTION_BACKEND"""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            name = os.environ.get('TRANSCRIPTION_BACKEND', 'assemblyai')
+            if name not in _backend_factories:
+                raise ValueError(f"Motor de transcripción desconocido: {name}")
+            _backend = _backend_factories[name]()
+        return _backend
@@ -0,0 +1,300 @@
+"""Waiting for AssemblyAI transcripts to complete.
+
+Two strategies, both bounded by an overall deadline:
+
+* Adaptive polling: the first poll happens after half a second and the
+  interval then grows exponentially up to a ceiling proportional to the
+  audio duration, so short calls return quickly and long ones do not
+  hammer the API.
+* Webhook: AssemblyAI posts to a small local receiver when the transcript
+  is ready. A slow poll keeps running as a safety net in case a webhook
+  is lost.
+
+The webhook mode is enabled by setting ASSEMBLYAI_WEBHOOK_URL to the public
+URL that reaches the receiver (and optionally ASSEMBLYAI_WEBHOOK_PORT for
+the local port it listens on, 8765 by default).
+
+AssemblyAI posts to a single URL, so one process per machine serves the
+receiver: the first to call get_webhook_receiver(), which the app and
+job_queue.py do before starting their worker processes. It records every
+webhook in a small SQLite database (ASSEMBLYAI_WEBHOOK_SIGNALS, default
+.data/webhooks.db) together with the shared secret, and the other
+processes wait on that database (WebhookSignals) instead of binding the
+port themselves.
+"""
+import io
+import itertools
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# Overall time (seconds) to wait for a transcript before giving up
+TRANSCRIPTION_DEADLINE = 300
+
+FIRST_POLL = 0.5
+BACKOFF_FACTOR = 1.5
+# The polling ceiling is this fraction of the audio duration, within bounds
+POLL_CEILING_RATIO = 0.05
+MIN_POLL_CEILING = 1.0
+MAX_POLL_CEILING = 10.0
+# Ceiling used when the audio duration is unknown
+DEFAULT_POLL_CEILING = 5.0
+# Safety poll interval while waiting for a webhook
+WEBHOOK_SAFETY_POLL = 15.0
+
+WEBHOOK_AUTH_HEADER = 'X-Webhook-Token'
+DEFAULT_SIGNALS_PATH = Path(__file__).parent / '.data' / 'webhooks.db'
+# How often a process without the receiver checks for its webhook
+WEBHOOK_SIGNAL_POLL = 0.25
+# Webhooks nobody waited for are dropped after this long
+WEBHOOK_SIGNAL_RETENTION = 3600
+
+def estimate_audio_duration(audio_file):
+    """Rough duration in seconds of a recording (bytes, path or seekable file), or None if unknown"""
+    position = None
+    if isinstance(audio_file, (bytes, bytearray)):
+        wav_source, size = io.BytesIO(audio_file), len(audio_file)
+    elif isinstance(audio_file, (str, Path)):
+        wav_source, size = str(audio_file), os.path.getsize(audio_file)
+    elif hasattr(audio_file, 'seek'):
+        position = audio_file.tell()
+        wav_source, size = audio_file, audio_file.seek(0, os.SEEK_END) - position
+        audio_file.seek(position)
+    else:
+        return None
+
+    try:
+        with wave.open(wav_source) as wav:
+            return wav.getnframes() / wav.getframerate()
+    except (wave.Error, EOFError):
+        pass
+    finally:
+        if position is not None:
+            audio_file.seek(position)
+
+    # Compressed formats: assume about 128 kbit/s
+    return size / 16000
+
+def poll_intervals(audio_duration=None):
+    """Exponentially growing poll intervals, capped according to the audio duration"""
+    if audio_duration is None:
+        ceiling = DEFAULT_POLL_CEILING
+    else:
+        ceiling = min(max(audio_duration * POLL_CEILING_RATIO, MIN_POLL_CEILING), MAX_POLL_CEILING)
+
+    interval = min(FIRST_POLL, ceiling)
+    while True:
+        yield interval
+        interval = min(interval * BACKOFF_FACTOR, ceiling)
+
+def wait_for_transcript(fetch, transcript_id, audio_duration=None, deadline=TRANSCRIPTION_DEADLINE,
+                        on_status=None, receiver=None):
+    """Wait until a transcript is completed or failed and return its JSON.
+
+    fetch(transcript_id) must return the transcript resource. If a
+    WebhookReceiver is given, its notifications wake the wait early and
+    polling only runs at WEBHOOK_SAFETY_POLL. Raises TimeoutError once the
+    deadline passes.
+    """
+    give_up = time.monotonic() + deadline
+    if receiver:
+        intervals = itertools.repeat(WEBHOOK_SAFETY_POLL)
+    else:
+        intervals = poll_intervals(audio_duration)
+
+    try:
+        while True:
+            remaining = give_up - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"La transcripción no terminó en {deadline} s")
+
+            wait = min(next(intervals), remaining)
+            if receiver:
+                receiver.wait(transcript_id, wait)
+            else:
+                time.sleep(wait)
+
+            result = fetch(transcript_id)
+            if on_status:
+                on_status(result['status'])
+            if result['status'] in ('completed', 'error'):
+                return result
+    finally:
+        if receiver:
+            receiver.forget(transcript_id)
+
+def _request_fields(public_url, secret):
+    """Extra transcript request fields so AssemblyAI calls the receiver"""
+    return {
+        'webhook_url': public_url,
+        'webhook_auth_header_name': WEBHOOK_AUTH_HEADER,
+        'webhook_auth_header_value': secret
+    }
+
+class WebhookSignals:
+    """Webhooks received by another process of this machine, shared through SQLite"""
+
+    def __init__(self, path, public_url=None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.public_url = public_url
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS webhooks (
+                    transcript_id TEXT PRIMARY KEY,
+                    received_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS webhook_secret (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    secret TEXT NOT NULL
+                );
+            """)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def secret(self):
+        """Secret shared by every process, created on first use"""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO webhook_secret (id, secret) VALUES (0, ?)", (secrets.token_urlsafe(16),)
+            )
+            return conn.execute("SELECT secret FROM webhook_secret").fetchone()[0]
+
+    def request_fields(self):
+        return _request_fields(self.public_url, self.secret())
+
+    def notify(self, transcript_id):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO webhooks VALUES (?, ?)", (transcript_id, now))
+            conn.execute("DELETE FROM webhooks WHERE received_at < ?", (now - WEBHOOK_SIGNAL_RETENTION,))
+
+    def wait(self, transcript_id, timeout):
+        """Block until the webhook for transcript_id is recorded or timeout elapses"""
+        give_up = time.monotonic() + timeout
+        while True:
+            with self._connect() as conn:
+                # Consume the signal, so the next wait blocks until another webhook
+                if conn.execute("DELETE FROM webhooks WHERE transcript_id = ?", (transcript_id,)).rowcount:
+                    return True
+            remaining = give_up - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(WEBHOOK_SIGNAL_POLL, remaining))
+
+    def forget(self, transcript_id):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM webhooks WHERE transcript_id = ?", (transcript_id,))
+
+class WebhookReceiver:
+    """Local HTTP server that records AssemblyAI completion webhooks, and
+    shares them through signals (a WebhookSignals) if given"""
+
+    def __init__(self, public_url, host='0.0.0.0', port=8765, secret=None, signals=None):
+        self.public_url = public_url
+        self.signals = signals
+        self.secret = secret or (signals.secret() if signals else secrets.token_urlsafe(16))
+        self._events = {}
+        self._lock = threading.Lock()
+
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.headers.get(WEBHOOK_AUTH_HEADER) != receiver.secret:
+                    self.send_response(401)
+                    self.end_headers()
+                    return
+
+                try:
+                    length = int(self.headers.get('Content-Length', 0))
+                    payload = json.loads(self.rfile.read(length))
+                    transcript_id = payload['transcript_id']
+                except (ValueError, KeyError, TypeError):
+                    self.send_response(400)
+                    self.end_headers()
+                    return
+
+                receiver.notify(transcript_id)
+                self.send_response(200)
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="webhook", daemon=True)
+        self._thread.start()
+
+    def request_fields(self):
+        return _request_fields(self.public_url, self.secret)
+
+    def notify(self, transcript_id):
+        if self.signals:
+            self.signals.notify(transcript_id)
+        # Only wake local waiters; webhooks for other transcripts leave nothing behind
+        with self._lock:
+            event = self._events.get(transcript_id)
+        if event:
+            event.set()
+
+    def wait(self, transcript_id, timeout):
+        """Block until a webhook for transcript_id arrives or timeout elapses.
+
+        The first call registers transcript_id until forget(), so webhooks
+        arriving between two waits are not lost.
+        """
+        with self._lock:
+            event = self._events.setdefault(transcript_id, threading.Event())
+        woken = event.wait(timeout)
+        event.clear()
+        return woken
+
+    def forget(self, transcript_id):
+        with self._lock:
+            self._events.pop(transcript_id, None)
+        if self.signals:
+            self.signals.forget(transcript_id)
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+_receiver = None
+_receiver_lock = threading.Lock()
+
+def get_webhook_receiver():
+    """Process-wide receiver if ASSEMBLYAI_WEBHOOK_URL is set, otherwise None.
+
+    The first process to call it serves the port; in the others it returns
+    the WebhookSignals the serving process shares its webhooks through.
+    """
+    global _receiver
+    public_url = os.environ.get('ASSEMBLYAI_WEBHOOK_URL')
+    if not public_url:
+        return None
+
+    with _receiver_lock:
+        if _receiver is None:
+            port = int(os.environ.get('ASSEMBLYAI_WEBHOOK_PORT', 8765))
+            signals = WebhookSignals(os.environ.get('ASSEMBLYAI_WEBHOOK_SIGNALS', DEFAULT_SIGNALS_PATH), public_url)
+            try:
+                _receiver = WebhookReceiver(public_url, port=port, signals=signals)
+            except OSError:
+                # Another process already listens on the port
+                _receiver = signals
+        return _receiver
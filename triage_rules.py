@@ -0,0 +1,191 @@
+"""Rule-based triage that runs before, and as a fallback for, the LLM.
+
+The keyword families from the LLM prompt are compiled into one regular
+expression over accent-folded, lowercased text, with inflected forms
+(plurals, gender, verb forms) written into each entry. A single scan
+yields the critical words with their positions in the original text, and
+from them a provisional severity, emergency type and stress level in the
+same format as analyze_transcript_with_llm, so it can be shown before
+the LLM answers and reconciled with it afterwards.
+"""
+import re
+import unicodedata
+from functools import lru_cache
+
+SEVERITY_ORDER = {'Crítico': 0, 'Alto': 1, 'Medio': 2, 'Bajo': 3}
+
+# category: (keyword severity, emergency type, patterns over folded text)
+LEXICON = {
+    'armas': ('ALTA', 'Policía', [
+        r'pistolas?', r'armas?', r'armad[oa]s?', r'revolver(es)?', r'cuchill(o|os|ada|adas)',
+        r'machetes?', r'navajas?', r'dispar\w*', r'balaz\w*', r'baleado\w*', r'tiros?'
+    ]),
+    'médico': ('ALTA', 'Médica', [
+        r'sangr\w*', r'inconscientes?', r'infart\w*', r'no respira\w*', r'convulsion(es|a|ando)?',
+        r'desmay\w*', r'herid[oa]s?', r'ataque cardiaco', r'no reacciona'
+    ]),
+    'fuego': ('ALTA', 'Incendio', [
+        r'incendi\w*', r'humo', r'explosi(on|ones)', r'explot\w*', r'fuego', r'llamas',
+        r'quemand\w*', r'olor a gas'
+    ]),
+    'violencia': ('ALTA', 'Policía', [
+        r'asalt\w*', r'secuestr\w*', r'golpe\w*', r'atrac\w*', r'violaci(on|ones)',
+        r'amenaz\w*', r'pelea\w*'
+    ]),
+    'vulnerable': ('MEDIA', None, [
+        r'nin[oa]s?', r'bebes?', r'ancian[oa]s?', r'embarazad[oa]s?', r'menor(es)? de edad'
+    ]),
+}
+
+# Phrases that suggest the caller is under stress
+STRESS_MARKERS = [
+    r'ayuda', r'auxilio', r'rapido', r'urgente', r'por favor', r'se (esta )?muere\w*',
+    r'apurense', r'dios mio'
+]
+
+@lru_cache(maxsize=1024)
+def _fold_char(c):
+    return unicodedata.normalize('NFKD', c.lower())[:1] or c
+
+def fold(text):
+    """Lowercase and strip accents, keeping one character per input character"""
+    if text.isascii():
+        return text.lower()
+    return ''.join(map(_fold_char, text))
+
+def _compile():
+    alternatives = []
+    groups = {}
+    for categoria, (_, _, patterns) in LEXICON.items():
+        for pattern in patterns:
+            name = f'k{len(groups)}'
+            groups[name] = categoria
+            alternatives.append(f'(?P<{name}>{pattern})')
+    return re.compile(r'\b(?:' + '|'.join(alternatives) + r')\b'), groups
+
+_keyword_pattern, _keyword_groups = _compile()
+_stress_pattern = re.compile(r'\b(?:' + '|'.join(STRESS_MARKERS) + r')\b')
+
+def find_keywords(text, folded=None):
+    """Critical words in text, in the palabras_criticas format plus their span"""
+    found = {}
+    for match in _keyword_pattern.finditer(folded or fold(text)):
+        term = match.group(0)
+        if term in found:
+            continue
+        categoria = _keyword_groups[match.lastgroup]
+        found[term] = {
+            'categoria': categoria,
+            'palabra': text[match.start():match.end()],
+            'severidad': LEXICON[categoria][0],
+            'inicio': match.start(),
+            'fin': match.end()
+        }
+    return list(found.values())
+
+KEYWORD_SEVERITY_RANK = {'ALTA': 0, 'MEDIA': 1}
+
+@lru_cache(maxsize=256)
+def _highlight_pattern(terms):
+    """One alternation over folded words, most severe and then longest first"""
+    ordered = sorted(terms, key=lambda term: (KEYWORD_SEVERITY_RANK.get(term[1], 2), -len(term[0])))
+    return re.compile(r'\b(?:' + '|'.join(re.escape(word) for word, _ in ordered) + r')\b')
+
+def keyword_spans(text, palabras_criticas, folded=None):
+    """Non-overlapping (inicio, fin, severidad) spans of the given critical words in text.
+
+    The words are matched accent- and case-insensitively in a single scan;
+    where two could match at the same place the more severe one wins.
+    """
+    severities = {}
+    for item in palabras_criticas:
+        word = fold(item.get('palabra', '').strip())
+        severidad = item.get('severidad', 'MEDIA')
+        if word and KEYWORD_SEVERITY_RANK.get(severidad, 2) < KEYWORD_SEVERITY_RANK.get(severities.get(word), 3):
+            severities[word] = severidad
+    if not severities:
+        return []
+
+    pattern = _highlight_pattern(tuple(sorted(severities.items())))
+    return [
+        (match.start(), match.end(), severities[match.group(0)])
+        for match in pattern.finditer(folded or fold(text))
+    ]
+
+def severity_for(palabras_criticas):
+    """Severity implied by a set of critical words"""
+    alta = {item['categoria'] for item in palabras_criticas if item.get('severidad') == 'ALTA'}
+    vulnerable = any(item.get('categoria') == 'vulnerable' for item in palabras_criticas)
+    if len(alta) >= 2 or (alta and vulnerable):
+        return 'Crítico'
+    if alta:
+        return 'Alto'
+    # Without clear signals keep the same default as when the LLM fails
+    return 'Medio'
+
+def type_for(palabras_criticas):
+    """Emergency type of the first critical word that implies one"""
+    for item in palabras_criticas:
+        emergency_type = LEXICON.get(item.get('categoria'), (None, None))[1]
+        if emergency_type:
+            return emergency_type
+    return 'Otro'
+
+def classify(text):
+    """Provisional analysis of a transcript, in the same format as the LLM's"""
+    folded = fold(text)
+    palabras_criticas = find_keywords(text, folded)
+    stress = len(_stress_pattern.findall(folded)) + text.count('!')
+    if stress >= 2:
+        emocion, icono = 'ESTRÉS ALTO', '🔴'
+    elif stress == 1:
+        emocion, icono = 'ESTRÉS MODERADO', '🟡'
+    else:
+        emocion, icono = 'CALMA', '🟢'
+
+    if palabras_criticas:
+        categorias = sorted({item['categoria'] for item in palabras_criticas})
+        justificacion = f"Clasificación preliminar por palabras clave: {', '.join(categorias)}"
+    else:
+        justificacion = "Clasificación preliminar: no se detectaron palabras críticas"
+
+    return {
+        'emocion': emocion,
+        'icono_emocion': icono,
+        'palabras_criticas': palabras_criticas,
+        'severidad_general': severity_for(palabras_criticas),
+        'tipo_emergencia': type_for(palabras_criticas),
+        'justificacion': justificacion
+    }
+
+def reconcile(provisional, llm_analysis):
+    """Combine the rule-based analysis with the LLM's once it arrives.
+
+    The LLM result is preferred, but the severity is never lowered below
+    what the critical words imply (without any, the LLM's severity stands)
+    and words the LLM missed are kept. If the LLM failed the provisional
+    analysis is used as the fallback.
+    """
+    if not llm_analysis:
+        return dict(provisional, justificacion=provisional['justificacion'] + " (análisis LLM no disponible)")
+
+    merged = dict(llm_analysis)
+    llm_words = merged.get('palabras_criticas') or []
+    seen = {fold(item.get('palabra', '')) for item in llm_words}
+    merged['palabras_criticas'] = llm_words + [
+        item for item in provisional['palabras_criticas'] if fold(item['palabra']) not in seen
+    ]
+
+    llm_severity = merged.get('severidad_general', 'Medio')
+    rule_severity = provisional['severidad_general']
+    # The rule severity without critical words is only a default, not a floor
+    if provisional['palabras_criticas'] and SEVERITY_ORDER.get(rule_severity, 4) < SEVERITY_ORDER.get(llm_severity, 4):
+        merged['severidad_general'] = rule_severity
+        merged['justificacion'] = (
+            f"{merged.get('justificacion', '')} (elevada de {llm_severity} a {rule_severity} "
+            f"por palabras críticas detectadas)"
+        ).strip()
+
+    if merged.get('tipo_emergencia', 'Otro') == 'Otro':
+        merged['tipo_emergencia'] = provisional['tipo_emergencia']
+    return merged